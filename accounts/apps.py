@@ -7,3 +7,6 @@ class UsersConfig(AppConfig):
 
     def ready(self):
         import accounts.signals
+        from accounts.caches import warn_about_local_caches
+
+        warn_about_local_caches()
@@ -0,0 +1,158 @@
+"""
+Native async versions of the MFA login views for ASGI deployments.
+
+They behave like their counterparts in ``accounts.views`` and are routed
+instead of them when ``ASYNC_LOGIN_VIEWS`` is on. Database access goes
+through the async ORM, descriptor comparison runs on the bounded pool in
+``mfa.executor``, and the handoff and rate-limit checks stay inline since
+they only touch in-memory caches. Under ASGI, a sync view instead holds a
+worker thread for the whole request.
+"""
+import json
+
+from django.contrib import messages
+from django.contrib.auth import alogin
+from django.contrib.auth.models import User
+from django.http import JsonResponse
+from django.shortcuts import redirect, render
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+
+from accounts.handoff import claim_handoff, clear_handoff
+from accounts.metrics import MATCH_DISTANCE, time_phase
+from accounts.models import Profile
+from accounts.ratelimit import rate_limit
+from accounts.views import (
+    alogin_mfa_profile, log_failed_login_attempt, login_user_queryset, read_face_frames, require_temp_auth,
+    verify_face,
+)
+from audit.pipeline import record_event
+from mfa.executor import run_cpu_bound
+from mfa.identification import aget_face_descriptor
+from mfa.liveness import BurstError
+from mfa.models import MFAProfile
+
+
+@require_temp_auth
+async def mfa_selection(request):
+    try:
+        mfa_fields = ('mfaprofile__has_face', 'mfaprofile__has_fingerprint')
+        with time_phase('mfa-selection', 'db_lookup'):
+            user = await login_user_queryset(
+                'profile__first_name', 'profile__last_name', *mfa_fields
+            ).select_related('profile').aget(pk=request.mfa_handoff['uid'])
+            try:
+                mfa_profile = await alogin_mfa_profile(user, *mfa_fields)
+            except MFAProfile.DoesNotExist:
+                mfa_profile, created = await MFAProfile.objects.for_user(user).aget_or_create(user=user)
+        if not mfa_profile.has_fingerprint and not mfa_profile.has_face:
+            if not claim_handoff(request):
+                messages.error(request, 'Please log in first.')
+                return clear_handoff(redirect(reverse('login')))
+            user.backend = 'allauth.account.auth_backends.AuthenticationBackend'
+            await alogin(request, user)
+            messages.warning(request, "Please set up MFA for enhanced security")
+            return clear_handoff(redirect(reverse('profile-home')))
+
+        context = {
+            'profile_first_name': user.profile.first_name,
+            'profile_last_name': user.profile.last_name,
+            'mfa_options': {
+                'fingerprint': mfa_profile.has_fingerprint,
+                'face_id': mfa_profile.has_face,
+            }
+        }
+        with time_phase('mfa-selection', 'render'):
+            return render(request, 'account/mfa-selection.html', context)
+    except (User.DoesNotExist, MFAProfile.DoesNotExist, Profile.DoesNotExist):
+        messages.error(request, 'User or MFA profile not found')
+        return redirect(reverse('login'))
+
+
+@csrf_exempt
+@require_temp_auth
+@rate_limit()
+async def face_login(request):
+    if request.method != "POST":
+        return render(request, 'account/face-login.html')
+
+    try:
+        data = json.loads(request.body)
+        # Scoring a burst is a few small array operations, cheaper than a pool handoff
+        with time_phase('face-login', 'liveness'):
+            input_frames, liveness = read_face_frames(data)
+    except (json.JSONDecodeError, AttributeError):
+        return JsonResponse({"status": "error", "message": "Invalid JSON data"}, status=400)
+    except BurstError as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=400)
+    except (TypeError, ValueError) as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=500)
+    if input_frames is None:
+        return JsonResponse({"status": "error", "message": "Missing face data"}, status=400)
+    if liveness is not None and not liveness.live:
+        handoff = request.mfa_handoff
+        record_event('face', 'failure', request=request, user=handoff['uid'], email=handoff['email'], reason=liveness.reason)
+        return JsonResponse({
+            "status": "error",
+            "message": "Live face check failed",
+            "reason": liveness.reason
+        }, status=401)
+
+    try:
+        mfa_fields = ('mfaprofile__has_face', 'mfaprofile__face_dim')
+        # The user comes from the signed handoff, never from the request body
+        with time_phase('face-login', 'db_lookup'):
+            user = await login_user_queryset(*mfa_fields).aget(pk=request.mfa_handoff['uid'])
+            mfa_profile = await alogin_mfa_profile(user, *mfa_fields)
+        if not mfa_profile.has_face:
+            return JsonResponse({"status": "error", "message": "Face ID not set up for this user"}, status=400)
+
+        if input_frames.ndim != 2 or input_frames.shape[1] != mfa_profile.face_dim:
+            return JsonResponse({"status": "error", "message": "Invalid face descriptor"}, status=400)
+        with time_phase('face-login', 'descriptor_load'):
+            stored_face_array = await aget_face_descriptor(user.pk)
+        if stored_face_array is None or stored_face_array.shape != input_frames.shape[1:]:
+            return JsonResponse({"status": "error", "message": "Invalid face descriptor"}, status=400)
+
+        # Includes waiting for a pool worker, which is what the request pays
+        with time_phase('face-login', 'distance'):
+            matched, distance, live = await run_cpu_bound(verify_face, stored_face_array, input_frames, liveness)
+        MATCH_DISTANCE.observe(distance, view='face-login')
+        if not matched:
+            log_failed_login_attempt(user, 'face_id', request)
+            return JsonResponse({"status": "error", "message": "Face verification failed"}, status=401)
+        if not live:
+            record_event('face', 'failure', request=request, user=user, reason='not_live')
+            return JsonResponse({"status": "error", "message": "Live face check failed"}, status=401)
+        if not claim_handoff(request):
+            return clear_handoff(JsonResponse({
+                "status": "error",
+                "message": "This login was already completed"
+            }, status=401))
+
+        user.backend = 'allauth.account.auth_backends.AuthenticationBackend'
+        await alogin(request, user)
+        record_event('face', 'success', request=request, user=user)
+        messages.success(request, "Face Authentication Successful")
+        return clear_handoff(JsonResponse({"status": "success", "redirect_url": reverse('profile-home')}))
+    except User.DoesNotExist:
+        return JsonResponse({"status": "error", "message": "User not found"}, status=404)
+    except MFAProfile.DoesNotExist:
+        return JsonResponse({"status": "error", "message": "MFA profile not found"}, status=404)
+    except Exception as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=500)
+
+
+@require_temp_auth
+@rate_limit(methods=None)
+async def fingerprint_login(request):
+    try:
+        user = await login_user_queryset('mfaprofile__has_fingerprint').aget(pk=request.mfa_handoff['uid'])
+        if not (await alogin_mfa_profile(user, 'mfaprofile__has_fingerprint')).has_fingerprint:
+            messages.error(request, "Fingerprint not set up for this user")
+            return redirect(reverse('mfa-selection'))
+    except (User.DoesNotExist, MFAProfile.DoesNotExist):
+        messages.error(request, "User profile not found")
+        return redirect(reverse('login'))
+
+    return render(request, 'account/fingerprint-login.html')
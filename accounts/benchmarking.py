@@ -0,0 +1,259 @@
+"""
+Synthetic users and timing helpers for the benchmark commands.
+
+``synthetic_population`` draws face descriptors and fingerprint templates,
+``seed_users`` writes them as users with profiles, and
+``throwaway_databases`` gives a command fresh test databases to write them
+into. ``run_hot_paths`` times the per-login building blocks and returns
+plain data that ``find_regressions`` can compare against an earlier run.
+"""
+import json
+import os
+import tempfile
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+import numpy as np
+from cryptography.fernet import Fernet
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from accounts.handoff import HANDOFF_COOKIE, make_handoff_token
+from accounts.loadtest import synthetic_burst
+from accounts.models import Profile
+from accounts.ratelimit import clear_rate_limits
+from accounts.views import FACE_MATCH_THRESHOLD, LIVE_FACE_MIN_VARIATION, match_face
+from audit.pipeline import reset_pipeline
+from fingerprint_service.scanner import TEMPLATE_SIZE
+from fingerprint_service.store import TemplateStore
+from mfa.codec import DTYPES, decode_descriptor, encode_descriptor
+from mfa.models import MFAProfile
+from mfa.routers import biometric_databases
+
+Population = namedtuple('Population', ['descriptors', 'templates'])
+
+# Never the bottleneck of a benchmark
+UNLIMITED_RATES = {'ip': (10**9, 300), 'email': (10**9, 300), 'user': (10**9, 300)}
+
+
+def synthetic_population(count, dim=128, seed=0):
+    """Face descriptors scaled like face-api output and random scanner templates"""
+    rng = np.random.default_rng(seed)
+    descriptors = (rng.standard_normal((count, dim)) * 0.15).astype(np.float32)
+    templates = rng.integers(0, 256, (count, TEMPLATE_SIZE), dtype=np.uint8)
+    return Population(descriptors, templates)
+
+
+def population_email(number, prefix='user'):
+    return f'{prefix}{number}@example.com'
+
+
+def seed_users(population, cipher=None, prefix='user', password=None):
+    """
+    Create one user per descriptor, with a profile and an MFA profile.
+
+    With a cipher, each user's fingerprint template is stored encrypted in
+    ``fingerprint_data`` so the login pages offer both methods. Every user
+    gets the same password (unusable when None), hashed once.
+    """
+    count = len(population.descriptors)
+    hashed = make_password(password)
+    users = User.objects.bulk_create([
+        User(username=population_email(number, prefix), email=population_email(number, prefix), password=hashed)
+        for number in range(count)
+    ])
+    Profile.objects.bulk_create([Profile(user=user) for user in users])
+    profiles = []
+    for user, descriptor, template in zip(users, population.descriptors, population.templates):
+        profile = MFAProfile(user=user, face_data=encode_descriptor(descriptor))
+        if cipher is not None:
+            profile.fingerprint_data = cipher.encrypt(template.tobytes())
+        # bulk_create skips save(), which fills in the capability columns
+        profile.sync_capabilities()
+        profiles.append(profile)
+    for alias in biometric_databases():
+        MFAProfile.objects.using(alias).bulk_create(
+            [profile for profile in profiles if MFAProfile.objects.for_user(profile.user).db == alias]
+        )
+    return users
+
+
+@contextmanager
+def throwaway_databases(on_disk=False):
+    """
+    Swap every configured database for an empty test copy while the block runs.
+
+    SQLite test databases live in shared memory, where concurrent writers
+    from a threaded server fail with "table is locked"; ``on_disk`` puts
+    them in temporary files instead. Audit events recorded meanwhile go to
+    the copies only, never to the audit log file.
+    """
+    aliases = ['default', *[alias for alias in biometric_databases() if alias != 'default']]
+    directory = tempfile.TemporaryDirectory() if on_disk else None
+    old_test_settings = {alias: connections[alias].settings_dict.get('TEST') for alias in aliases}
+    for alias in aliases:
+        if directory and connections[alias].vendor == 'sqlite':
+            connections[alias].settings_dict['TEST'] = dict(
+                old_test_settings[alias] or {}, NAME=os.path.join(directory.name, f'{alias}.sqlite3')
+            )
+    old_names = {
+        alias: connections[alias].creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        for alias in aliases
+    }
+    audit_settings = override_settings(AUDIT_LOG_FILE=None)
+    audit_settings.enable()
+    reset_pipeline()
+    try:
+        yield
+    finally:
+        # Write buffered events while their tables still exist
+        reset_pipeline()
+        audit_settings.disable()
+        clear_rate_limits()
+        for alias, old_name in old_names.items():
+            connections[alias].creation.destroy_test_db(old_name, verbosity=0)
+        if directory:
+            for alias, test_settings in old_test_settings.items():
+                connections[alias].settings_dict['TEST'] = test_settings
+            directory.cleanup()
+
+
+def time_calls(func, iterations, warmup=5):
+    """Seconds taken by each of ``iterations`` calls of func, after a few untimed ones"""
+    for _ in range(min(warmup, iterations)):
+        func()
+    samples = np.empty(iterations)
+    for position in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples[position] = time.perf_counter() - started
+    return samples
+
+
+def summarize(samples, items_per_call=1):
+    """Latency percentiles in microseconds and the throughput they imply"""
+    micros = samples * 1e6
+    return {
+        'iterations': len(samples),
+        'items_per_call': items_per_call,
+        'mean_us': round(float(micros.mean()), 3),
+        'p50_us': round(float(np.percentile(micros, 50)), 3),
+        'p95_us': round(float(np.percentile(micros, 95)), 3),
+        'p99_us': round(float(np.percentile(micros, 99)), 3),
+        'items_per_sec': round(items_per_call / float(samples.mean()), 1),
+    }
+
+
+def cycle(values):
+    """A function returning values[0], values[1], ... and wrapping around"""
+    position = -1
+
+    def next_value():
+        nonlocal position
+        position = (position + 1) % len(values)
+        return values[position]
+    return next_value
+
+
+def codec_cases(population, iterations):
+    descriptors = population.descriptors
+    results = {'codec.encode.float32': summarize(time_calls(lambda: encode_descriptor(descriptors[0]), iterations))}
+    for dtype in DTYPES:
+        blob = encode_descriptor(descriptors[0], dtype=dtype)
+        results[f'codec.decode.{dtype}'] = summarize(time_calls(lambda: decode_descriptor(blob), iterations))
+    return results
+
+
+def distance_cases(population, iterations, batch_size):
+    descriptors = population.descriptors
+    probes = descriptors + np.float32(0.01)
+    batch_size = min(batch_size, len(descriptors))
+    stored, inputs = descriptors[:batch_size], probes[:batch_size]
+
+    def batch():
+        # The vectorized form face_verify_batch uses
+        distances = np.linalg.norm(stored - inputs, axis=1)
+        live = np.std(inputs, axis=1) >= LIVE_FACE_MIN_VARIATION
+        return (distances < FACE_MATCH_THRESHOLD) & live
+
+    return {
+        'distance.single': summarize(time_calls(lambda: match_face(descriptors[0], probes[0]), iterations)),
+        'distance.batch': summarize(time_calls(batch, iterations), items_per_call=batch_size),
+    }
+
+
+def fernet_cases(population, iterations, cipher):
+    template = population.templates[0].tobytes()
+    stored = TemplateStore.encode_token(cipher.encrypt(template))
+    # The same work as TemplateStore.save_template and _read_template, minus SQLite
+    return {
+        'fernet.encrypt': summarize(time_calls(
+            lambda: TemplateStore.encode_token(cipher.encrypt(template)), iterations
+        )),
+        'fernet.decrypt': summarize(time_calls(
+            lambda: np.frombuffer(cipher.decrypt(TemplateStore.decode_token(stored)), dtype=np.uint8), iterations
+        )),
+    }
+
+
+def view_cases(population, users, iterations):
+    """face_login and mfa_selection through the test client, cycling through the users"""
+    client = Client()
+    pairs = list(zip(users, population.descriptors))
+    next_user = cycle(pairs)
+    responses = {'face-login': [], 'mfa-selection': []}
+
+    def face_login():
+        user, descriptor = next_user()
+        client.cookies[HANDOFF_COOKIE] = make_handoff_token(user)
+        response = client.post(
+            reverse('face-login'), json.dumps({'frames': synthetic_burst(descriptor)}), content_type='application/json'
+        )
+        responses['face-login'].append(response.status_code)
+
+    def mfa_selection():
+        user, descriptor = next_user()
+        client.cookies[HANDOFF_COOKIE] = make_handoff_token(user)
+        responses['mfa-selection'].append(client.get(reverse('mfa-selection')).status_code)
+
+    with override_settings(LOGIN_RATE_LIMITS=UNLIMITED_RATES, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        clear_rate_limits()
+        results = {
+            'view.face_login': summarize(time_calls(face_login, iterations)),
+            'view.mfa_selection': summarize(time_calls(mfa_selection, iterations)),
+        }
+    for name, statuses in responses.items():
+        if any(status != 200 for status in statuses):
+            raise RuntimeError(f"{name} answered {sorted(set(statuses))} during the benchmark")
+    return results
+
+
+def run_hot_paths(population, users, iterations=200, batch_size=64, view_iterations=None):
+    """Time every hot path against an already seeded population"""
+    cipher = Fernet(Fernet.generate_key())
+    return {
+        **codec_cases(population, iterations),
+        **distance_cases(population, iterations, batch_size),
+        **fernet_cases(population, iterations, cipher),
+        **view_cases(population, users, view_iterations or iterations),
+    }
+
+
+def find_regressions(results, baseline, tolerance=0.2, metric='p50_us'):
+    """Cases whose ``metric`` grew by more than ``tolerance`` over the baseline's"""
+    regressions = []
+    for name, current in sorted(results.items()):
+        previous = baseline.get(name)
+        if not previous or not previous.get(metric):
+            continue
+        change = current[metric] / previous[metric] - 1
+        if change > tolerance:
+            regressions.append({
+                'case': name, 'baseline': previous[metric], 'current': current[metric], 'change': round(change, 3)
+            })
+    return regressions
@@ -0,0 +1,43 @@
+"""
+Startup check for the caches the login flow relies on being shared.
+
+Rate-limit counters and the set of used MFA handoffs only work across
+worker processes when every worker sees the same cache. Django's
+local-memory backend keeps one copy per process: each worker then allows
+the full rate on its own, and a handoff used on one worker can be replayed
+on another.
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+logger = logging.getLogger(__name__)
+
+# setting naming the cache alias, its default, and what a per-process copy breaks
+SHARED_CACHES = (
+    ('LOGIN_RATE_LIMIT_CACHE', 'default', "each worker process counts login attempts on its own"),
+    ('MFA_HANDOFF_CACHE', 'default', "an MFA handoff used on one worker process can be replayed on another"),
+)
+
+
+def local_memory_caches():
+    """(setting, alias, consequence) for every shared cache that is local to this process"""
+    found = []
+    for setting, default, consequence in SHARED_CACHES:
+        alias = getattr(settings, setting, default)
+        if isinstance(caches[alias], LocMemCache):
+            found.append((setting, alias, consequence))
+    return found
+
+
+def warn_about_local_caches():
+    """Log a warning per shared cache that is local memory, unless DEBUG is on"""
+    if settings.DEBUG:
+        return
+    for setting, alias, consequence in local_memory_caches():
+        logger.warning(
+            "%s points at the local-memory cache %r, so %s. Use Redis or Memcached when running more than one worker.",
+            setting, alias, consequence,
+        )
@@ -0,0 +1,83 @@
+"""
+Signed handoff from the password step to the MFA step.
+
+After a correct password the user gets a short-lived cookie instead of
+session keys. It holds a ``django.core.signing`` token with the user id,
+email and a random nonce, so the MFA views can check it without touching
+the database. The nonce goes into a cache-backed replay set when the
+handoff completes a login, which makes every token single-use.
+"""
+import secrets
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+
+HANDOFF_COOKIE = 'mfa_handoff'
+HANDOFF_SALT = 'accounts.handoff'
+DEFAULT_MAX_AGE = 300
+
+
+def get_max_age():
+    return getattr(settings, 'MFA_HANDOFF_MAX_AGE', DEFAULT_MAX_AGE)
+
+
+def replay_cache():
+    return caches[getattr(settings, 'MFA_HANDOFF_CACHE', 'default')]
+
+
+def replay_key(nonce):
+    return f'mfa_handoff:used:{nonce}'
+
+
+def make_handoff_token(user):
+    return signing.dumps(
+        {'uid': user.pk, 'email': user.email, 'nonce': secrets.token_urlsafe(16)},
+        salt=HANDOFF_SALT,
+    )
+
+
+def issue_handoff(response, user):
+    """Attach a fresh handoff cookie for user to response"""
+    response.set_cookie(
+        HANDOFF_COOKIE,
+        make_handoff_token(user),
+        max_age=get_max_age(),
+        secure=settings.SESSION_COOKIE_SECURE,
+        httponly=True,
+        samesite='Lax',
+    )
+    return response
+
+
+def read_handoff(request):
+    """The verified handoff payload, or None if missing, forged, expired or used"""
+    token = request.COOKIES.get(HANDOFF_COOKIE)
+    if not token:
+        return None
+    try:
+        payload = signing.loads(token, salt=HANDOFF_SALT, max_age=get_max_age())
+    except signing.BadSignature:
+        return None
+    if replay_cache().get(replay_key(payload['nonce'])):
+        return None
+    return payload
+
+
+def claim_handoff(request):
+    """
+    Use up the request's handoff; call before logging the user in.
+
+    Returns False if the token is invalid or another request used it first.
+    cache.add() is atomic, so two concurrent logins with one token cannot
+    both succeed.
+    """
+    payload = getattr(request, 'mfa_handoff', None) or read_handoff(request)
+    if payload is None:
+        return False
+    return replay_cache().add(replay_key(payload['nonce']), True, get_max_age())
+
+
+def clear_handoff(response):
+    response.delete_cookie(HANDOFF_COOKIE, samesite='Lax')
+    return response
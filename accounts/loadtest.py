@@ -0,0 +1,189 @@
+"""
+Virtual users that drive the full MFA login flow over HTTP.
+
+Every login starts as a new visitor with an empty cookie jar, just like a
+browser that has never seen the site:
+
+1. ``login_page``: GET the login form, which sets the CSRF cookie
+2. ``password``: POST the form; a valid password redirects to MFA selection
+   with the signed handoff cookie
+3. ``mfa_selection``: GET the method picker the handoff unlocks
+4. ``face_login``: POST a burst of camera frames of the face as JSON
+
+A wrong-face attempt sends another user's descriptor at step 4 and counts
+as correct when the server rejects it with 401. Only the standard library
+is used, so the generator can run on any machine that can reach the site.
+"""
+import itertools
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+
+import numpy as np
+
+STEPS = ('login_page', 'password', 'mfa_selection', 'face_login')
+
+
+def synthetic_burst(descriptor, count=5, seed=0, jitter=0.01, motion=0.5):
+    """Frames a camera might capture of one face: small descriptor noise, landmarks drifting by ~motion px"""
+    descriptor = np.asarray(descriptor, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    landmarks = rng.uniform(80, 160, size=(68, 2))
+    return [{
+        'descriptor': (descriptor + rng.standard_normal(descriptor.shape) * jitter).tolist(),
+        'score': 0.9,
+        'landmarks': (landmarks + rng.standard_normal(landmarks.shape) * motion).tolist(),
+    } for _ in range(count)]
+
+
+class NoRedirects(urllib.request.HTTPRedirectHandler):
+    """Each step is timed on its own, so redirects are followed by hand"""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class VirtualUser:
+    """One visitor logging in as a given account; make a new one per login"""
+
+    def __init__(self, base_url, paths, timeout=30.0):
+        self.base_url = base_url.rstrip('/')
+        self.paths = paths
+        self.timeout = timeout
+        self.cookies = CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies), NoRedirects)
+
+    def cookie(self, name):
+        return next((cookie.value for cookie in self.cookies if cookie.name == name), None)
+
+    def request(self, path, data=None, headers=None):
+        """Return (status, headers, body); HTTP error statuses are results, not exceptions"""
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers or {})
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as error:
+            with error:
+                return error.code, error.headers, error.read()
+
+    def login(self, email, password, descriptor, expect_match=True):
+        """
+        Run the four steps, stopping at the first one that goes wrong.
+
+        Returns one ``(step, seconds, ok)`` tuple per step attempted.
+        """
+        samples = []
+
+        def step(name, path, check, data=None, headers=None):
+            started = time.perf_counter()
+            try:
+                status, response_headers, body = self.request(path, data, headers)
+                ok = check(status, response_headers, body)
+            except OSError:
+                ok = False
+            samples.append((name, time.perf_counter() - started, ok))
+            return ok
+
+        if not step('login_page', self.paths['login'], lambda status, headers, body: status == 200):
+            return samples
+
+        token = self.cookie('csrftoken')
+        form = urllib.parse.urlencode({'login': email, 'password': password, 'csrfmiddlewaretoken': token or ''})
+        redirected_to_mfa = (
+            lambda status, headers, body: status == 302 and headers.get('Location', '').endswith(self.paths['mfa_selection'])
+        )
+        if not step('password', self.paths['login'], redirected_to_mfa, form.encode(), {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Referer': self.base_url + self.paths['login'],
+        }):
+            return samples
+
+        if not step('mfa_selection', self.paths['mfa_selection'], lambda status, headers, body: status == 200):
+            return samples
+
+        def face_result(status, headers, body):
+            try:
+                reply = json.loads(body)
+            except ValueError:
+                return False
+            if expect_match:
+                return status == 200 and reply.get('status') == 'success'
+            return status == 401 and reply.get('message') == 'Face verification failed'
+
+        payload = json.dumps({'frames': synthetic_burst(descriptor)}).encode()
+        step('face_login', self.paths['face_login'], face_result, payload, {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': token or '',
+        })
+        return samples
+
+
+def run_load(base_url, paths, accounts, logins, concurrency, wrong_face_ratio=0.0, seed=0, timeout=30.0):
+    """
+    Run ``logins`` logins from ``concurrency`` threads over ``accounts``.
+
+    ``accounts`` is a list of ``(email, password, descriptor)``. Returns the
+    per-login records and the wall-clock seconds taken.
+    """
+    numbers = itertools.count()
+    numbers_lock = threading.Lock()
+    records = []
+
+    def worker(worker_id):
+        rng = random.Random(seed * 100_003 + worker_id)
+        while True:
+            with numbers_lock:
+                number = next(numbers)
+            if number >= logins:
+                return
+            email, password, descriptor = accounts[number % len(accounts)]
+            # With one account there is no other face to present
+            wrong_face = rng.random() < wrong_face_ratio and len(accounts) > 1
+            if wrong_face:
+                descriptor = accounts[(number + 1) % len(accounts)][2]
+            samples = VirtualUser(base_url, paths, timeout).login(email, password, descriptor, expect_match=not wrong_face)
+            records.append({'wrong_face': wrong_face, 'samples': samples})
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='virtual-user') as executor:
+        for future in [executor.submit(worker, worker_id) for worker_id in range(concurrency)]:
+            future.result()
+    return records, time.perf_counter() - started
+
+
+def summarize_load(records, elapsed):
+    """Throughput and per-step latency percentiles (milliseconds) as plain data"""
+    completed = [record for record in records if len(record['samples']) == len(STEPS) and record['samples'][-1][2]]
+    wrong = [record for record in records if record['wrong_face']]
+    report = {
+        'logins': len(records),
+        'completed': len(completed),
+        'failed': len(records) - len(completed),
+        'seconds': round(elapsed, 3),
+        'logins_per_sec': round(len(records) / elapsed, 2) if elapsed else None,
+        'wrong_face': {
+            'attempts': len(wrong),
+            'rejected': sum(record in completed for record in wrong),
+        },
+        'steps': {},
+    }
+    for name in STEPS:
+        samples = [(seconds, ok) for record in records for step, seconds, ok in record['samples'] if step == name]
+        if not samples:
+            continue
+        millis = np.array([seconds for seconds, _ in samples]) * 1e3
+        report['steps'][name] = {
+            'requests': len(samples),
+            'errors': sum(not ok for _, ok in samples),
+            'p50_ms': round(float(np.percentile(millis, 50)), 2),
+            'p95_ms': round(float(np.percentile(millis, 95)), 2),
+            'p99_ms': round(float(np.percentile(millis, 99)), 2),
+            'max_ms': round(float(millis.max()), 2),
+        }
+    return report
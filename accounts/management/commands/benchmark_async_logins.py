@@ -0,0 +1,93 @@
+import asyncio
+import json
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, override_settings
+from django.urls import include, path, reverse
+
+from accounts import async_views, views
+from accounts.benchmarking import UNLIMITED_RATES, seed_users, synthetic_population, throwaway_databases
+from accounts.handoff import HANDOFF_COOKIE, make_handoff_token
+from accounts.loadtest import synthetic_burst
+from accounts.ratelimit import clear_rate_limits
+from accounts.urls import login_urlpatterns
+
+
+def urlconf_for(login_views):
+    class URLConf:
+        urlpatterns = [*login_urlpatterns(login_views), path('', include('config.urls'))]
+    return URLConf
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the sync and async MFA login views under the ASGI handler at several "
+        "concurrency levels. Runs against a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[100, 500, 1000],
+                            help="Logins started at once per run")
+        parser.add_argument('--seed', type=int, default=0)
+
+    async def login(self, user, descriptor):
+        """The MFA half of a login: pick a method, then match a face"""
+        client = AsyncClient()
+        client.cookies[HANDOFF_COOKIE] = make_handoff_token(user)
+        started = time.perf_counter()
+        selection = await client.get(reverse('mfa-selection'))
+        response = await client.post(
+            reverse('face-login'),
+            json.dumps({'frames': synthetic_burst(descriptor)}),
+            content_type='application/json',
+        )
+        ok = selection.status_code == 200 and response.status_code == 200
+        return time.perf_counter() - started, ok
+
+    async def run_logins(self, users, descriptors):
+        peak_threads = threading.active_count()
+        done = asyncio.Event()
+
+        async def watch_threads():
+            nonlocal peak_threads
+            while not done.is_set():
+                peak_threads = max(peak_threads, threading.active_count())
+                await asyncio.sleep(0.005)
+
+        watcher = asyncio.create_task(watch_threads())
+        started = time.perf_counter()
+        results = await asyncio.gather(*(self.login(user, descriptor) for user, descriptor in zip(users, descriptors)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await watcher
+        return elapsed, results, peak_threads
+
+    def report(self, label, concurrency, elapsed, results, peak_threads):
+        latencies = np.array([latency for latency, _ in results]) * 1e3
+        failed = sum(not ok for _, ok in results)
+        self.stdout.write(
+            f"{label:<6} n={concurrency:<5} wall={elapsed:6.2f}s rate={concurrency / elapsed:7.1f}/s "
+            f"p50={np.percentile(latencies, 50):7.1f}ms p95={np.percentile(latencies, 95):7.1f}ms "
+            f"p99={np.percentile(latencies, 99):7.1f}ms threads={peak_threads} failed={failed}"
+        )
+
+    def handle(self, *args, **options):
+        with throwaway_databases():
+            population = synthetic_population(max(options['concurrency']), seed=options['seed'])
+            users, descriptors = seed_users(population), population.descriptors
+            for concurrency in options['concurrency']:
+                for label, login_views in (('sync', views), ('async', async_views)):
+                    with override_settings(
+                        ROOT_URLCONF=urlconf_for(login_views),
+                        ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                        LOGIN_RATE_LIMITS=UNLIMITED_RATES,
+                    ):
+                        clear_rate_limits()
+                        elapsed, results, peak_threads = asyncio.run(
+                            self.run_logins(users[:concurrency], descriptors[:concurrency])
+                        )
+                    self.report(label, concurrency, elapsed, results, peak_threads)
@@ -0,0 +1,96 @@
+import json
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+import django
+import numpy as np
+from cryptography.fernet import Fernet
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.benchmarking import (
+    find_regressions, run_hot_paths, seed_users, synthetic_population, throwaway_databases,
+)
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Time descriptor encode/decode, face distance, Fernet template encryption and the "
+        "face_login and mfa_selection views on a synthetic population, and write the results "
+        "as JSON. With --baseline, fail when a case's median got slower than --tolerance allows. "
+        "Runs against a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help="Size of the synthetic population")
+        parser.add_argument('--iterations', type=int, default=2000, help="Timed calls per micro case")
+        parser.add_argument('--view-iterations', type=int, default=200, help="Timed requests per view")
+        parser.add_argument('--batch-size', type=int, default=64, help="Descriptors per batched distance call")
+        parser.add_argument('--output', help="Write the JSON here instead of stdout")
+        parser.add_argument('--baseline', help="JSON from an earlier run to compare against")
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help="Allowed growth of a case's p50 over the baseline, as a fraction")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+
+        population = synthetic_population(options['users'], seed=options['seed'])
+        with throwaway_databases():
+            users = seed_users(population, cipher=Fernet(Fernet.generate_key()))
+            results = run_hot_paths(
+                population, users,
+                iterations=options['iterations'],
+                batch_size=options['batch_size'],
+                view_iterations=options['view_iterations'],
+            )
+
+        report = {
+            'meta': {
+                'commit': current_commit(),
+                'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'numpy': np.__version__,
+                'machine': platform.machine(),
+                'users': options['users'],
+                'seed': options['seed'],
+            },
+            'results': results,
+        }
+        if baseline is not None:
+            report['regressions'] = find_regressions(results, baseline['results'], options['tolerance'])
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output + '\n')
+            for name, result in results.items():
+                self.stdout.write(
+                    f"{name:<22} p50={result['p50_us']:10.1f}us p95={result['p95_us']:10.1f}us "
+                    f"{result['items_per_sec']:12,.0f}/s"
+                )
+        else:
+            self.stdout.write(output)
+
+        if baseline is not None and report['regressions']:
+            for regression in report['regressions']:
+                self.stderr.write(
+                    f"{regression['case']}: p50 {regression['baseline']:.1f}us -> {regression['current']:.1f}us "
+                    f"({regression['change']:+.0%})"
+                )
+            raise CommandError(
+                f"{len(report['regressions'])} case(s) slower than the baseline by more than {options['tolerance']:.0%}"
+            )
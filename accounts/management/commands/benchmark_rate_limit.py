@@ -0,0 +1,88 @@
+import json
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+
+from accounts.benchmarking import UNLIMITED_RATES, throwaway_databases
+from accounts.ratelimit import check_rate_limit, clear_rate_limits, rate_limit
+
+
+def percentile_us(samples, q):
+    return float(np.percentile(samples, q) * 1e6)
+
+
+class Command(BaseCommand):
+    help = "Measure the per-request overhead of the login rate limiter against the configured cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20_000)
+        parser.add_argument('--clients', type=int, default=1_000,
+                            help="Distinct IPs and emails the requests are spread over")
+
+    def build_requests(self, count, clients):
+        factory = RequestFactory()
+        requests = []
+        for number in range(count):
+            client = number % clients
+            request = factory.post(
+                '/accounts/face/login/',
+                json.dumps({'email': f'user{client}@example.com'}),
+                content_type='application/json',
+                REMOTE_ADDR=f'10.{client // 65536}.{client // 256 % 256}.{client % 256}',
+            )
+            request.mfa_handoff = {'uid': client, 'email': f'user{client}@example.com', 'nonce': str(number)}
+            requests.append(request)
+        return requests
+
+    def time_view(self, view, requests):
+        samples = []
+        for request in requests:
+            started = time.perf_counter()
+            view(request)
+            samples.append(time.perf_counter() - started)
+        return np.array(samples)
+
+    def report(self, label, samples, baseline=None):
+        overhead = ""
+        if baseline is not None:
+            overhead = f" overhead={(samples.mean() - baseline.mean()) * 1e6:6.1f}us"
+        self.stdout.write(
+            f"{label:<18} mean={samples.mean() * 1e6:6.1f}us p50={percentile_us(samples, 50):6.1f}us "
+            f"p99={percentile_us(samples, 99):6.1f}us{overhead}"
+        )
+
+    def handle(self, *args, **options):
+        # Rejections are audited; keep those events out of the real database
+        with throwaway_databases():
+            self.run_benchmark(options)
+
+    def run_benchmark(self, options):
+        def view(request):
+            return HttpResponse()
+
+        # Generous limits so every timed request is allowed
+        with self.settings_override(UNLIMITED_RATES):
+            clear_rate_limits()
+            requests = self.build_requests(options['requests'], options['clients'])
+            baseline = self.time_view(view, requests)
+            # Every client has attempted once before, so counters already exist
+            self.time_view(rate_limit()(view), requests[:options['clients']])
+            limited = self.time_view(rate_limit()(view), requests)
+            self.report("undecorated", baseline)
+            self.report("allowed", limited, baseline)
+
+        # Tight limits: after the first few attempts every request is rejected locally
+        with self.settings_override({'ip': (1, 300)}):
+            clear_rate_limits()
+            requests = self.build_requests(options['requests'], 10)
+            for request in requests[:10]:
+                check_rate_limit(request, ('ip',))
+            rejected = self.time_view(rate_limit(scopes=('ip',))(view), requests[10:])
+            self.report("rejected locally", rejected, baseline[10:])
+        clear_rate_limits()
+
+    def settings_override(self, limits):
+        return override_settings(LOGIN_RATE_LIMITS=limits)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import Profile
+from accounts.pictures import generate_variants, needs_variants
+
+
+class Command(BaseCommand):
+    help = "Build the resized variants of every profile picture that does not have them yet"
+
+    def handle(self, *args, **options):
+        built = failed = 0
+        for profile in Profile.objects.only('profile_picture', 'picture_variants').iterator():
+            if not needs_variants(profile):
+                continue
+            if generate_variants(profile.pk) is None:
+                failed += 1
+            else:
+                built += 1
+        self.stdout.write(f"Built variants for {built} profiles ({failed} failed)")
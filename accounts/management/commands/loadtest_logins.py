@@ -0,0 +1,139 @@
+import json
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application
+from django.test import override_settings
+from django.urls import reverse
+
+from accounts.benchmarking import (
+    UNLIMITED_RATES, population_email, seed_users, synthetic_population, throwaway_databases,
+)
+from accounts.loadtest import STEPS, run_load, summarize_load
+
+USER_PREFIX = 'loadtest'
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class LoadTestServer(ThreadedWSGIServer):
+    # socketserver's default backlog of 5 refuses connections under load
+    request_queue_size = 1024
+
+
+@contextmanager
+def local_server():
+    """Serve the site from a background thread on a free localhost port"""
+    server = LoadTestServer(('127.0.0.1', 0), QuietRequestHandler, allow_reuse_address=False)
+    server.set_app(get_internal_wsgi_application())
+    thread = threading.Thread(target=server.serve_forever, name='loadtest-server', daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_address[1]}'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the full login flow (password, MFA selection, face login) from many concurrent "
+        "virtual users and report throughput and per-step latency. By default the site is served "
+        "in-process against a throwaway database with rate limits lifted. With --url, a running "
+        "server is tested instead: create its users first with --seed-only, and raise "
+        "LOGIN_RATE_LIMITS and allauth's ACCOUNT_RATE_LIMITS there, since every virtual user "
+        "comes from the same IP."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help="Size of the synthetic population")
+        parser.add_argument('--logins', type=int, default=1000, help="Logins to run in total")
+        parser.add_argument('--concurrency', type=int, default=20, help="Virtual users logging in at once")
+        parser.add_argument('--wrong-face-ratio', type=float, default=0.0,
+                            help="Fraction of logins that present another user's face")
+        parser.add_argument('--password', default='loadtest-password', help="Password of every synthetic user")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--url', help="Test the server at this base URL instead of an in-process one")
+        parser.add_argument('--seed-only', action='store_true',
+                            help="Create the synthetic users in the configured database and exit")
+        parser.add_argument('--delete', action='store_true',
+                            help="Delete the synthetic users from the configured database and exit")
+        parser.add_argument('--cheap-passwords', action='store_true',
+                            help="Hash passwords with MD5 in the in-process server, to see the rest of "
+                                 "the flow without PBKDF2 dominating the password step")
+        parser.add_argument('--json', help="Also write the report as JSON to this file")
+
+    def handle(self, *args, **options):
+        if not 0 <= options['wrong_face_ratio'] <= 1:
+            raise CommandError("--wrong-face-ratio must be between 0 and 1")
+        if options['wrong_face_ratio'] and options['users'] < 2:
+            raise CommandError("--wrong-face-ratio needs at least two --users to swap faces between")
+        population = synthetic_population(options['users'], seed=options['seed'])
+
+        if options['delete']:
+            deleted = User.objects.filter(username__startswith=USER_PREFIX, username__endswith='@example.com').delete()
+            self.stdout.write(f"Deleted {deleted[1].get('auth.User', 0)} synthetic users")
+            return
+        if options['seed_only']:
+            seed_users(population, prefix=USER_PREFIX, password=options['password'])
+            self.stdout.write(f"Created {options['users']} users {population_email(0, USER_PREFIX)} and up")
+            return
+
+        accounts = [
+            (population_email(number, USER_PREFIX), options['password'], descriptor)
+            for number, descriptor in enumerate(population.descriptors.tolist())
+        ]
+        paths = {
+            'login': reverse('login'),
+            'mfa_selection': reverse('mfa-selection'),
+            'face_login': reverse('face-login'),
+        }
+        load = dict(
+            paths=paths, accounts=accounts, logins=options['logins'], concurrency=options['concurrency'],
+            wrong_face_ratio=options['wrong_face_ratio'], seed=options['seed'],
+        )
+
+        if options['url']:
+            records, elapsed = run_load(options['url'], **load)
+        else:
+            overrides = dict(
+                LOGIN_RATE_LIMITS=UNLIMITED_RATES,
+                ACCOUNT_RATE_LIMITS=False,
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, '127.0.0.1'],
+            )
+            if options['cheap_passwords']:
+                overrides['PASSWORD_HASHERS'] = ['django.contrib.auth.hashers.MD5PasswordHasher']
+            with throwaway_databases(on_disk=True), override_settings(**overrides):
+                seed_users(population, prefix=USER_PREFIX, password=options['password'])
+                # Rejected faces would otherwise log a warning per attempt
+                logging.disable(logging.WARNING)
+                try:
+                    with local_server() as base_url:
+                        records, elapsed = run_load(base_url, **load)
+                finally:
+                    logging.disable(logging.NOTSET)
+
+        report = summarize_load(records, elapsed)
+        self.stdout.write(
+            f"{report['logins']} logins in {report['seconds']:.2f}s ({report['logins_per_sec']:.1f}/s) "
+            f"completed={report['completed']} failed={report['failed']} "
+            f"wrong-face={report['wrong_face']['attempts']} rejected={report['wrong_face']['rejected']}"
+        )
+        for name in STEPS:
+            step = report['steps'].get(name)
+            if step:
+                self.stdout.write(
+                    f"  {name:<14} n={step['requests']:<6} errors={step['errors']:<5} "
+                    f"p50={step['p50_ms']:8.1f}ms p95={step['p95_ms']:8.1f}ms p99={step['p99_ms']:8.1f}ms"
+                )
+        if options['json']:
+            with open(options['json'], 'w') as report_file:
+                json.dump(report, report_file, indent=2)
+                report_file.write('\n')
@@ -0,0 +1,118 @@
+"""
+Serving uploaded media with validators, byte ranges and long-lived caching.
+
+Names under ``profile_pictures/variants/`` embed a hash of their content
+(see accounts.pictures), so they are sent as ``immutable`` for a year.
+Everything else must be revalidated, which the ETag makes a cheap 304.
+
+With ``MEDIA_SENDFILE_HEADER`` set, the view only checks the path and hands
+the file to the front-end server: ``X-Accel-Redirect`` for nginx, pointing
+into an internal location at ``MEDIA_SENDFILE_PREFIX``, or ``X-Sendfile``
+for Apache and lighttpd, with the absolute path. Otherwise it answers from
+Python through ``FileResponse``, which WSGI servers with a file wrapper
+send with sendfile().
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags
+from django.views.decorators.http import require_safe
+
+from accounts.pictures import VARIANT_DIRECTORY
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=0, must-revalidate'
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def file_etag(stat):
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def parse_range(header, size):
+    """
+    (start, end) inclusive for a single-range header, or None to send the
+    whole file. Raises ValueError when the range cannot be satisfied.
+    """
+    match = RANGE.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        # Malformed and multi-range requests get the full body, as RFC 9110 allows
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the final `last` bytes
+        length = int(last)
+        if not length:
+            raise ValueError("Empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("Range starts past the end of the file")
+    return start, end
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404("Media file not found")
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404("Media file not found")
+    if not os.path.isfile(full_path):
+        raise Http404("Media file not found")
+
+    etag = file_etag(stat)
+    cache_control = IMMUTABLE if path.startswith(f'{VARIANT_DIRECTORY}/') else REVALIDATE
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control
+        return response
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    sendfile_header = getattr(settings, 'MEDIA_SENDFILE_HEADER', None)
+    if sendfile_header:
+        # The front-end server adds Range handling and the body
+        response = HttpResponse(content_type=content_type)
+        if sendfile_header == 'X-Accel-Redirect':
+            response[sendfile_header] = quote(settings.MEDIA_SENDFILE_PREFIX.rstrip('/') + '/' + path)
+        else:
+            response[sendfile_header] = full_path
+    else:
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+        # A Range tied to an older version of the file gets the new file in full
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if byte_range and if_range and if_range != etag:
+            byte_range = None
+
+        if byte_range:
+            start, end = byte_range
+            with open(full_path, 'rb') as media_file:
+                media_file.seek(start)
+                response = HttpResponse(media_file.read(end - start + 1), status=206, content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        else:
+            response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = cache_control
+    response['Accept-Ranges'] = 'bytes'
+    return response
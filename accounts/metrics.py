@@ -0,0 +1,87 @@
+"""
+Login and enrollment metrics for the Django site.
+
+``MetricsMiddleware`` records a count, a latency and the ORM query count
+for every request to a named URL. Views add per-phase timings with
+``time_phase`` and match distances with ``MATCH_DISTANCE``. The ``metrics``
+view serves all of it in the Prometheus text format.
+
+Queries are counted by an execute wrapper that accounts.signals installs
+on every new database connection. The per-request tally lives in a context
+variable, which follows async views into the threads that run their ORM
+calls.
+"""
+import contextvars
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+
+from metrics.registry import COUNT_BUCKETS, DISTANCE_BUCKETS, REGISTRY
+
+REQUESTS = REGISTRY.counter('bioauth_requests_total', "Requests by view and status code", ('view', 'status'))
+REQUEST_SECONDS = REGISTRY.histogram('bioauth_request_seconds', "Request latency by view", ('view',))
+REQUEST_QUERIES = REGISTRY.histogram(
+    'bioauth_request_queries', "ORM queries per request by view", ('view',), buckets=COUNT_BUCKETS
+)
+PHASE_SECONDS = REGISTRY.histogram(
+    'bioauth_phase_seconds', "Time spent in each phase of a login or enrollment", ('view', 'phase')
+)
+MATCH_DISTANCE = REGISTRY.histogram(
+    'bioauth_face_match_distance', "Distance between submitted and stored face descriptors", ('view',),
+    buckets=DISTANCE_BUCKETS,
+)
+FAILED_LOGINS = REGISTRY.counter('bioauth_failed_logins_total', "Rejected biometric logins by method", ('method',))
+
+_query_count = contextvars.ContextVar('bioauth_query_count', default=None)
+
+
+def time_phase(view, phase):
+    return PHASE_SECONDS.time(view=view, phase=phase)
+
+
+def count_queries(execute, sql, params, many, context):
+    tally = _query_count.get()
+    if tally is not None:
+        tally[0] += 1
+    return execute(sql, params, many, context)
+
+
+def install_query_counter(connection):
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+def _start(request):
+    tally = [0]
+    token = _query_count.set(tally)
+    return tally, token, time.perf_counter()
+
+
+def _finish(request, response, tally, token, started):
+    _query_count.reset(token)
+    match = request.resolver_match
+    if match is None or not match.url_name:
+        return
+    view = match.url_name
+    REQUEST_SECONDS.observe(time.perf_counter() - started, view=view)
+    REQUEST_QUERIES.observe(tally[0], view=view)
+    REQUESTS.inc(view=view, status=response.status_code)
+
+
+@sync_and_async_middleware
+def MetricsMiddleware(get_response):
+    """Count, time and tally queries for every request to a named URL"""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            state = _start(request)
+            response = await get_response(request)
+            _finish(request, response, *state)
+            return response
+    else:
+        def middleware(request):
+            state = _start(request)
+            response = get_response(request)
+            _finish(request, response, *state)
+            return response
+    return middleware
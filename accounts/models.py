@@ -1,11 +1,15 @@
 from django.db import models
 from django.contrib.auth.models import User
 
-class Profile(models.Model):
+from accounts.tracking import DirtyFieldsMixin
+
+class Profile(DirtyFieldsMixin, models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     first_name = models.CharField(max_length=30, blank=True)
     last_name = models.CharField(max_length=30, blank=True)
     profile_picture = models.ImageField(default='default.png', upload_to='profile_pictures')
+    # Resized copies of profile_picture, filled in by accounts.pictures
+    picture_variants = models.JSONField(default=dict, blank=True, editable=False)
     job = models.CharField(max_length=30, blank=True)
     about_me = models.TextField(blank=True)
     def __str__(self):
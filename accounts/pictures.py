@@ -0,0 +1,155 @@
+"""
+Fixed-size variants of profile pictures.
+
+Uploads are stored as-is, often several megabytes. After a profile is
+saved with a new picture, a background thread renders each size in
+``VARIANTS`` as WebP and JPEG under ``profile_pictures/variants/``. The
+file names carry a hash of the original's bytes, so a name never points at
+different content and browsers may cache it forever.
+
+``Profile.picture_variants`` records what was built for which original::
+
+    {'source': 'profile_pictures/me.jpg',
+     'avatar': {'webp': 'profile_pictures/variants/3f2a...-avatar.webp', 'jpeg': ...},
+     'thumbnail': {...}}
+
+Until the variants exist, templates fall back to the original. Once a new
+mapping is recorded, the old one's files are deleted unless another
+profile still uses them.
+"""
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from accounts.models import Profile
+
+logger = logging.getLogger(__name__)
+
+# Square edge in pixels: avatars show at 36px and thumbnails at 100px, doubled for HiDPI screens
+VARIANTS = {
+    'avatar': 72,
+    'thumbnail': 200,
+}
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 6}),
+    'jpeg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+VARIANT_DIRECTORY = 'profile_pictures/variants'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='picture-variants')
+    return _executor
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:20]
+
+
+def render_variant(image, size, image_format, options):
+    """The picture cropped to a centred square of size pixels, encoded as image_format"""
+    variant = ImageOps.fit(image, (size, size), method=Image.Resampling.LANCZOS)
+    output = BytesIO()
+    variant.save(output, image_format, **options)
+    return output.getvalue()
+
+
+def build_variants(name):
+    """Write every variant of the stored picture name and return the mapping to record"""
+    with default_storage.open(name, 'rb') as original:
+        data = original.read()
+    digest = content_hash(data)
+    with Image.open(BytesIO(data)) as opened:
+        image = ImageOps.exif_transpose(opened).convert('RGB')
+
+    variants = {'source': name}
+    for variant, size in VARIANTS.items():
+        variants[variant] = {}
+        for extension, (image_format, options) in FORMATS.items():
+            path = f'{VARIANT_DIRECTORY}/{digest}-{variant}.{extension}'
+            # Same hash, same bytes: another profile with this picture already built it
+            if not default_storage.exists(path):
+                saved = default_storage.save(path, ContentFile(render_variant(image, size, image_format, options)))
+                # A concurrent job wrote path first and storage renamed our copy; keep theirs
+                if saved != path:
+                    default_storage.delete(saved)
+            variants[variant][extension] = path
+    return variants
+
+
+def needs_variants(profile):
+    return bool(profile.profile_picture) and profile.picture_variants.get('source') != profile.profile_picture.name
+
+
+def variant_paths(variants):
+    return {
+        (variant, extension, path)
+        for variant, paths in variants.items() if variant in VARIANTS
+        for extension, path in paths.items()
+    }
+
+
+def delete_replaced_variants(profile_id, old, new):
+    """Delete the files of a profile's old mapping that neither the new one nor another profile uses"""
+    kept = {path for _, _, path in variant_paths(new)}
+    for variant, extension, path in variant_paths(old):
+        if path in kept:
+            continue
+        shared = Profile.objects.exclude(pk=profile_id).filter(
+            **{f'picture_variants__{variant}__{extension}': path}
+        ).exists()
+        if not shared:
+            default_storage.delete(path)
+
+
+def generate_variants(profile_id):
+    """Build variants for a profile's current picture; a no-op when they are up to date"""
+    profile = Profile.objects.only('profile_picture', 'picture_variants').filter(pk=profile_id).first()
+    if profile is None or not needs_variants(profile):
+        return None
+    name = profile.profile_picture.name
+    previous = profile.picture_variants
+    try:
+        variants = build_variants(name)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logger.exception("Could not build variants of %s", name)
+        return None
+    # Skip the write if the picture was replaced while we worked; its own job follows
+    if Profile.objects.filter(pk=profile_id, profile_picture=name).update(picture_variants=variants):
+        delete_replaced_variants(profile_id, previous, variants)
+    return variants
+
+
+def schedule_variants(profile):
+    """
+    Build variants on the background thread once the current transaction commits.
+
+    New accounts all start on the shared default picture; build_picture_variants
+    covers those instead of a job per signup.
+    """
+    if needs_variants(profile) and profile.profile_picture.name != Profile._meta.get_field('profile_picture').default:
+        profile_id = profile.pk
+        transaction.on_commit(lambda: get_executor().submit(generate_variants, profile_id))
+
+
+def picture_url(profile, variant='avatar', extension='webp'):
+    """URL of a variant of the profile's picture, or of the original until it is built"""
+    picture = profile.profile_picture
+    variants = profile.picture_variants
+    if variants.get('source') == picture.name and variant in variants:
+        return default_storage.url(variants[variant][extension])
+    return picture.url
@@ -0,0 +1,257 @@
+"""
+Sliding-window rate limiting for the login and biometric matching views.
+
+Each scope (``ip``, ``email``, ``user``) keeps one counter per fixed window
+in the shared cache. The estimate for the sliding window weights the
+previous window's count by how much of it still overlaps::
+
+    previous * (1 - elapsed / window) + current
+
+Counters live in the ``LOGIN_RATE_LIMIT_CACHE`` alias and only move through
+``add`` and ``incr``, which are atomic on Redis, Memcached and the
+local-memory backend, so concurrent workers cannot lose updates. Once a key is over its limit, the process
+remembers until when it stays blocked and rejects further attempts
+without touching the cache. Finished windows no longer change, so their
+counts are also remembered after the first read; an allowed attempt then
+costs one ``incr`` per scope.
+"""
+import hashlib
+import json
+import threading
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import caches
+from django.http import JsonResponse
+from django.shortcuts import redirect
+from django.urls import reverse
+
+from audit.pipeline import record_event
+
+DEFAULT_LIMITS = {
+    'ip': (50, 300),
+    'email': (10, 300),
+    'user': (10, 300),
+}
+LOCAL_BLOCK_MAX_ENTRIES = 10_000
+CLOSED_WINDOW_MAX_ENTRIES = 50_000
+# Attempts that started just before a window ended may still be counting into it
+CLOSED_WINDOW_GRACE_SECONDS = 2.0
+
+_blocked = {}
+_blocked_lock = threading.Lock()
+_closed_windows = {}
+
+
+def get_cache():
+    return caches[getattr(settings, 'LOGIN_RATE_LIMIT_CACHE', 'default')]
+
+
+def get_limits():
+    """(max attempts, window seconds) per scope, from LOGIN_RATE_LIMITS"""
+    return getattr(settings, 'LOGIN_RATE_LIMITS', DEFAULT_LIMITS)
+
+
+def submitted_email(request):
+    """
+    The email an attempt is for: the MFA handoff's, else the JSON body or login form field.
+
+    Past the password step the account is settled, so a client cannot spread
+    its attempts over emails it puts in the body.
+    """
+    email = None
+    handoff = getattr(request, 'mfa_handoff', None)
+    if handoff:
+        email = handoff['email']
+    elif request.content_type == 'application/json':
+        try:
+            body = json.loads(request.body)
+        except ValueError:
+            body = None
+        if isinstance(body, dict):
+            email = body.get('email')
+    else:
+        email = request.POST.get('login') or request.POST.get('email')
+    return email.strip().lower() if isinstance(email, str) and email.strip() else None
+
+
+def handoff_user(request):
+    """The account that already passed the password step"""
+    handoff = getattr(request, 'mfa_handoff', None)
+    return str(handoff['uid']) if handoff else None
+
+
+KEY_FUNCTIONS = {
+    'ip': lambda request: request.META.get('REMOTE_ADDR'),
+    'email': submitted_email,
+    'user': handoff_user,
+}
+
+
+def cache_key(scope, value):
+    digest = hashlib.blake2b(value.encode(), digest_size=12).hexdigest()
+    return f'ratelimit:{scope}:{digest}'
+
+
+def retry_after(previous, current, elapsed, limit, window):
+    """Seconds until one more attempt fits under limit, assuming no other traffic"""
+    room = limit - 1
+    if current <= room:
+        if previous <= 0:
+            return 0.0
+        # Wait for the previous window's weight to decay enough
+        return max(0.0, window * (1 - (room - current) / previous) - elapsed)
+    # Full even without the previous window: wait into the next one
+    return (window - elapsed) + window * (1 - room / current)
+
+
+def increment(cache, key, timeout):
+    """Atomically add one to key, creating it with timeout if missing"""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        if cache.add(key, 1, timeout):
+            return 1
+        return cache.incr(key)
+
+
+def locally_blocked(keys, now):
+    """Largest remaining block among keys this process already knows are over limit"""
+    wait = 0.0
+    for key in keys:
+        # Expired entries are left for block_locally to prune under its lock
+        until = _blocked.get(key, 0.0)
+        if until > now:
+            wait = max(wait, until - now)
+    return wait
+
+
+def block_locally(key, until):
+    with _blocked_lock:
+        if len(_blocked) >= LOCAL_BLOCK_MAX_ENTRIES:
+            now = time.time()
+            for stale in [k for k, t in _blocked.items() if t <= now]:
+                del _blocked[stale]
+            if len(_blocked) >= LOCAL_BLOCK_MAX_ENTRIES:
+                _blocked.clear()
+        _blocked[key] = until
+
+
+def previous_window_counts(cache, keys, settled):
+    """Counts of already finished windows, from this process's memory when possible"""
+    counts = {}
+    missing = []
+    for key in keys:
+        count = _closed_windows.get(key)
+        if count is None:
+            missing.append(key)
+        else:
+            counts[key] = count
+    if missing:
+        fetched = cache.get_many(missing)
+        if len(_closed_windows) + len(missing) > CLOSED_WINDOW_MAX_ENTRIES:
+            _closed_windows.clear()
+        for key in missing:
+            counts[key] = fetched.get(key, 0)
+            if settled:
+                _closed_windows[key] = counts[key]
+    return counts
+
+
+def clear_rate_limits():
+    """Forget every counter and local block (tests and benchmarks)"""
+    get_cache().clear()
+    with _blocked_lock:
+        _blocked.clear()
+    _closed_windows.clear()
+
+
+def check_rate_limit(request, scopes):
+    """
+    Count one attempt against every scope and return the seconds to wait,
+    or 0 when the attempt is allowed.
+    """
+    limits = get_limits()
+    keyed = []
+    for scope in scopes:
+        if scope not in limits:
+            continue
+        value = KEY_FUNCTIONS[scope](request)
+        if value:
+            keyed.append((cache_key(scope, value), *limits[scope]))
+    if not keyed:
+        return 0.0
+
+    now = time.time()
+    wait = locally_blocked([key for key, _, _ in keyed], now)
+    if wait:
+        return wait
+
+    cache = get_cache()
+    previous_keys = {}
+    settled = True
+    for key, limit, window in keyed:
+        number = int(now // window)
+        previous_keys[key] = f'{key}:{number - 1}'
+        settled = settled and now - number * window > CLOSED_WINDOW_GRACE_SECONDS
+    previous_counts = previous_window_counts(cache, list(previous_keys.values()), settled)
+
+    for key, limit, window in keyed:
+        number = int(now // window)
+        elapsed = now - number * window
+        current = increment(cache, f'{key}:{number}', window * 2)
+        previous = previous_counts.get(previous_keys[key], 0)
+        if previous * (1 - elapsed / window) + current > limit:
+            key_wait = retry_after(previous, current, elapsed, limit, window)
+            # Only the exhausted scope: an email over its limit must not lock
+            # out everyone else behind the same address
+            block_locally(key, now + key_wait)
+            wait = max(wait, key_wait)
+    return wait
+
+
+def limited_response(request, wait):
+    seconds = max(1, int(wait + 0.999))
+    message = f"Too many login attempts. Please try again in {seconds} seconds."
+    if request.content_type == 'application/json':
+        response = JsonResponse({"status": "error", "message": message}, status=429)
+        response['Retry-After'] = str(seconds)
+        return response
+    messages.error(request, message)
+    return redirect(reverse('login'))
+
+
+def rate_limit(scopes=('ip', 'email', 'user'), methods=('POST',)):
+    """
+    Reject a view's attempts over LOGIN_RATE_LIMITS before it touches the database.
+
+    Works on sync and async views. The check runs inline either way: with
+    the local-memory cache it never blocks, and a networked cache costs an
+    event loop about one round trip per scope.
+    """
+    def decorator(view_func):
+        def rejection(request):
+            if methods is None or request.method in methods:
+                wait = check_rate_limit(request, scopes)
+                if wait:
+                    record_event(
+                        'rate_limit', 'failure', request=request, user=handoff_user(request),
+                        email=submitted_email(request) or '', retry_after=round(wait, 1),
+                    )
+                    return limited_response(request, wait)
+            return None
+
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapper(request, *args, **kwargs):
+                return rejection(request) or await view_func(request, *args, **kwargs)
+            return async_wrapper
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            return rejection(request) or view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
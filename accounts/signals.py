@@ -1,18 +1,35 @@
+from django.db.backends.signals import connection_created
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 
+from accounts.metrics import install_query_counter
 from accounts.models import Profile
+from accounts.pictures import schedule_variants
 from mfa.models import MFAProfile
 @receiver(post_save, sender=User)
 def create_user_profiles(sender, instance, created, **kwargs):
     if created:
-        Profile.objects.create(user=instance)
-        MFAProfile.objects.create(user=instance)
+        # Insert-or-ignore, so a profile a concurrent request already made is kept
+        Profile.objects.bulk_create([Profile(user_id=instance.pk)], ignore_conflicts=True)
+        MFAProfile.objects.for_user(instance).bulk_create([MFAProfile(user_id=instance.pk)], ignore_conflicts=True)
 
 @receiver(post_save, sender=User)
-def save_user_profiles(sender, instance, **kwargs):
-    if hasattr(instance, 'profile'):
-        instance.profile.save()
-    if hasattr(instance, 'mfa_profile'):
-        instance.mfa_profile.save()
+def save_user_profiles(sender, instance, update_fields=None, **kwargs):
+    # Partial saves such as login()'s last_login never carry profile changes
+    if update_fields is not None:
+        return
+    for name in ('profile', 'mfaprofile'):
+        # Only a profile already loaded can have been changed; saving a clean one writes nothing
+        profile = sender._meta.get_field(name).get_cached_value(instance, default=None)
+        if profile is not None:
+            profile.save()
+
+@receiver(post_save, sender=Profile)
+def build_picture_variants(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'profile_picture' in update_fields:
+        schedule_variants(instance)
+
+@receiver(connection_created)
+def count_request_queries(sender, connection, **kwargs):
+    install_query_counter(connection)
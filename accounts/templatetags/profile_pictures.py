@@ -0,0 +1,11 @@
+from django import template
+
+from accounts import pictures
+
+register = template.Library()
+
+
+@register.filter
+def picture_url(profile, variant='avatar'):
+    """``{{ profile|picture_url:"thumbnail" }}``: a resized WebP, or the original until it is built"""
+    return pictures.picture_url(profile, variant)
@@ -1,3 +1,894 @@
-from django.test import TestCase
+import json
+import os
+import re
+import shutil
+import tempfile
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import LiveServerTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.template import Context, Template
+from django.urls import include, path, reverse
+from PIL import Image
+
+from accounts import async_views
+from accounts.benchmarking import (
+    UNLIMITED_RATES, find_regressions, population_email, run_hot_paths, seed_users, synthetic_population,
+)
+from accounts.caches import local_memory_caches, warn_about_local_caches
+from accounts.handoff import HANDOFF_COOKIE, make_handoff_token
+from accounts.loadtest import run_load, summarize_load, synthetic_burst
+from accounts.models import Profile
+from accounts.pictures import build_variants, generate_variants
+from accounts.media import IMMUTABLE, REVALIDATE
+from accounts.metrics import MATCH_DISTANCE, PHASE_SECONDS, REQUEST_QUERIES, REQUESTS
+from accounts.ratelimit import clear_rate_limits, retry_after
+from accounts.signals import create_user_profiles
+from accounts.urls import login_urlpatterns
+from accounts.views import FACE_BATCH_MAX_ITEMS
+from fingerprint_service.results import sign_result
+from mfa import async_views as mfa_async_views
+from mfa.codec import encode_descriptor
+from mfa.identification import reset_face_index
+from mfa.liveness import match_burst
+from mfa.models import MFAProfile
+from metrics.registry import REGISTRY
+
+
+def blob_queries(queries):
+    return [q['sql'] for q in queries if 'face_data' in q['sql'] or 'fingerprint_data' in q['sql']]
+
+
+def write_queries(queries):
+    return [q['sql'] for q in queries if re.match(r'\s*(INSERT|UPDATE|DELETE)', q['sql'])]
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class LoginFlowQueryCountTests(TestCase):
+    def setUp(self):
+        clear_rate_limits()
+        self.descriptor = (np.random.default_rng(0).standard_normal(128) * 0.15).astype(np.float32)
+        self.user = User.objects.create_user(username='ada@example.com', email='ada@example.com', password='pw')
+        profile = self.user.mfaprofile
+        profile.face_data = encode_descriptor(self.descriptor)
+        profile.fingerprint_data = b'{"id": "credential"}'
+        profile.save()
+        self.client.cookies[HANDOFF_COOKIE] = make_handoff_token(self.user)
+
+    def post_face(self):
+        return self.client.post(
+            reverse('face-login'),
+            json.dumps({'frames': synthetic_burst(self.descriptor)}),
+            content_type='application/json',
+        )
+
+    def test_mfa_selection_uses_one_query_without_blobs(self):
+        # A single joined user/profile/MFA query; the handoff needs no session
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('mfa-selection'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(blob_queries(queries), [])
+        self.assertEqual(response.context['mfa_options'], {'fingerprint': True, 'face_id': True})
+
+    def test_fingerprint_login_uses_one_query_without_blobs(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('fingerprint-login'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(blob_queries(queries), [])
+
+    def test_face_login_loads_only_the_face_blob(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_face()
+        self.assertEqual(response.json()['status'], 'success')
+        self.assertEqual(len(blob_queries(queries)), 1)
+        self.assertNotIn('fingerprint_data', blob_queries(queries)[0])
+
+    def test_face_login_rejects_single_descriptors_before_loading_blob(self):
+        single = json.dumps({'faceDescriptor': self.descriptor.tolist()})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('face-login'), single, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(blob_queries(queries), [])
+
+        with override_settings(FACE_LOGIN_REQUIRE_BURST=False):
+            response = self.client.post(reverse('face-login'), single, content_type='application/json')
+        self.assertEqual(response.json()['status'], 'success')
+
+    def test_face_login_rejects_wrong_dimension_before_loading_blob(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse('face-login'),
+                json.dumps({'frames': synthetic_burst(self.descriptor[:64])}),
+                content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(blob_queries(queries), [])
+
+    def test_face_login_reads_descriptor_store_instead_of_database(self):
+        path = os.path.join(tempfile.mkdtemp(), 'descriptors.bin')
+        with override_settings(FACE_DESCRIPTOR_STORE_PATH=path):
+            # An unchanged profile saves nothing, so write the face again to fill the store
+            with self.captureOnCommitCallbacks(execute=True):
+                self.user.mfaprofile.save(update_fields=['face_data'])
+            with CaptureQueriesContext(connection) as queries:
+                response = self.post_face()
+        self.assertEqual(response.json()['status'], 'success')
+        self.assertEqual(blob_queries(queries), [])
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    LOGIN_RATE_LIMITS={'ip': (5, 60), 'email': (3, 60), 'user': (10, 60)},
+)
+class RateLimitTests(TestCase):
+    def setUp(self):
+        clear_rate_limits()
+        # allauth counts failed logins in the default cache; later tests log in from the same IP
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='ada@example.com', email='ada@example.com', password='pw')
+        self.client.cookies[HANDOFF_COOKIE] = make_handoff_token(self.user)
+
+    def post_face(self, email):
+        return self.client.post(
+            reverse('face-login'),
+            json.dumps({'frames': synthetic_burst(np.full(128, 0.1)), 'email': email}),
+            content_type='application/json',
+        )
+
+    def test_email_limit_rejects_before_matching(self):
+        # Past the password step the handoff's email counts, whatever the body says
+        for email in ('ada@example.com', 'grace@example.com', ''):
+            self.assertNotEqual(self.post_face(email).status_code, 429)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_face('someone@example.com')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertEqual([q for q in queries if 'auth_user' in q['sql']], [])
+
+        # Another email from the same address still has room under the IP limit
+        response = self.client.post(reverse('login'), {'login': 'GRACE@example.com', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_ip_limit_covers_every_email(self):
+        statuses = [
+            self.client.post(reverse('login'), {'login': f'user{number}@example.com', 'password': 'pw'}).status_code
+            for number in range(6)
+        ]
+        self.assertEqual(statuses, [200] * 5 + [302])
+
+    def test_password_login_is_limited(self):
+        for _ in range(3):
+            self.client.post(reverse('login'), {'login': 'ada@example.com', 'password': 'wrong'})
+        response = self.client.post(reverse('login'), {'login': 'ada@example.com', 'password': 'pw'})
+        self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+
+    def test_retry_after_follows_the_sliding_window(self):
+        # Current window already full: wait for the next one, then for its weight to fall
+        self.assertAlmostEqual(retry_after(previous=0, current=4, elapsed=10, limit=3, window=60), 50 + 60 * (1 - 2 / 4))
+        # Room in the current window: only the previous window's weight is in the way
+        self.assertAlmostEqual(retry_after(previous=10, current=1, elapsed=30, limit=3, window=60), 60 * (1 - 1 / 10) - 30)
+        self.assertEqual(retry_after(previous=0, current=1, elapsed=30, limit=3, window=60), 0.0)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class MFAHandoffTests(TestCase):
+    def setUp(self):
+        clear_rate_limits()
+        self.descriptor = (np.random.default_rng(0).standard_normal(128) * 0.15).astype(np.float32)
+        self.user = User.objects.create_user(username='ada@example.com', email='ada@example.com', password='pw')
+        profile = self.user.mfaprofile
+        profile.face_data = encode_descriptor(self.descriptor)
+        profile.save()
+
+    def post_face(self):
+        return self.client.post(
+            reverse('face-login'),
+            json.dumps({'frames': synthetic_burst(self.descriptor)}),
+            content_type='application/json',
+        )
+
+    def test_local_memory_caches_are_reported_outside_debug(self):
+        with override_settings(DEBUG=False), self.assertLogs('accounts.caches', 'WARNING') as logs:
+            warn_about_local_caches()
+        self.assertEqual(
+            [message.split(' points at')[0] for message in logs.output],
+            ['WARNING:accounts.caches:LOGIN_RATE_LIMIT_CACHE', 'WARNING:accounts.caches:MFA_HANDOFF_CACHE'],
+        )
+        shared = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+        with override_settings(DEBUG=False, CACHES={**settings.CACHES, 'handoff': shared, 'ratelimit': shared}):
+            self.assertEqual(local_memory_caches(), [])
+        with override_settings(DEBUG=True), self.assertNoLogs('accounts.caches'):
+            warn_about_local_caches()
+
+    def test_password_step_writes_nothing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('login'), {'login': 'ada@example.com', 'password': 'pw'})
+        self.assertRedirects(response, reverse('mfa-selection'), fetch_redirect_response=False)
+        self.assertIn(HANDOFF_COOKIE, response.cookies)
+        self.assertEqual(write_queries(queries), [])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('mfa-selection')).status_code, 200)
+        self.assertEqual([q['sql'] for q in queries if 'django_session' in q['sql']], [])
+
+        response = self.post_face()
+        self.assertEqual(response.json()['status'], 'success')
+        self.assertEqual(response.cookies[HANDOFF_COOKIE].value, '')
+
+    def test_handoff_is_single_use(self):
+        token = make_handoff_token(self.user)
+        self.client.cookies[HANDOFF_COOKIE] = token
+        self.assertEqual(self.post_face().json()['status'], 'success')
+
+        self.client.logout()
+        self.client.cookies[HANDOFF_COOKIE] = token
+        self.assertRedirects(self.client.get(reverse('mfa-selection')), reverse('login'), fetch_redirect_response=False)
+        self.assertEqual(self.post_face().status_code, 302)
+
+    def test_tampered_or_expired_handoff_is_rejected(self):
+        token = make_handoff_token(self.user)
+        self.client.cookies[HANDOFF_COOKIE] = token[:-1] + ('A' if token[-1] != 'A' else 'B')
+        self.assertRedirects(self.client.get(reverse('mfa-selection')), reverse('login'), fetch_redirect_response=False)
+
+        self.client.cookies[HANDOFF_COOKIE] = token
+        with override_settings(MFA_HANDOFF_MAX_AGE=-1):
+            self.assertRedirects(self.client.get(reverse('mfa-selection')), reverse('login'), fetch_redirect_response=False)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ProfileWriteTests(TestCase):
+    def setUp(self):
+        clear_rate_limits()
+        self.user = User.objects.create_user(username='ada@example.com', email='ada@example.com', password='pw')
+
+    def updates(self, queries):
+        # The session store saves its own row on login; everything else is ours
+        return [
+            sql for sql in write_queries(queries)
+            if sql.lstrip().startswith('UPDATE') and 'django_session' not in sql
+        ]
+
+    def test_face_login_updates_only_last_login(self):
+        descriptor = (np.random.default_rng(0).standard_normal(128) * 0.15).astype(np.float32)
+        profile = self.user.mfaprofile
+        profile.face_data = encode_descriptor(descriptor)
+        profile.save()
+        self.client.post(reverse('login'), {'login': 'ada@example.com', 'password': 'pw'})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse('face-login'), json.dumps({'frames': synthetic_burst(descriptor)}), content_type='application/json'
+            )
+        self.assertEqual(response.json()['status'], 'success')
+        updates = self.updates(queries)
+        self.assertEqual(len(updates), 1)
+        self.assertRegex(updates[0], r'^UPDATE "auth_user" SET "last_login" = ')
+
+    def test_login_without_mfa_updates_only_last_login(self):
+        # mfa-selection logs these users straight in with their profile already joined
+        self.client.post(reverse('login'), {'login': 'ada@example.com', 'password': 'pw'})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('mfa-selection'))
+        self.assertRedirects(response, reverse('profile-home'), fetch_redirect_response=False)
+        updates = self.updates(queries)
+        self.assertEqual(len(updates), 1)
+        self.assertRegex(updates[0], r'^UPDATE "auth_user" SET "last_login" = ')
+
+    def test_saves_write_only_changed_columns(self):
+        profile = Profile.objects.get(user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            profile.save()
+            self.user.save()
+        self.assertEqual([sql for sql in write_queries(queries) if 'accounts_profile' in sql], [])
+
+        profile.job = 'Analyst'
+        with CaptureQueriesContext(connection) as queries:
+            profile.save()
+            profile.save()
+        self.assertEqual(len(queries), 1)
+        self.assertRegex(queries[0]['sql'], r'^UPDATE "accounts_profile" SET "job" = \S+ WHERE')
+        self.assertEqual(Profile.objects.get(pk=profile.pk).job, 'Analyst')
+
+    def test_provisioning_keeps_existing_profiles(self):
+        profile = self.user.mfaprofile
+        profile.fingerprint_data = b'credential'
+        profile.save()
+        # A second provisioning, as from a racing request, neither fails nor replaces anything
+        create_user_profiles(User, self.user, created=True)
+        self.assertEqual(Profile.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(MFAProfile.objects.get(user=self.user).fingerprint_data, b'credential')
+
+
+class AsyncLoginURLs:
+    # Same names and paths as config.urls; the first match wins
+    urlpatterns = [
+        *login_urlpatterns(async_views),
+        path('mfa/setup/face-id', mfa_async_views.setup_face, name='setup-face'),
+        path('', include('config.urls')),
+    ]
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    ROOT_URLCONF=AsyncLoginURLs,
+)
+class AsyncLoginViewTests(TestCase):
+    def setUp(self):
+        clear_rate_limits()
+        self.descriptor = (np.random.default_rng(0).standard_normal(128) * 0.15).astype(np.float32)
+        self.user = User.objects.create_user(username='ada@example.com', email='ada@example.com', password='pw')
+        profile = self.user.mfaprofile
+        profile.face_data = encode_descriptor(self.descriptor)
+        profile.save()
+        self.async_client.cookies[HANDOFF_COOKIE] = make_handoff_token(self.user)
+        self.client.cookies[HANDOFF_COOKIE] = make_handoff_token(self.user)
+
+    def post_face(self, descriptor):
+        return self.async_client.post(
+            reverse('face-login'),
+            json.dumps({'frames': synthetic_burst(descriptor)}),
+            content_type='application/json',
+        )
+
+    def test_mfa_selection_uses_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('mfa-selection'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(response.context['mfa_options'], {'fingerprint': False, 'face_id': True})
+
+    async def test_face_login_logs_in_once(self):
+        response = await self.post_face(self.descriptor)
+        self.assertEqual(response.json()['status'], 'success')
+        self.assertEqual(response.cookies[HANDOFF_COOKIE].value, '')
+        session = await self.async_client.asession()
+        self.assertEqual(await session.aget('_auth_user_id'), str(self.user.pk))
+
+        self.async_client.cookies[HANDOFF_COOKIE] = make_handoff_token(self.user)
+        response = await self.post_face(self.descriptor + 1)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['message'], 'Face verification failed')
+
+    async def test_missing_handoff_redirects_to_login(self):
+        del self.async_client.cookies[HANDOFF_COOKIE]
+        response = await self.async_client.get(reverse('fingerprint-login'))
+        self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+
+    async def test_setup_face_enrolls_descriptor(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(
+            reverse('setup-face'),
+            json.dumps({'facialId': [0.5] * 128}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.json()['status'], 'success')
+        profile = await MFAProfile.objects.aget(user=self.user)
+        self.assertEqual(profile.face_dim, 128)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class FaceBurstLoginTests(TestCase):
+    def setUp(self):
+        clear_rate_limits()
+        self.descriptor = (np.random.default_rng(0).standard_normal(128) * 0.15).astype(np.float32)
+        self.user = User.objects.create_user(username='ada@example.com', email='ada@example.com', password='pw')
+        profile = self.user.mfaprofile
+        profile.face_data = encode_descriptor(self.descriptor)
+        profile.save()
+        self.client.cookies[HANDOFF_COOKIE] = make_handoff_token(self.user)
+        self.async_client.cookies[HANDOFF_COOKIE] = make_handoff_token(self.user)
+
+    def post_burst(self, frames):
+        return self.client.post(reverse('face-login'), json.dumps({'frames': frames}), content_type='application/json')
+
+    def test_live_burst_logs_in(self):
+        response = self.post_burst(synthetic_burst(self.descriptor))
+        self.assertEqual(response.json()['status'], 'success')
+        self.assertEqual(self.client.session['_auth_user_id'], str(self.user.pk))
+
+    def test_someone_elses_burst_fails_verification(self):
+        response = self.post_burst(synthetic_burst(self.descriptor + 0.2))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['message'], 'Face verification failed')
+
+    def test_replayed_or_still_frames_are_rejected_without_queries(self):
+        replayed = synthetic_burst(self.descriptor, jitter=0, motion=0)
+        for frames, reason in [
+            (replayed, 'static'),
+            (synthetic_burst(self.descriptor, motion=0), 'static'),
+            (synthetic_burst(self.descriptor, jitter=0.2), 'inconsistent'),
+            ([dict(frame, score=0.1) for frame in synthetic_burst(self.descriptor)], 'low_quality'),
+        ]:
+            with self.subTest(reason=reason), CaptureQueriesContext(connection) as queries:
+                response = self.post_burst(frames)
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(response.json()['reason'], reason)
+            self.assertEqual(len(queries), 0)
+
+    def test_malformed_burst_is_rejected_without_queries(self):
+        frames = synthetic_burst(self.descriptor)
+        nan_frame = dict(frames[0], descriptor=[float('nan')] * 128)
+        for bad in [frames[:2], frames * 3, [nan_frame] + frames[1:], [{'descriptor': [0.1] * 128}] * 5]:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.post_burst(bad)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(len(queries), 0)
+
+    def test_burst_of_wrong_dimension_is_rejected_before_loading_blob(self):
+        frames = synthetic_burst(self.descriptor[:64])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_burst(frames)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(blob_queries(queries), [])
+
+    def test_match_stops_at_the_first_decisive_frame(self):
+        stored = np.zeros(2, dtype=np.float32)
+        near, far = [0.1, 0], [1, 0]
+        result = match_burst(stored, np.array([near, near, near, far, far], dtype=np.float32), 0.4)
+        self.assertEqual((result.matched, result.frames_used), (True, 3))
+        result = match_burst(stored, np.array([far, far, far, near, near], dtype=np.float32), 0.4)
+        self.assertEqual((result.matched, result.frames_used), (False, 3))
+        result = match_burst(stored, np.array([near, far, near, far, near], dtype=np.float32), 0.4)
+        self.assertEqual((result.matched, result.frames_used), (True, 5))
+
+    async def test_async_view_accepts_bursts(self):
+        with self.settings(ROOT_URLCONF=AsyncLoginURLs):
+            response = await self.async_client.post(
+                reverse('face-login'),
+                json.dumps({'frames': synthetic_burst(self.descriptor, jitter=0, motion=0)}),
+                content_type='application/json',
+            )
+            self.assertEqual(response.json()['reason'], 'static')
+            response = await self.async_client.post(
+                reverse('face-login'),
+                json.dumps({'frames': synthetic_burst(self.descriptor)}),
+                content_type='application/json',
+            )
+        self.assertEqual(response.json()['status'], 'success')
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], FACE_IDENTIFY_ENABLED=True)
+class FaceIdentifyTests(TestCase):
+    def setUp(self):
+        clear_rate_limits()
+        reset_face_index()
+        self.addCleanup(reset_face_index)
+        self.descriptors = (np.random.default_rng(0).standard_normal((20, 128)) * 0.15).astype(np.float32)
+        self.users = []
+        for i, descriptor in enumerate(self.descriptors):
+            user = User.objects.create_user(username=f'user{i}@example.com', email=f'user{i}@example.com', password='pw')
+            MFAProfile.objects.filter(user=user).update(face_data=encode_descriptor(descriptor))
+            self.users.append(user)
+
+    def identify(self, body):
+        return self.client.post(reverse('face-identify'), json.dumps(body), content_type='application/json')
+
+    def test_enrolled_face_logs_its_owner_in(self):
+        response = self.identify({'frames': synthetic_burst(self.descriptors[7])})
+        self.assertEqual(response.json(), {'status': 'success', 'redirect_url': reverse('profile-home')})
+        self.assertEqual(self.client.session['_auth_user_id'], str(self.users[7].pk))
+
+    def test_unknown_or_static_faces_are_refused(self):
+        response = self.identify({'frames': synthetic_burst(np.random.default_rng(2).standard_normal(128) * 0.15)})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['message'], 'Face not recognised')
+
+        response = self.identify({'frames': synthetic_burst(self.descriptors[7], jitter=0, motion=0)})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['reason'], 'static')
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+    def test_single_descriptors_need_the_stricter_threshold(self):
+        response = self.identify({'faceDescriptor': self.descriptors[7].tolist()})
+        self.assertEqual(response.status_code, 400)
+
+        # Close enough for the 1:1 check after the password step, but not for a 1:N search
+        offset = np.random.default_rng(3).standard_normal(128)
+        probe = self.descriptors[7] + offset / np.linalg.norm(offset) * 0.35
+        with override_settings(FACE_LOGIN_REQUIRE_BURST=False):
+            response = self.identify({'faceDescriptor': probe.tolist()})
+            self.assertEqual(response.json()['message'], 'Face not recognised')
+            self.assertEqual(self.identify({'faceDescriptor': self.descriptors[7].tolist()}).status_code, 200)
+
+    def test_malformed_descriptors_are_rejected(self):
+        with override_settings(FACE_LOGIN_REQUIRE_BURST=False):
+            self.assertEqual(self.identify({'faceDescriptor': self.descriptors[0][:64].tolist()}).status_code, 400)
+        response = self.identify({})
+        self.assertEqual(response.json()['message'], 'Missing face data')
+
+    @override_settings(FACE_IDENTIFY_ENABLED=False)
+    def test_disabled_identification_is_not_found(self):
+        self.assertEqual(self.identify({'frames': synthetic_burst(self.descriptors[7])}).status_code, 404)
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    FINGERPRINT_RESULT_KEY='shared-key',
+)
+class FingerprintLoginTests(TestCase):
+    def setUp(self):
+        clear_rate_limits()
+        self.user = User.objects.create_user(username='ada@example.com', email='ada@example.com', password='pw')
+        profile = self.user.mfaprofile
+        profile.fingerprint_data = b'template'
+        profile.save()
+        self.client.cookies[HANDOFF_COOKIE] = make_handoff_token(self.user)
+
+    def post_result(self, result):
+        return self.client.post(reverse('fingerprint-login'), json.dumps({'result': result}), content_type='application/json')
+
+    def test_signed_success_logs_the_user_in_once(self):
+        self.assertEqual(self.client.get(reverse('fingerprint-login')).context['email'], 'ada@example.com')
+        result = sign_result('shared-key', 'ada@example.com', 'success')
+        response = self.post_result(result)
+        self.assertEqual(response.json(), {'status': 'success', 'redirect_url': reverse('profile-home')})
+        self.assertEqual(self.client.session['_auth_user_id'], str(self.user.pk))
+        self.assertEqual(response.cookies[HANDOFF_COOKIE].value, '')
+
+    def test_forged_failed_or_foreign_results_are_refused(self):
+        self.assertEqual(self.post_result(sign_result('other-key', 'ada@example.com', 'success')).status_code, 400)
+        self.assertEqual(self.post_result(sign_result('shared-key', 'ada@example.com', 'failure')).status_code, 401)
+        self.assertEqual(self.post_result(sign_result('shared-key', 'bob@example.com', 'success')).status_code, 401)
+        expired = sign_result('shared-key', 'ada@example.com', 'success', issued_at=0)
+        self.assertEqual(self.post_result(expired).status_code, 400)
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+    @override_settings(FINGERPRINT_RESULT_KEY=None)
+    def test_login_needs_a_result_key(self):
+        self.assertEqual(self.post_result(sign_result('', 'ada@example.com', 'success')).status_code, 503)
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    FACE_GATEWAY_API_KEYS=['gateway-secret'],
+)
+class FaceVerifyBatchTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.descriptors = {}
+        for name in ('ada', 'grace'):
+            descriptor = (rng.standard_normal(128) * 0.15).astype(np.float32)
+            user = User.objects.create_user(username=f'{name}@example.com', email=f'{name}@example.com', password='pw')
+            MFAProfile.objects.filter(user=user).update(face_data=encode_descriptor(descriptor))
+            self.descriptors[name] = descriptor
+        User.objects.create_user(username='noface@example.com', email='noface@example.com', password='pw')
+        flat = User.objects.create_user(username='flat@example.com', email='flat@example.com', password='pw')
+        MFAProfile.objects.filter(user=flat).update(face_data=encode_descriptor(np.full(128, 0.05, dtype=np.float32)))
+
+    def post_batch(self, body, key='gateway-secret'):
+        headers = {'HTTP_X_GATEWAY_KEY': key} if key is not None else {}
+        return self.client.post(
+            reverse('face-verify-batch'), body if isinstance(body, str) else json.dumps(body),
+            content_type='application/json', **headers,
+        )
+
+    def item(self, email, descriptor):
+        return {'email': email, 'faceDescriptor': [float(value) for value in descriptor]}
+
+    def test_requests_without_a_valid_gateway_key_are_refused(self):
+        body = {'items': [self.item('ada@example.com', self.descriptors['ada'])]}
+        for key in (None, '', 'gateway-secret-but-longer', 'wrong'):
+            with self.subTest(key=key), CaptureQueriesContext(connection) as queries:
+                response = self.post_batch(body, key=key)
+            self.assertEqual(response.status_code, 403)
+            self.assertEqual(len(queries), 0)
+        self.assertEqual(self.client.get(reverse('face-verify-batch')).status_code, 405)
+
+    def test_mixed_items_are_answered_in_order_with_one_lookup(self):
+        items = [
+            self.item('ada@example.com', self.descriptors['ada'] + 0.001),
+            self.item('grace@example.com', self.descriptors['ada']),
+            self.item('nobody@example.com', self.descriptors['ada']),
+            self.item('noface@example.com', self.descriptors['ada']),
+            self.item('flat@example.com', np.full(128, 0.05)),
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_batch({'items': items})
+        self.assertEqual(len(queries), 1)
+        results = response.json()['results']
+        self.assertEqual([result['index'] for result in results], list(range(len(items))))
+        self.assertEqual([result['email'] for result in results], [item['email'] for item in items])
+        self.assertEqual([result.get('message', result['status']) for result in results], [
+            'success', 'Face verification failed', 'User not found', 'Face ID not set up for this user',
+            'Live face check failed',
+        ])
+        self.assertLess(results[0]['distance'], 0.05)
+        self.assertNotIn('distance', results[2])
+
+    def test_malformed_items_get_their_own_errors(self):
+        good = self.item('ada@example.com', self.descriptors['ada'])
+        items = [
+            'not an object',
+            {'faceDescriptor': good['faceDescriptor']},
+            {'email': 'ada@example.com'},
+            {'email': 42, 'faceDescriptor': good['faceDescriptor']},
+            {'email': 'ada@example.com', 'faceDescriptor': ['a'] * 128},
+            {'email': 'ada@example.com', 'faceDescriptor': [[0.1] * 128]},
+            {'email': 'ada@example.com', 'faceDescriptor': [float('nan')] * 128},
+            {'email': 'ada@example.com', 'faceDescriptor': good['faceDescriptor'][:64]},
+            good,
+        ]
+        results = self.post_batch({'items': items}).json()['results']
+        self.assertEqual([result.get('message', result['status']) for result in results], [
+            'Missing face data or email', 'Missing face data or email', 'Missing face data or email',
+            'Missing face data or email', 'Invalid face descriptor', 'Invalid face descriptor',
+            'Invalid face descriptor', 'Invalid face descriptor', 'success',
+        ])
+        self.assertNotIn('email', results[0])
+
+    def test_corrupt_stored_descriptors_fail_only_their_items(self):
+        MFAProfile.objects.filter(user__email='grace@example.com').update(
+            face_data=encode_descriptor(self.descriptors['grace'])[:-3]
+        )
+        items = [
+            self.item('grace@example.com', self.descriptors['grace']),
+            self.item('ada@example.com', self.descriptors['ada']),
+        ]
+        with self.assertLogs('accounts.views', 'WARNING'):
+            response = self.post_batch({'items': items})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result.get('message', result['status']) for result in response.json()['results']], [
+            'Stored face data is unreadable', 'success',
+        ])
+
+    def test_batch_size_and_body_shape_are_checked(self):
+        item = self.item('ada@example.com', self.descriptors['ada'])
+        response = self.post_batch({'items': [item] * FACE_BATCH_MAX_ITEMS})
+        self.assertEqual(response.status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_batch({'items': [item] * (FACE_BATCH_MAX_ITEMS + 1)})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['message'], f'At most {FACE_BATCH_MAX_ITEMS} items per batch')
+        self.assertEqual(len(queries), 0)
+        for body in ('{not json', [item], {'items': []}, {'items': {'0': item}}):
+            with self.subTest(body=body):
+                self.assertEqual(self.post_batch(body).status_code, 400)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class MetricsTests(TestCase):
+    def setUp(self):
+        clear_rate_limits()
+        REGISTRY.clear()
+        self.descriptor = (np.random.default_rng(0).standard_normal(128) * 0.15).astype(np.float32)
+        self.user = User.objects.create_user(username='ada@example.com', email='ada@example.com', password='pw')
+        profile = self.user.mfaprofile
+        profile.face_data = encode_descriptor(self.descriptor)
+        profile.save()
+        self.client.cookies[HANDOFF_COOKIE] = make_handoff_token(self.user)
+
+    def post_face(self, descriptor):
+        return self.client.post(
+            reverse('face-login'),
+            json.dumps({'frames': synthetic_burst(descriptor, jitter=0.005)}),
+            content_type='application/json',
+        )
+
+    def test_face_login_records_phases_distance_and_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.post_face(self.descriptor).json()['status'], 'success')
+        self.assertEqual(REQUESTS.value(view='face-login', status=200), 1)
+        for phase in ('db_lookup', 'descriptor_load', 'distance'):
+            self.assertEqual(PHASE_SECONDS.count(view='face-login', phase=phase), 1)
+        self.assertEqual(MATCH_DISTANCE.count(view='face-login'), 1)
+        self.assertLess(MATCH_DISTANCE.quantile(0.5, view='face-login'), 0.1)
+        series = REQUEST_QUERIES.snapshot()[0]
+        self.assertEqual(series['labels'], {'view': 'face-login'})
+        self.assertEqual(series['sum'], len(queries))
+
+    def test_metrics_endpoint_serves_prometheus_text(self):
+        self.client.cookies[HANDOFF_COOKIE] = make_handoff_token(self.user)
+        self.post_face(self.descriptor + 1)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        self.assertIn('# TYPE bioauth_face_match_distance histogram', body)
+        self.assertIn('bioauth_requests_total{view="face-login",status="401"} 1', body)
+        self.assertIn('bioauth_failed_logins_total{method="face_id"} 1', body)
+        self.assertIn('bioauth_face_match_distance_bucket{view="face-login",le="+Inf"} 1', body)
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_metrics_endpoint_rejects_other_clients(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+    @override_settings(METRICS_ALLOWED_IPS=[], METRICS_TOKENS=['scrape-secret'])
+    def test_metrics_endpoint_accepts_a_token_behind_a_proxy(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer wrong'})
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer scrape-secret'})
+        self.assertEqual(response.status_code, 200)
+
+
+class HotPathBenchmarkTests(TestCase):
+    def test_suite_times_every_case_and_flags_regressions(self):
+        population = synthetic_population(4)
+        users = seed_users(population)
+        results = run_hot_paths(population, users, iterations=3, batch_size=4)
+        self.assertEqual(set(results), {
+            'codec.encode.float32', 'codec.decode.float32', 'codec.decode.float16', 'codec.decode.int8',
+            'distance.single', 'distance.batch', 'fernet.encrypt', 'fernet.decrypt',
+            'view.face_login', 'view.mfa_selection',
+        })
+        self.assertEqual(results['distance.batch']['items_per_call'], 4)
+        self.assertEqual(json.loads(json.dumps(results)), results)
+
+        slower = {name: dict(result, p50_us=result['p50_us'] * 2) for name, result in results.items()}
+        self.assertEqual(find_regressions(results, results), [])
+        self.assertEqual(find_regressions(results, slower), [])
+        regressions = find_regressions(slower, results, tolerance=0.5)
+        self.assertEqual(len(regressions), len(results))
+        self.assertEqual(regressions[0]['change'], 1.0)
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    LOGIN_RATE_LIMITS=UNLIMITED_RATES,
+    ACCOUNT_RATE_LIMITS=False,
+)
+class LoginLoadTests(LiveServerTestCase):
+    def test_full_flow_with_wrong_faces(self):
+        clear_rate_limits()
+        population = synthetic_population(3)
+        seed_users(population, prefix='loadtest', password='pw')
+        accounts = [
+            (population_email(number, 'loadtest'), 'pw', descriptor)
+            for number, descriptor in enumerate(population.descriptors.tolist())
+        ]
+        paths = {'login': reverse('login'), 'mfa_selection': reverse('mfa-selection'), 'face_login': reverse('face-login')}
+        records, elapsed = run_load(
+            self.live_server_url, paths, accounts, logins=8, concurrency=1, wrong_face_ratio=0.5, seed=1
+        )
+        report = summarize_load(records, elapsed)
+        self.assertEqual(report['logins'], 8)
+        self.assertEqual(report['failed'], 0)
+        self.assertGreater(report['wrong_face']['attempts'], 0)
+        self.assertEqual(report['wrong_face']['rejected'], report['wrong_face']['attempts'])
+        self.assertEqual(set(report['steps']), {'login_page', 'password', 'mfa_selection', 'face_login'})
+        self.assertEqual(report['steps']['face_login']['errors'], 0)
+
+    def test_a_single_account_never_presents_a_wrong_face(self):
+        clear_rate_limits()
+        population = synthetic_population(1)
+        seed_users(population, prefix='loadtest', password='pw')
+        accounts = [(population_email(0, 'loadtest'), 'pw', population.descriptors[0].tolist())]
+        paths = {'login': reverse('login'), 'mfa_selection': reverse('mfa-selection'), 'face_login': reverse('face-login')}
+        records, elapsed = run_load(self.live_server_url, paths, accounts, logins=3, concurrency=1, wrong_face_ratio=1.0)
+        report = summarize_load(records, elapsed)
+        self.assertEqual((report['completed'], report['wrong_face']['attempts']), (3, 0))
+
+        with self.assertRaisesMessage(CommandError, "at least two --users"):
+            call_command('loadtest_logins', users=1, wrong_face_ratio=0.5)
+
+
+class ProfilePictureTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_SENDFILE_HEADER=None)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user(username='ada@example.com', email='ada@example.com', password='pw')
+        self.client.force_login(self.user)
+
+    def upload(self, color='red', size=(640, 480)):
+        image = BytesIO()
+        Image.new('RGB', size, color).save(image, 'JPEG')
+        return self.client.post(reverse('account-update'), {
+            'first_name': 'Ada', 'last_name': 'Lovelace', 'job': 'Analyst', 'about_me': 'Engines',
+            'profile_picture': SimpleUploadedFile('me.jpg', image.getvalue(), content_type='image/jpeg'),
+        })
+
+    def test_upload_builds_hashed_variants_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.upload()
+        self.assertEqual(len(callbacks), 1)
+        # Run the job inline rather than on the background thread
+        profile = Profile.objects.get(user=self.user)
+        variants = generate_variants(profile.pk)
+        self.assertEqual(variants['source'], profile.profile_picture.name)
+        self.assertRegex(variants['avatar']['webp'], r'^profile_pictures/variants/[0-9a-f]{20}-avatar\.webp$')
+        with Image.open(os.path.join(self.media_root, variants['thumbnail']['jpeg'])) as thumbnail:
+            self.assertEqual((thumbnail.format, thumbnail.size), ('JPEG', (200, 200)))
+        self.assertIsNone(generate_variants(profile.pk))
+
+        # Logins save a profile loaded with only(); that must not reschedule anything
+        with self.captureOnCommitCallbacks() as callbacks:
+            Profile.objects.only('first_name').get(pk=profile.pk).save()
+        self.assertEqual(callbacks, [])
+
+    def test_replacing_a_picture_deletes_its_unshared_variants(self):
+        profile = Profile.objects.get(user=self.user)
+        self.upload('red')
+        first = generate_variants(profile.pk)
+        # Another account with the same picture shares the red avatar files
+        other = User.objects.create_user(username='bob@example.com', email='bob@example.com', password='pw')
+        Profile.objects.filter(user=other).update(picture_variants={'source': 'elsewhere.jpg', 'avatar': first['avatar']})
+
+        self.upload('blue')
+        second = generate_variants(profile.pk)
+        def exists(path):
+            return os.path.exists(os.path.join(self.media_root, path))
+        self.assertTrue(all(exists(path) for paths in second.values() if isinstance(paths, dict) for path in paths.values()))
+        self.assertTrue(all(exists(path) for path in first['avatar'].values()))
+        self.assertFalse(any(exists(path) for path in first['thumbnail'].values()))
+
+    def test_racing_builds_keep_one_file_per_variant(self):
+        self.upload()
+        profile = Profile.objects.get(user=self.user)
+        variants = generate_variants(profile.pk)
+        directory = os.path.join(self.media_root, 'profile_pictures', 'variants')
+        built = sorted(os.listdir(directory))
+
+        # Another job checked each path just before ours was written, so storage renames its saves
+        checked = set()
+        real_exists = default_storage.exists
+        def exists(name):
+            if name in checked:
+                return real_exists(name)
+            checked.add(name)
+            return False
+        with mock.patch.object(default_storage, 'exists', side_effect=exists):
+            self.assertEqual(build_variants(profile.profile_picture.name), variants)
+        self.assertEqual(sorted(os.listdir(directory)), built)
+
+    def test_new_accounts_on_the_default_picture_schedule_nothing(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            User.objects.create_user(username='bob@example.com', email='bob@example.com', password='pw')
+        self.assertEqual(callbacks, [])
+
+    def test_template_filter_falls_back_to_original(self):
+        template = Template('{% load profile_pictures %}{{ profile|picture_url:"thumbnail" }}')
+        self.upload()
+        profile = Profile.objects.get(user=self.user)
+        self.assertEqual(template.render(Context({'profile': profile})), profile.profile_picture.url)
+        generate_variants(profile.pk)
+        profile.refresh_from_db()
+        self.assertEqual(
+            template.render(Context({'profile': profile})),
+            settings.MEDIA_URL + profile.picture_variants['thumbnail']['webp'],
+        )
+
+    def test_media_view_validators_ranges_and_caching(self):
+        self.upload()
+        profile = Profile.objects.get(user=self.user)
+        variant = generate_variants(profile.pk)['avatar']['jpeg']
+        size = os.path.getsize(os.path.join(self.media_root, variant))
+
+        response = self.client.get(settings.MEDIA_URL + variant)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], IMMUTABLE)
+        self.assertEqual(len(b''.join(response.streaming_content)), size)
+        original = self.client.get(profile.profile_picture.url)
+        self.assertEqual(original['Cache-Control'], REVALIDATE)
+
+        etag = response['ETag']
+        self.assertEqual(self.client.get(settings.MEDIA_URL + variant, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        partial = self.client.get(settings.MEDIA_URL + variant, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(partial['Content-Range'], f'bytes 10-19/{size}')
+        self.assertEqual(len(partial.content), 10)
+        self.assertEqual(len(self.client.get(settings.MEDIA_URL + variant, HTTP_RANGE='bytes=-5').content), 5)
+        self.assertEqual(self.client.get(settings.MEDIA_URL + variant, HTTP_RANGE=f'bytes={size}-').status_code, 416)
+        self.assertEqual(self.client.get(settings.MEDIA_URL + '../manage.py').status_code, 404)
+
+    @override_settings(MEDIA_SENDFILE_HEADER='X-Accel-Redirect', MEDIA_SENDFILE_PREFIX='/protected-media/')
+    def test_sendfile_handoff(self):
+        self.upload()
+        picture = Profile.objects.get(user=self.user).profile_picture.name
+        response = self.client.get(settings.MEDIA_URL + picture)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + picture)
+        self.assertEqual(response.content, b'')
@@ -0,0 +1,76 @@
+"""
+Writing only the columns that changed.
+
+Models mixing in ``DirtyFieldsMixin`` remember the values they were loaded
+with. A ``save()`` without ``update_fields`` then writes just the fields
+whose values differ, plus ``auto_now`` timestamps, and when nothing
+differs it does not touch the database or send any signals. Saves that
+insert, or that name their own ``update_fields``, behave as usual.
+"""
+import copy
+
+from django.db import models
+from django.db.models.fields.files import FieldFile
+
+
+def comparable(value):
+    """value in a form that compares equal to an unchanged copy of itself"""
+    if isinstance(value, memoryview):
+        return bytes(value)
+    if isinstance(value, FieldFile):
+        # A new upload is always a change, even under the old file's name
+        return value.name if value._committed else object()
+    if isinstance(value, (dict, list)):
+        return copy.deepcopy(value)
+    return value
+
+
+class DirtyFieldsMixin(models.Model):
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember()
+        return instance
+
+    def _remember(self, names=None):
+        """Record the current values of names, or of every loaded field, as saved"""
+        if names is None or not hasattr(self, '_saved_values'):
+            self._saved_values = {}
+        for field in self._meta.concrete_fields:
+            if field.primary_key or field.attname not in self.__dict__:
+                continue
+            if names is None or field.name in names or field.attname in names:
+                self._saved_values[field.name] = comparable(getattr(self, field.attname))
+
+    def get_dirty_fields(self):
+        """Names of loaded fields whose values differ from the database's"""
+        saved = getattr(self, '_saved_values', {})
+        return {
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key and field.attname in self.__dict__
+            and (field.name not in saved or saved[field.name] != comparable(getattr(self, field.attname)))
+        }
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self._remember(fields)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        using = kwargs.get('using')
+        tracked = (
+            hasattr(self, '_saved_values') and not self._state.adding and not kwargs.get('force_insert')
+            and update_fields is None and using in (None, self._state.db)
+        )
+        if tracked:
+            dirty = self.get_dirty_fields()
+            if not dirty:
+                return
+            kwargs['update_fields'] = dirty | {
+                field.name for field in self._meta.concrete_fields if getattr(field, 'auto_now', False)
+            }
+        super().save(*args, **kwargs)
+        self._remember(kwargs.get('update_fields'))
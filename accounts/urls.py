@@ -1,18 +1,32 @@
+from django.conf import settings
 from django.urls import path, include
 
-from accounts.views import CustomLoginView, CustomSignupView, logout_confirmation, mfa_selection, fingerprint_login, face_login
+from accounts import async_views, views
+from accounts.views import (
+    CustomLoginView, CustomSignupView, logout_confirmation, face_identify, face_verify_batch, metrics,
+)
 from allauth.account.views import LogoutView
 
 
+def login_urlpatterns(login_views):
+    """The MFA login steps, served by accounts.views or accounts.async_views"""
+    return [
+        path('accounts/mfa-selection/continue/login', login_views.mfa_selection, name='mfa-selection' ),
+        path('accounts/fingerprint/login', login_views.fingerprint_login, name='fingerprint-login'),
+        path('accounts/face/login/', login_views.face_login, name='face-login'),
+    ]
+
+
 urlpatterns = [
 
     path('accounts/login/', CustomLoginView.as_view(), name='login'),
     path('accounts/signup/', CustomSignupView.as_view(), name='signup'),
     path('accounts/logout/', LogoutView.as_view(), name='logout'),
     path('accounts/logout/confirm/', logout_confirmation, name='logout_confirmation'),
-    path('accounts/mfa-selection/continue/login', mfa_selection, name='mfa-selection' ),
-    path('accounts/fingerprint/login', fingerprint_login, name='fingerprint-login'),
-    path('accounts/face/login/', face_login, name='face-login'),
+    *login_urlpatterns(async_views if settings.ASYNC_LOGIN_VIEWS else views),
+    path('accounts/face/identify/', face_identify, name='face-identify'),
+    path('accounts/face/verify/batch/', face_verify_batch, name='face-verify-batch'),
+    path('metrics', metrics, name='metrics'),
 
     path('accounts/', include('allauth.urls')),
 
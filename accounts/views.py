@@ -1,56 +1,47 @@
+import hmac
 import json
+import logging
 import numpy as np
-import struct
-import datetime
 
+from django.conf import settings
 from django.contrib.auth import login, authenticate
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import redirect, render
 from django.urls import reverse
 from django.contrib.auth.models import User
 from django.contrib import messages
+from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
-from django.core.cache import cache
 
 from allauth.account.views import LoginView, SignupView
+from asgiref.sync import iscoroutinefunction
 from functools import wraps
 
+from mfa.codec import decode_descriptor
+from mfa.identification import get_face_descriptor, identify_face
+from mfa.liveness import BurstError, assess_liveness, match_burst, parse_burst
+from fingerprint_service.results import InvalidResult, read_result
+from audit.pipeline import record_event
+from accounts.handoff import claim_handoff, clear_handoff, issue_handoff, read_handoff
+from accounts.metrics import FAILED_LOGINS, MATCH_DISTANCE, time_phase
+from accounts.models import Profile
+from accounts.ratelimit import rate_limit
 from mfa.models import MFAProfile
+from metrics.registry import REGISTRY
+from mfa.routers import biometrics_are_separate, group_by_shard, read_alias
 
-# def rate_limit_logins(view_func):
-#     @wraps(view_func)
-#     def wrapped(request, *args, **kwargs):
-#         ip = request.META.get('REMOTE_ADDR')
-#         key = f'login_attempts:{ip}'
-        
-#         # Get current attempts from cache
-#         attempts = cache.get(key, 0)
-        
-#         if attempts >= 5:  # Max 5 attempts per 15 minutes
-#             return JsonResponse({
-#                 'status': 'error',
-#                 'message': 'Too many login attempts. Please try again later.'
-#             }, status=429)
-            
-#         # Increment attempts
-#         cache.set(key, attempts + 1, 900)  # 15 minutes timeout
-        
-#         return view_func(request, *args, **kwargs)
-#     return wrapped
+FACE_MATCH_THRESHOLD = 0.4
+LIVE_FACE_MIN_VARIATION = 0.1
+FACE_BATCH_MAX_ITEMS = 500
+# Login method -> AuditEvent kind, for failures and successes alike
+AUDIT_KINDS = {'face_id': 'face', 'fingerprint': 'fingerprint'}
+
+logger = logging.getLogger(__name__)
 
 def check_temp_auth(request):
-    temp_auth = request.session.get('temp_auth', False)
-    timestamp = request.session.get('temp_auth_timestamp')
-    if not temp_auth or not timestamp:
-        return False
-    auth_time = datetime.datetime.fromtimestamp(float(timestamp))
-    if datetime.datetime.now() - auth_time > datetime.timedelta(minutes=5):
-        request.session.pop('temp_auth', None)
-        request.session.pop('temp_auth_timestamp', None)
-        request.session.pop('auth_email', None)
-        return False
-    return True
+    """The signed password-step handoff for this request, or None"""
+    return read_handoff(request)
 
 def require_anonymous(view_func):
     @wraps(view_func)
@@ -62,30 +53,74 @@ def require_anonymous(view_func):
     return wrapper
 
 def require_temp_auth(view_func):
-    @wraps(view_func)
-    def wrapper(request, *args, **kwargs):
-        if not check_temp_auth(request):
+    def reject(request):
+        request.mfa_handoff = check_temp_auth(request)
+        if request.mfa_handoff is None:
             messages.error(request, 'Please log in first.')
             return redirect(reverse('login'))
-        return view_func(request, *args, **kwargs)
+        return None
+
+    # The handoff check never touches the database, so async views run it inline
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            return reject(request) or await view_func(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        return reject(request) or view_func(request, *args, **kwargs)
     return wrapper
 
 def is_live_face(face_descriptor):
     try:
         descriptor_array = np.array(face_descriptor)        
         variation = np.std(descriptor_array)
-        if variation < 0.1:
+        if variation < LIVE_FACE_MIN_VARIATION:
             return False
         return True
     except:
         return False
 
-def log_failed_login_attempt(user, method, request):
-    try:
-        print(f"Failed login attempt for user {user.email} using {method} from IP {request.META.get('REMOTE_ADDR')}")
-    except:
-        pass
+def match_face(stored_face_array, input_face_array):
+    """(distance, liveness) for one login attempt"""
+    return float(np.linalg.norm(stored_face_array - input_face_array)), is_live_face(input_face_array)
+
+def read_face_frames(data):
+    """
+    (frames, liveness) for a face login body: the descriptors as an (n, dim)
+    array and, for a burst, its Liveness; (None, None) without face data.
+
+    A burst is scored here, before any database lookup. Raises BurstError
+    when it is malformed, or when a single descriptor is sent while
+    FACE_LOGIN_REQUIRE_BURST is on.
+    """
+    if data.get("frames") is not None:
+        burst = parse_burst(data["frames"])
+        liveness = assess_liveness(burst)
+        return burst.descriptors[liveness.frames], liveness
+    if data.get("faceDescriptor"):
+        if getattr(settings, 'FACE_LOGIN_REQUIRE_BURST', True):
+            raise BurstError("Send a burst of frames; single face descriptors are not accepted")
+        return np.asarray(data["faceDescriptor"], dtype=np.float32)[np.newaxis], None
+    return None, None
 
+def verify_face(stored_face_array, input_frames, liveness=None, threshold=FACE_MATCH_THRESHOLD):
+    """(matched, distance, live) for one login attempt, a single descriptor or a burst"""
+    if liveness is None:
+        distance, live = match_face(stored_face_array, input_frames[0])
+        return distance < threshold, distance, live
+    result = match_burst(stored_face_array, input_frames, threshold)
+    return result.matched, float(np.median(result.distances)), liveness.live
+
+def log_failed_login_attempt(user, method, request, **detail):
+    FAILED_LOGINS.inc(method=method)
+    record_event(AUDIT_KINDS[method], 'failure', request=request, user=user, **detail)
+    logger.warning(
+        "Failed login attempt for user %s using %s from IP %s", user.email, method, request.META.get('REMOTE_ADDR')
+    )
+
+@method_decorator(rate_limit(scopes=('ip', 'email')), name='dispatch')
 class CustomLoginView(LoginView):
     template_name = 'account/login.html'
     
@@ -100,10 +135,9 @@ class CustomLoginView(LoginView):
         password = form.cleaned_data.get('password')
         user = authenticate(self.request, username=email, password=password)
         if user is not None:
-            self.request.session['temp_auth'] = True
-            self.request.session['temp_auth_timestamp'] = datetime.datetime.now().timestamp()
-            self.request.session['auth_email'] = email
-            return redirect('mfa-selection')
+            record_event('password', 'success', request=self.request, user=user)
+            # A signed cookie instead of session keys: no session write until MFA succeeds
+            return issue_handoff(redirect('mfa-selection'), user)
         else:
             messages.error(self.request, "Invalid login credentials.")
             return super().form_invalid(form)
@@ -112,85 +146,161 @@ class CustomSignupView(SignupView):
     def dispatch(self, request, *args, **kwargs):
         return super().dispatch(request, *args, **kwargs)
 
+def login_user_queryset(*related_fields):
+    """Users joined to their profiles, loading only what the login flow reads"""
+    if biometrics_are_separate():
+        # MFA profiles live on another database; login_mfa_profile reads them
+        related_fields = [field for field in related_fields if not field.startswith('mfaprofile__')]
+        return User.objects.only('id', 'email', 'username', 'password', 'last_login', *related_fields)
+    return User.objects.select_related('mfaprofile').only(
+        'id', 'email', 'username', 'password', 'last_login', *related_fields
+    )
+
+def login_mfa_profile(user, *related_fields):
+    """The MFA profile for a login_user_queryset user, with the same mfaprofile__ fields"""
+    if not biometrics_are_separate():
+        return user.mfaprofile
+    fields = [field.split('__', 1)[1] for field in related_fields if field.startswith('mfaprofile__')]
+    return MFAProfile.objects.for_login(user).only('user_id', *fields).get(user_id=user.pk)
+
+async def alogin_mfa_profile(user, *related_fields):
+    """Async login_mfa_profile; the joined profile needs no query at all"""
+    if not biometrics_are_separate():
+        return user.mfaprofile
+    fields = [field.split('__', 1)[1] for field in related_fields if field.startswith('mfaprofile__')]
+    return await MFAProfile.objects.for_login(user).only('user_id', *fields).aget(user_id=user.pk)
+
+def stored_face_data(emails):
+    """Yield (email, face_data) for every MFA profile whose user has one of emails"""
+    if not biometrics_are_separate():
+        yield from MFAProfile.objects.filter(user__email__in=emails).values_list('user__email', 'face_data')
+        return
+    emails_by_id = dict(User.objects.filter(email__in=emails).values_list('id', 'email'))
+    for alias, user_ids in group_by_shard(emails_by_id).items():
+        rows = MFAProfile.objects.using(read_alias(alias)).filter(user_id__in=user_ids).values_list('user_id', 'face_data')
+        for user_id, face_data in rows:
+            yield emails_by_id[user_id], face_data
+
 @require_temp_auth
 def mfa_selection(request):
-    email = request.session.get('auth_email') 
-    if not email:
-        return redirect(reverse('login'))
     try:
-        user = User.objects.get(email=email)
-        mfa_profile, created = MFAProfile.objects.get_or_create(user=user)
-        if not mfa_profile.fingerprint_data and not mfa_profile.face_data:
+        mfa_fields = ('mfaprofile__has_face', 'mfaprofile__has_fingerprint')
+        with time_phase('mfa-selection', 'db_lookup'):
+            user = login_user_queryset(
+                'profile__first_name', 'profile__last_name', *mfa_fields
+            ).select_related('profile').get(pk=request.mfa_handoff['uid'])
+            try:
+                mfa_profile = login_mfa_profile(user, *mfa_fields)
+            except MFAProfile.DoesNotExist:
+                mfa_profile, created = MFAProfile.objects.for_user(user).get_or_create(user=user)
+        if not mfa_profile.has_fingerprint and not mfa_profile.has_face:
+            if not claim_handoff(request):
+                messages.error(request, 'Please log in first.')
+                return clear_handoff(redirect(reverse('login')))
             user.backend = 'allauth.account.auth_backends.AuthenticationBackend'
             login(request, user)
             messages.warning(request, "Please set up MFA for enhanced security")
-            return redirect(reverse('profile-home'))
+            return clear_handoff(redirect(reverse('profile-home')))
             
         context = {
             'profile_first_name': user.profile.first_name,
             'profile_last_name': user.profile.last_name,
-            'profile_picture': user.profile.profile_picture,
             'mfa_options': {
-                'fingerprint': bool(mfa_profile.fingerprint_data),
-                'face_id': bool(mfa_profile.face_data),
+                'fingerprint': mfa_profile.has_fingerprint,
+                'face_id': mfa_profile.has_face,
             }
         }
-        return render(request, 'account/mfa-selection.html', context)
-    except (User.DoesNotExist, MFAProfile.DoesNotExist):
+        with time_phase('mfa-selection', 'render'):
+            return render(request, 'account/mfa-selection.html', context)
+    except (User.DoesNotExist, MFAProfile.DoesNotExist, Profile.DoesNotExist):
         messages.error(request, 'User or MFA profile not found')
         return redirect(reverse('login'))
 
 @csrf_exempt
-# @rate_limit_logins
 @require_temp_auth
+@rate_limit()
 def face_login(request):
     if request.method == "POST":
         try:
             data = json.loads(request.body)
-            face_descriptor = data.get("faceDescriptor")
-            email = data.get("email") or request.session.get('auth_email')
-            
-            if not face_descriptor or not email:
+            try:
+                with time_phase('face-login', 'liveness'):
+                    input_frames, liveness = read_face_frames(data)
+            except BurstError as e:
+                return JsonResponse({
+                    "status": "error",
+                    "message": str(e)
+                }, status=400)
+
+            if input_frames is None:
                 return JsonResponse({
                     "status": "error",
-                    "message": "Missing face data or email"
+                    "message": "Missing face data"
                 }, status=400)
+            if liveness is not None and not liveness.live:
+                handoff = request.mfa_handoff
+                record_event(
+                    'face', 'failure', request=request, user=handoff['uid'], email=handoff['email'], reason=liveness.reason
+                )
+                return JsonResponse({
+                    "status": "error",
+                    "message": "Live face check failed",
+                    "reason": liveness.reason
+                }, status=401)
                 
             try:
-                user = User.objects.get(email=email)
-                mfa_profile = MFAProfile.objects.get(user=user)
-                
-                if not mfa_profile.face_data:
+                mfa_fields = ('mfaprofile__has_face', 'mfaprofile__face_dim')
+                # The user comes from the signed handoff, never from the request body
+                with time_phase('face-login', 'db_lookup'):
+                    user = login_user_queryset(*mfa_fields).get(pk=request.mfa_handoff['uid'])
+                    mfa_profile = login_mfa_profile(user, *mfa_fields)
+
+                if not mfa_profile.has_face:
                     return JsonResponse({
                         "status": "error",
                         "message": "Face ID not set up for this user"
                     }, status=400)
-                    
-                input_face_binary = convert_array_to_binary(face_descriptor)
-                stored_face_array = convert_binary_to_array(mfa_profile.face_data)
-                input_face_array = convert_binary_to_array(input_face_binary)
+
+                if input_frames.ndim != 2 or input_frames.shape[1] != mfa_profile.face_dim:
+                    return JsonResponse({
+                        "status": "error",
+                        "message": "Invalid face descriptor"
+                    }, status=400)
+
+                with time_phase('face-login', 'descriptor_load'):
+                    stored_face_array = get_face_descriptor(user.pk)
+                if stored_face_array is None or stored_face_array.shape != input_frames.shape[1:]:
+                    return JsonResponse({
+                        "status": "error",
+                        "message": "Invalid face descriptor"
+                    }, status=400)
                 
-                distance = np.linalg.norm(stored_face_array - input_face_array)
-                threshold = 0.4
-                if distance < threshold:
-                    if not is_live_face(face_descriptor):
+                with time_phase('face-login', 'distance'):
+                    matched, distance, live = verify_face(stored_face_array, input_frames, liveness)
+                MATCH_DISTANCE.observe(distance, view='face-login')
+                if matched:
+                    if not live:
+                        record_event('face', 'failure', request=request, user=user, reason='not_live')
                         return JsonResponse({
                             "status": "error",
                             "message": "Live face check failed"
                         }, status=401)
                         
+                    if not claim_handoff(request):
+                        return clear_handoff(JsonResponse({
+                            "status": "error",
+                            "message": "This login was already completed"
+                        }, status=401))
+
                     user.backend = 'allauth.account.auth_backends.AuthenticationBackend'
                     login(request, user)
+                    record_event('face', 'success', request=request, user=user)
                     messages.success(request, "Face Authentication Successful")
                     
-                    request.session.pop('temp_auth', None)
-                    request.session.pop('temp_auth_timestamp', None)
-                    request.session.pop('auth_email', None)
-                    
-                    return JsonResponse({
+                    return clear_handoff(JsonResponse({
                         "status": "success",
                         "redirect_url": reverse('profile-home')
-                    })
+                    }))
                 else:
                     log_failed_login_attempt(user, 'face_id', request)
                     return JsonResponse({
@@ -221,32 +331,261 @@ def face_login(request):
 
     return render(request, 'account/face-login.html')
 
+@csrf_exempt
+@require_anonymous
+@rate_limit(scopes=('ip',))
+def face_identify(request):
+    """
+    Passwordless login by searching every enrolled face; off unless FACE_IDENTIFY_ENABLED.
+
+    Takes the same body as face_login, and the closest account must match
+    under the stricter FACE_IDENTIFY_THRESHOLD.
+    """
+    if not settings.FACE_IDENTIFY_ENABLED:
+        raise Http404("Face identification is not enabled")
+    if request.method == "POST":
+        try:
+            data = json.loads(request.body)
+            try:
+                input_frames, liveness = read_face_frames(data)
+            except BurstError as e:
+                return JsonResponse({
+                    "status": "error",
+                    "message": str(e)
+                }, status=400)
+
+            if input_frames is None:
+                return JsonResponse({
+                    "status": "error",
+                    "message": "Missing face data"
+                }, status=400)
+            if liveness is not None and not liveness.live:
+                record_event('face', 'failure', request=request, reason=liveness.reason)
+                return JsonResponse({
+                    "status": "error",
+                    "message": "Live face check failed",
+                    "reason": liveness.reason
+                }, status=401)
+
+            try:
+                with time_phase('face-identify', 'search'):
+                    candidates = identify_face(input_frames.mean(axis=0), k=1)
+            except ValueError as e:
+                return JsonResponse({
+                    "status": "error",
+                    "message": str(e)
+                }, status=400)
+
+            stored_face_array = get_face_descriptor(candidates[0][0]) if candidates else None
+            matched, live = False, False
+            if stored_face_array is not None and stored_face_array.shape == input_frames.shape[1:]:
+                matched, distance, live = verify_face(
+                    stored_face_array, input_frames, liveness, threshold=settings.FACE_IDENTIFY_THRESHOLD
+                )
+                MATCH_DISTANCE.observe(distance, view='face-identify')
+            if not matched:
+                record_event('face', 'failure', request=request, reason='not_recognised')
+                return JsonResponse({
+                    "status": "error",
+                    "message": "Face not recognised"
+                }, status=401)
+
+            if not live:
+                record_event('face', 'failure', request=request, user=candidates[0][0], reason='not_live')
+                return JsonResponse({
+                    "status": "error",
+                    "message": "Live face check failed"
+                }, status=401)
+
+            user = User.objects.get(pk=candidates[0][0])
+            user.backend = 'allauth.account.auth_backends.AuthenticationBackend'
+            login(request, user)
+            record_event('face', 'success', request=request, user=user, identified=True)
+            messages.success(request, "Face Authentication Successful")
+
+            return JsonResponse({
+                "status": "success",
+                "redirect_url": reverse('profile-home')
+            })
+        except User.DoesNotExist:
+            return JsonResponse({
+                "status": "error",
+                "message": "User not found"
+            }, status=404)
+        except json.JSONDecodeError:
+            return JsonResponse({
+                "status": "error",
+                "message": "Invalid JSON data"
+            }, status=400)
+        except Exception as e:
+            return JsonResponse({
+                "status": "error",
+                "message": str(e)
+            }, status=500)
+
+    return render(request, 'account/face-login.html', {'identify': True})
+
+def has_gateway_key(request):
+    supplied = request.headers.get('X-Gateway-Key', '')
+    return any(hmac.compare_digest(supplied, key) for key in settings.FACE_GATEWAY_API_KEYS)
+
+@csrf_exempt
+def face_verify_batch(request):
+    if request.method != "POST":
+        return JsonResponse({"status": "error", "message": "Method not allowed"}, status=405)
+    if not has_gateway_key(request):
+        return JsonResponse({"status": "error", "message": "Invalid gateway key"}, status=403)
+
+    try:
+        items = json.loads(request.body).get("items")
+    except (json.JSONDecodeError, AttributeError):
+        return JsonResponse({"status": "error", "message": "Invalid JSON data"}, status=400)
+    if not isinstance(items, list) or not items:
+        return JsonResponse({"status": "error", "message": "Missing items"}, status=400)
+    if len(items) > FACE_BATCH_MAX_ITEMS:
+        return JsonResponse({
+            "status": "error",
+            "message": f"At most {FACE_BATCH_MAX_ITEMS} items per batch"
+        }, status=400)
+
+    results = [None] * len(items)
+    pending = []
+    for position, item in enumerate(items):
+        email = item.get("email") if isinstance(item, dict) else None
+        descriptor = item.get("faceDescriptor") if isinstance(item, dict) else None
+        if not isinstance(email, str) or not email or not descriptor:
+            results[position] = {"status": "error", "message": "Missing face data or email"}
+            continue
+        try:
+            array = np.asarray(descriptor, dtype=np.float32)
+        except (TypeError, ValueError):
+            array = None
+        if array is None or array.ndim != 1 or not np.all(np.isfinite(array)):
+            results[position] = {"status": "error", "message": "Invalid face descriptor"}
+            continue
+        pending.append((position, email, array))
+
+    # One query for every profile in the batch
+    emails = {email for _, email, _ in pending}
+    stored = {}
+    duplicated = set()
+    with time_phase('face-verify-batch', 'db_lookup'):
+        for email, face_data in stored_face_data(emails):
+            if email in stored:
+                duplicated.add(email)
+            stored[email] = face_data
+
+    matched, stored_arrays, input_arrays = [], [], []
+    for position, email, array in pending:
+        if email in duplicated:
+            results[position] = {"status": "error", "message": "Email is not unique"}
+        elif email not in stored:
+            results[position] = {"status": "error", "message": "User not found"}
+        elif not stored[email]:
+            results[position] = {"status": "error", "message": "Face ID not set up for this user"}
+        else:
+            try:
+                with time_phase('face-verify-batch', 'descriptor_decode'):
+                    stored_array = decode_descriptor(stored[email])
+            except ValueError:
+                # A corrupt or truncated blob fails its own item, not the batch
+                logger.warning("Unreadable stored face descriptor for %s", email)
+                results[position] = {"status": "error", "message": "Stored face data is unreadable"}
+                continue
+            if stored_array.shape != array.shape:
+                results[position] = {"status": "error", "message": "Invalid face descriptor"}
+                continue
+            matched.append(position)
+            stored_arrays.append(stored_array)
+            input_arrays.append(array)
+
+    if matched:
+        with time_phase('face-verify-batch', 'distance'):
+            inputs = np.vstack(input_arrays)
+            distances = np.linalg.norm(np.vstack(stored_arrays) - inputs, axis=1)
+            live = np.std(inputs, axis=1) >= LIVE_FACE_MIN_VARIATION
+        for position, distance, is_live in zip(matched, distances.tolist(), live.tolist()):
+            MATCH_DISTANCE.observe(distance, view='face-verify-batch')
+            if distance >= FACE_MATCH_THRESHOLD:
+                results[position] = {"status": "error", "message": "Face verification failed"}
+            elif not is_live:
+                results[position] = {"status": "error", "message": "Live face check failed"}
+            else:
+                results[position] = {"status": "success"}
+            results[position]["distance"] = round(distance, 4)
+
+    for position, item in enumerate(items):
+        results[position]["index"] = position
+        if isinstance(item, dict) and isinstance(item.get("email"), str):
+            results[position]["email"] = item["email"]
+
+    return JsonResponse({"status": "success", "results": results})
+
 @require_temp_auth
-# @rate_limit_logins
+@rate_limit(methods=None)
 def fingerprint_login(request):
-    email = request.session.get('auth_email')
     try:
-        user = User.objects.get(email=email)
-        mfa_profile = MFAProfile.objects.get(user=user)
-        if not mfa_profile.fingerprint_data:
+        user = login_user_queryset('mfaprofile__has_fingerprint').get(pk=request.mfa_handoff['uid'])
+        if not login_mfa_profile(user, 'mfaprofile__has_fingerprint').has_fingerprint:
             messages.error(request, "Fingerprint not set up for this user")
             return redirect(reverse('mfa-selection'))
     except (User.DoesNotExist, MFAProfile.DoesNotExist):
         messages.error(request, "User profile not found")
         return redirect(reverse('login'))
-        
-    return render(request, 'account/fingerprint-login.html')
 
-def convert_array_to_binary(array_data):
-    if isinstance(array_data, list):
-        array_data = np.array(array_data, dtype=np.float32)
-    return struct.pack('f' * len(array_data), *array_data)
+    if request.method == "POST":
+        return complete_fingerprint_login(request, user)
+    return render(request, 'account/fingerprint-login.html', {'email': request.mfa_handoff['email']})
+
+def complete_fingerprint_login(request, user):
+    """Log user in on a verification result the fingerprint service signed, auditing either outcome"""
+    if not settings.FINGERPRINT_RESULT_KEY:
+        return JsonResponse({
+            "status": "error",
+            "message": "Fingerprint login is not configured"
+        }, status=503)
+    try:
+        token = json.loads(request.body).get("result")
+        result = read_result(settings.FINGERPRINT_RESULT_KEY, token, settings.FINGERPRINT_RESULT_MAX_AGE)
+    except (json.JSONDecodeError, AttributeError, InvalidResult) as e:
+        log_failed_login_attempt(user, 'fingerprint', request, reason=str(e))
+        return JsonResponse({
+            "status": "error",
+            "message": "Invalid fingerprint result"
+        }, status=400)
+
+    if result['email'] != request.mfa_handoff['email'] or result['outcome'] != 'success':
+        log_failed_login_attempt(user, 'fingerprint', request)
+        return JsonResponse({
+            "status": "error",
+            "message": "Fingerprint verification failed"
+        }, status=401)
 
-def convert_binary_to_array(binary_data):
-    float_count = len(binary_data) // struct.calcsize('f')
-    unpacked_data = struct.unpack('f' * float_count, binary_data)
-    return np.array(unpacked_data, dtype=np.float32)
+    if not claim_handoff(request):
+        return clear_handoff(JsonResponse({
+            "status": "error",
+            "message": "This login was already completed"
+        }, status=401))
+
+    user.backend = 'allauth.account.auth_backends.AuthenticationBackend'
+    login(request, user)
+    record_event(AUDIT_KINDS['fingerprint'], 'success', request=request, user=user)
+    messages.success(request, "Fingerprint Authentication Successful")
+    return clear_handoff(JsonResponse({
+        "status": "success",
+        "redirect_url": reverse('profile-home')
+    }))
 
 @login_required
 def logout_confirmation(request):
-    return render(request, 'account/logout_confirmation.html')
\ No newline at end of file
+    return render(request, 'account/logout_confirmation.html')
+
+def has_metrics_token(request):
+    scheme, _, supplied = request.headers.get('Authorization', '').partition(' ')
+    return scheme == 'Bearer' and any(hmac.compare_digest(supplied, token) for token in settings.METRICS_TOKENS)
+
+def metrics(request):
+    """This process's counters and histograms in the Prometheus text format"""
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS and not has_metrics_token(request):
+        return HttpResponse(status=403)
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
\ No newline at end of file
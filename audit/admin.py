@@ -0,0 +1,14 @@
+from django.contrib import admin
+
+from audit.models import AuditEvent
+
+
+@admin.register(AuditEvent)
+class AuditEventAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'kind', 'outcome', 'email', 'user_id', 'ip', 'path')
+    list_filter = ('kind', 'outcome')
+    search_fields = ('email', 'ip')
+    date_hierarchy = 'created_at'
+
+    def has_change_permission(self, request, obj=None):
+        return False
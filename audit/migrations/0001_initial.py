@@ -0,0 +1,32 @@
+# Generated by Django 5.1.15 on 2026-10-18 08:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(db_index=True)),
+                ('kind', models.CharField(choices=[('password', 'Password'), ('face', 'Face login'), ('fingerprint', 'Fingerprint login'), ('face_enrollment', 'Face enrollment'), ('fingerprint_enrollment', 'Fingerprint enrollment'), ('rate_limit', 'Rate limit')], max_length=32)),
+                ('outcome', models.CharField(choices=[('success', 'Success'), ('failure', 'Failure')], max_length=16)),
+                ('user_id', models.PositiveIntegerField(blank=True, db_index=True, null=True)),
+                ('email', models.CharField(blank=True, max_length=254)),
+                ('ip', models.GenericIPAddressField(blank=True, null=True)),
+                ('path', models.CharField(blank=True, max_length=200)),
+                ('detail', models.JSONField(blank=True, default=dict)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['kind', 'outcome', 'created_at'], name='audit_audit_kind_7ea0bd_idx')],
+            },
+        ),
+    ]
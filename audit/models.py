@@ -0,0 +1,31 @@
+from django.db import models
+
+
+class AuditEvent(models.Model):
+    KINDS = [
+        ('password', 'Password'),
+        ('face', 'Face login'),
+        ('fingerprint', 'Fingerprint login'),
+        ('face_enrollment', 'Face enrollment'),
+        ('fingerprint_enrollment', 'Fingerprint enrollment'),
+        ('rate_limit', 'Rate limit'),
+    ]
+    OUTCOMES = [('success', 'Success'), ('failure', 'Failure')]
+
+    # When it happened, not when the batch was written
+    created_at = models.DateTimeField(db_index=True)
+    kind = models.CharField(max_length=32, choices=KINDS)
+    outcome = models.CharField(max_length=16, choices=OUTCOMES)
+    # Plain ids and a copy of the email: the trail has to outlive the account
+    user_id = models.PositiveIntegerField(null=True, blank=True, db_index=True)
+    email = models.CharField(max_length=254, blank=True)
+    ip = models.GenericIPAddressField(null=True, blank=True)
+    path = models.CharField(max_length=200, blank=True)
+    detail = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['kind', 'outcome', 'created_at'])]
+
+    def __str__(self):
+        return f"{self.kind} {self.outcome} for {self.email or self.user_id} at {self.created_at:%Y-%m-%d %H:%M:%S}"
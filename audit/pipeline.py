@@ -0,0 +1,266 @@
+"""
+Buffered recording of security audit events.
+
+``record_event`` only appends to an in-memory buffer, so a login never
+waits on an audit write. A background thread drains the buffer whenever it
+holds ``AUDIT_BATCH_SIZE`` events or ``AUDIT_FLUSH_INTERVAL`` seconds have
+passed, writing each batch with one ``bulk_create`` into ``AuditEvent`` and
+appending it to the JSON-lines file at ``AUDIT_LOG_FILE``, which rotates
+at ``AUDIT_LOG_MAX_BYTES`` keeping ``AUDIT_LOG_BACKUPS`` old files.
+
+The buffer holds at most ``AUDIT_BUFFER_SIZE`` events. When it is full a
+recorder waits up to ``AUDIT_FULL_WAIT`` seconds for the flusher to make
+room, then drops the event and counts it in
+``bioauth_audit_events_dropped_total``. A batch the database cannot take
+right now (``OperationalError``) is kept, counting against that bound, and
+stored again at the next flush; it is not appended to the file twice. A
+batch the database refuses outright is split until the events it will
+not take are found; those stay in the file only and are counted in
+``bioauth_audit_events_refused_total``. Text is cut to the column lengths
+before it is buffered, so an oversized email never gets that far.
+``close`` runs at interpreter exit and writes whatever is left.
+
+With ``AUDIT_BACKGROUND_FLUSH`` off there is no thread: the recorder that
+fills a batch writes it, and the rest waits for ``flush`` or ``close``.
+"""
+import atexit
+import ipaddress
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import DatabaseError, OperationalError, close_old_connections, transaction
+from django.utils import timezone
+
+from audit.sink import JSONLinesSink
+from metrics.registry import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+EVENTS = REGISTRY.counter('bioauth_audit_events_total', "Audit events recorded by kind and outcome", ('kind', 'outcome'))
+DROPPED = REGISTRY.counter('bioauth_audit_events_dropped_total', "Audit events dropped because the buffer was full")
+REFUSED = REGISTRY.counter('bioauth_audit_events_refused_total', "Audit events the database would not store")
+FLUSH_SECONDS = REGISTRY.histogram('bioauth_audit_flush_seconds', "Time to write one batch of audit events")
+
+
+# Text columns cut to their max_length before an event is buffered
+TEXT_FIELDS = ('kind', 'outcome', 'email', 'path')
+
+
+def client_ip(request):
+    ip = request.META.get('REMOTE_ADDR') if request is not None else None
+    try:
+        return str(ipaddress.ip_address(ip)) if ip else None
+    except ValueError:
+        return None
+
+
+def fit_to_columns(event):
+    """event with its text cut to the column lengths; email and path come from the client"""
+    from audit.models import AuditEvent
+
+    for name in TEXT_FIELDS:
+        event[name] = event[name][:AuditEvent._meta.get_field(name).max_length]
+    return event
+
+
+class AuditPipeline:
+    def __init__(self, batch_size=500, flush_interval=2.0, buffer_size=50_000, full_wait=0.05, sink=None,
+                 background=True):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.full_wait = full_wait
+        self.sink = sink
+        self.background = background
+        self._buffer = deque()
+        # Batches already in the file whose database write failed, oldest first
+        self._retry = deque()
+        self._retry_count = 0
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def _held(self):
+        return len(self._buffer) + self._retry_count
+
+    def _wait_for_room(self):
+        """With the condition held: False when the buffer stayed full for full_wait seconds"""
+        if self._held() < self.buffer_size:
+            return True
+        self._condition.notify_all()
+        deadline = time.monotonic() + self.full_wait
+        while self._held() >= self.buffer_size and time.monotonic() < deadline:
+            self._condition.wait(deadline - time.monotonic())
+        return self._held() < self.buffer_size
+
+    def record(self, event):
+        """Queue one event dict; waits at most full_wait when the buffer is full"""
+        with self._condition:
+            closed = self._closed
+            if not closed:
+                if not self._wait_for_room():
+                    DROPPED.inc()
+                    return
+                self._buffer.append(event)
+                full = len(self._buffer) >= self.batch_size
+                if self.background:
+                    if full:
+                        self._condition.notify_all()
+                    self._start()
+        if closed:
+            # After close nothing flushes in the background any more
+            self._write([event])
+        elif full and not self.background:
+            self.flush()
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='audit-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._closed and len(self._buffer) < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+                if self._closed:
+                    return
+            self.flush()
+            # The thread keeps one connection; drop it if the database closed it
+            close_old_connections()
+
+    def _take(self):
+        with self._condition:
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            # Wake recorders waiting for room
+            self._condition.notify_all()
+            return batch
+
+    def _store(self, batch):
+        """Store batch; returns (events stored, events to retry once the database is back)"""
+        from audit.models import AuditEvent
+
+        try:
+            with transaction.atomic():
+                AuditEvent.objects.bulk_create([AuditEvent(**event) for event in batch])
+        except OperationalError:
+            logger.warning("Could not store %d audit events; retrying on the next flush", len(batch))
+            return 0, batch
+        except DatabaseError:
+            if len(batch) == 1:
+                logger.exception("Database refused an audit event; it is only in the log file: %r", batch[0])
+                REFUSED.inc()
+                return 0, []
+            # Halve until the events it will never take are found; store the rest
+            middle = len(batch) // 2
+            first, first_retry = self._store(batch[:middle])
+            second, second_retry = self._store(batch[middle:])
+            return first + second, first_retry + second_retry
+        return len(batch), []
+
+    def _write(self, batch):
+        """Append batch to the file and store it, returning what _store does"""
+        with FLUSH_SECONDS.time():
+            if self.sink is not None:
+                try:
+                    self.sink.write(batch)
+                except OSError:
+                    logger.exception("Could not append %d audit events to the log file", len(batch))
+            return self._store(batch)
+
+    def flush(self):
+        """Write everything buffered so far, batch by batch; returns how many events were stored"""
+        written = 0
+        with self._flush_lock:
+            while self._retry:
+                batch = self._retry[0]
+                stored, remaining = self._store(batch)
+                with self._condition:
+                    self._retry.popleft()
+                    self._retry_count -= len(batch)
+                    if remaining:
+                        self._retry.appendleft(remaining)
+                        self._retry_count += len(remaining)
+                    self._condition.notify_all()
+                written += stored
+                if remaining:
+                    return written
+            while True:
+                batch = self._take()
+                if not batch:
+                    return written
+                stored, remaining = self._write(batch)
+                written += stored
+                if remaining:
+                    with self._condition:
+                        self._retry.append(remaining)
+                        self._retry_count += len(remaining)
+                    return written
+
+    def close(self, timeout=5.0):
+        """Stop the thread and write what is left; later events are written synchronously"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+        if self.sink is not None:
+            self.sink.close()
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline():
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                path = getattr(settings, 'AUDIT_LOG_FILE', None)
+                _pipeline = AuditPipeline(
+                    batch_size=settings.AUDIT_BATCH_SIZE,
+                    flush_interval=settings.AUDIT_FLUSH_INTERVAL,
+                    buffer_size=settings.AUDIT_BUFFER_SIZE,
+                    full_wait=settings.AUDIT_FULL_WAIT,
+                    sink=JSONLinesSink(path, settings.AUDIT_LOG_MAX_BYTES, settings.AUDIT_LOG_BACKUPS) if path else None,
+                    background=settings.AUDIT_BACKGROUND_FLUSH,
+                )
+                atexit.register(_pipeline.close)
+    return _pipeline
+
+
+def reset_pipeline():
+    """Write out and discard the current pipeline so the next event builds one from settings"""
+    global _pipeline
+    with _pipeline_lock:
+        pipeline, _pipeline = _pipeline, None
+    if pipeline is not None:
+        atexit.unregister(pipeline.close)
+        pipeline.close()
+
+
+def record_event(kind, outcome, request=None, user=None, email='', **detail):
+    """
+    Record that a `kind` of security event ended in `outcome` ('success' or 'failure').
+
+    ``user`` may be a User or a user id; extra keyword arguments go into the
+    event's ``detail``.
+    """
+    EVENTS.inc(kind=kind, outcome=outcome)
+    user_id = getattr(user, 'pk', user)
+    get_pipeline().record(fit_to_columns({
+        'created_at': timezone.now(),
+        'kind': kind,
+        'outcome': outcome,
+        'user_id': user_id,
+        'email': email or getattr(user, 'email', '') or '',
+        'ip': client_ip(request),
+        'path': request.path if request is not None else '',
+        'detail': detail,
+    }))
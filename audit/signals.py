@@ -0,0 +1,11 @@
+from django.contrib.auth.signals import user_login_failed
+from django.dispatch import receiver
+
+from audit.pipeline import record_event
+
+
+@receiver(user_login_failed)
+def record_password_failure(sender, credentials, request=None, **kwargs):
+    # Django has already masked the password in credentials
+    email = credentials.get('email') or credentials.get('username') or ''
+    record_event('password', 'failure', request=request, email=email)
@@ -0,0 +1,27 @@
+"""
+The JSON-lines audit log, free of Django so the fingerprint service can write it too.
+
+Each line is one event with the ``AuditEvent`` columns as keys and
+``created_at`` in ISO 8601. Rotation is not coordinated between
+processes, so every process writing events needs its own file.
+"""
+import json
+import logging
+from logging.handlers import RotatingFileHandler
+
+
+class JSONLinesSink:
+    """Appends one JSON object per line, rotating by size"""
+
+    def __init__(self, path, max_bytes, backups):
+        self.handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8', delay=True)
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+
+    def write(self, events):
+        for event in events:
+            line = json.dumps(dict(event, created_at=event['created_at'].isoformat()), sort_keys=True)
+            # The handler rotates between lines and serializes writers
+            self.handler.emit(logging.makeLogRecord({'msg': line}))
+
+    def close(self):
+        self.handler.close()
@@ -0,0 +1,25 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from audit.pipeline import reset_pipeline
+
+
+class AuditTestRunner(DiscoverRunner):
+    """
+    Keeps audit events away from the flush thread and the log file during tests.
+
+    The thread writes on its own connection, which SQLite test databases
+    lock out while a test case holds its transaction, so tests flush
+    synchronously on the connection that recorded the events.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.audit_settings = override_settings(AUDIT_BACKGROUND_FLUSH=False, AUDIT_LOG_FILE=None)
+        self.audit_settings.enable()
+        reset_pipeline()
+
+    def teardown_test_environment(self, **kwargs):
+        reset_pipeline()
+        self.audit_settings.disable()
+        super().teardown_test_environment(**kwargs)
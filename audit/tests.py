@@ -0,0 +1,188 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.db import OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.handoff import HANDOFF_COOKIE, make_handoff_token
+from accounts.loadtest import synthetic_burst
+from accounts.ratelimit import clear_rate_limits
+from audit.models import AuditEvent
+from audit.pipeline import DROPPED, REFUSED, AuditPipeline, get_pipeline, record_event
+from audit.sink import JSONLinesSink
+from fingerprint_service.results import sign_result
+from mfa.codec import encode_descriptor
+
+
+def make_event(number=0, kind='face', outcome='failure'):
+    return {
+        'created_at': timezone.now(), 'kind': kind, 'outcome': outcome, 'user_id': number,
+        'email': f'user{number}@example.com', 'ip': '127.0.0.1', 'path': '/accounts/face/login/', 'detail': {},
+    }
+
+
+def read_lines(path):
+    with open(path) as log_file:
+        return [json.loads(line) for line in log_file]
+
+
+class AuditPipelineTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'audit.jsonl')
+
+    def test_batches_are_written_once_full(self):
+        pipeline = AuditPipeline(batch_size=3, background=False, sink=JSONLinesSink(self.path, 10**6, 1))
+        self.addCleanup(pipeline.sink.close)
+        pipeline.record(make_event(1))
+        pipeline.record(make_event(2))
+        self.assertEqual(AuditEvent.objects.count(), 0)
+        pipeline.record(make_event(3))
+        self.assertEqual(sorted(AuditEvent.objects.values_list('user_id', flat=True)), [1, 2, 3])
+        self.assertEqual([line['user_id'] for line in read_lines(self.path)], [1, 2, 3])
+
+    def test_full_buffer_drops_instead_of_blocking(self):
+        pipeline = AuditPipeline(batch_size=10, buffer_size=2, full_wait=0.01, background=False)
+        dropped = DROPPED.value()
+        for number in range(3):
+            pipeline.record(make_event(number))
+        self.assertEqual(DROPPED.value(), dropped + 1)
+        self.assertEqual(pipeline.flush(), 2)
+
+    def test_refused_batch_is_retried_without_repeating_file_lines(self):
+        pipeline = AuditPipeline(batch_size=10, background=False, sink=JSONLinesSink(self.path, 10**6, 1))
+        self.addCleanup(pipeline.sink.close)
+        pipeline.record(make_event(1))
+        with mock.patch.object(AuditEvent.objects, 'bulk_create', side_effect=OperationalError("locked")), \
+                self.assertLogs('audit.pipeline', 'WARNING'):
+            self.assertEqual(pipeline.flush(), 0)
+        pipeline.record(make_event(2))
+        self.assertEqual(pipeline.flush(), 2)
+        self.assertEqual(AuditEvent.objects.count(), 2)
+        self.assertEqual(len(read_lines(self.path)), 2)
+
+    def test_refused_events_do_not_hold_up_the_rest(self):
+        pipeline = AuditPipeline(batch_size=4, background=False, sink=JSONLinesSink(self.path, 10**6, 1))
+        self.addCleanup(pipeline.sink.close)
+        refused = REFUSED.value()
+        # user_id is a positive integer column; the database will never take -1
+        events = [make_event(1), make_event(-1), make_event(3), make_event(4)]
+        with self.assertLogs('audit.pipeline', 'ERROR'):
+            for event in events:
+                pipeline.record(event)
+        self.assertEqual(REFUSED.value(), refused + 1)
+        self.assertEqual(sorted(AuditEvent.objects.values_list('user_id', flat=True)), [1, 3, 4])
+        self.assertEqual(len(read_lines(self.path)), 4)
+
+        pipeline.record(make_event(5))
+        self.assertEqual(pipeline.flush(), 1)
+        self.assertEqual(AuditEvent.objects.count(), 4)
+
+    def test_client_supplied_text_is_cut_to_the_columns(self):
+        # Leftovers from earlier tests
+        get_pipeline().flush()
+        AuditEvent.objects.all().delete()
+        record_event('rate_limit', 'failure', email='a' * 1000 + '@example.com')
+        get_pipeline().flush()
+        self.assertEqual(AuditEvent.objects.get().email, 'a' * 254)
+
+    def test_log_file_rotates_by_size(self):
+        sink = JSONLinesSink(self.path, max_bytes=500, backups=2)
+        self.addCleanup(sink.close)
+        sink.write([make_event(number) for number in range(20)])
+        self.assertEqual(sorted(os.listdir(self.directory)), ['audit.jsonl', 'audit.jsonl.1', 'audit.jsonl.2'])
+        self.assertLessEqual(os.path.getsize(self.path), 500)
+
+
+class AuditBackgroundFlushTests(TransactionTestCase):
+    def test_thread_flushes_on_interval_and_close_writes_the_rest(self):
+        pipeline = AuditPipeline(batch_size=100, flush_interval=0.05)
+        pipeline.record(make_event(1))
+        deadline = time.monotonic() + 5
+        while not AuditEvent.objects.exists() and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(AuditEvent.objects.count(), 1)
+
+        pipeline.flush_interval = 3600
+        pipeline.record(make_event(2))
+        pipeline.close()
+        self.assertEqual(AuditEvent.objects.count(), 2)
+        # Events after close are written straight away
+        pipeline.record(make_event(3))
+        self.assertEqual(AuditEvent.objects.count(), 3)
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    LOGIN_RATE_LIMITS={'ip': (4, 60), 'email': (10, 60), 'user': (10, 60)},
+)
+class LoginAuditTests(TestCase):
+    def setUp(self):
+        clear_rate_limits()
+        # Leftovers from earlier tests
+        get_pipeline().flush()
+        AuditEvent.objects.all().delete()
+        self.descriptor = (np.random.default_rng(0).standard_normal(128) * 0.15).astype(np.float32)
+        self.user = User.objects.create_user(username='ada@example.com', email='ada@example.com', password='pw')
+        profile = self.user.mfaprofile
+        profile.face_data = encode_descriptor(self.descriptor)
+        profile.save()
+
+    def events(self):
+        get_pipeline().flush()
+        return list(AuditEvent.objects.order_by('created_at', 'id').values_list('kind', 'outcome', 'email'))
+
+    def post_face(self, descriptor):
+        self.client.cookies[HANDOFF_COOKIE] = make_handoff_token(self.user)
+        return self.client.post(
+            reverse('face-login'), json.dumps({'frames': synthetic_burst(descriptor)}), content_type='application/json'
+        )
+
+    def test_login_steps_and_rate_limit_hits_are_recorded(self):
+        self.client.post(reverse('login'), {'login': 'ada@example.com', 'password': 'wrong'})
+        self.client.post(reverse('login'), {'login': 'ada@example.com', 'password': 'pw'})
+        self.assertEqual(self.post_face(self.descriptor + 1).status_code, 401)
+        self.assertEqual(self.post_face(self.descriptor).json()['status'], 'success')
+        self.assertEqual(self.post_face(self.descriptor).status_code, 429)
+        self.assertEqual(self.events(), [
+            ('password', 'failure', 'ada@example.com'),
+            ('password', 'success', 'ada@example.com'),
+            ('face', 'failure', 'ada@example.com'),
+            ('face', 'success', 'ada@example.com'),
+            ('rate_limit', 'failure', 'ada@example.com'),
+        ])
+        self.assertFalse(any(AuditEvent.objects.filter(kind='password').values_list('detail', flat=True)))
+
+    @override_settings(FINGERPRINT_RESULT_KEY='shared-key')
+    def test_fingerprint_login_outcomes_are_recorded(self):
+        profile = self.user.mfaprofile
+        profile.fingerprint_data = b'template'
+        profile.save()
+        self.client.cookies[HANDOFF_COOKIE] = make_handoff_token(self.user)
+        for outcome in ('failure', 'success'):
+            self.client.post(
+                reverse('fingerprint-login'), json.dumps({'result': sign_result('shared-key', 'ada@example.com', outcome)}),
+                content_type='application/json',
+            )
+        self.assertEqual(self.events(), [
+            ('fingerprint', 'failure', 'ada@example.com'),
+            ('fingerprint', 'success', 'ada@example.com'),
+        ])
+
+    def test_face_enrollment_is_recorded(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('setup-face'), json.dumps({'facialId': [0.5] * 128}), content_type='application/json')
+        self.client.post(reverse('setup-face'), json.dumps({'facialId': 'not a face'}), content_type='application/json')
+        self.assertEqual(self.events(), [
+            ('face_enrollment', 'success', 'ada@example.com'),
+            ('face_enrollment', 'failure', 'ada@example.com'),
+        ])
@@ -36,11 +36,13 @@ INSTALLED_APPS = [
     'dashboard',
     'mfa',
     'accounts',
+    'audit',
 ]
 
 SITE_ID = 1
 
 MIDDLEWARE = [
+    'accounts.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -78,6 +80,14 @@ DATABASES = {
     }
 }
 
+# Biometric tables (the mfa app) can move off 'default': add the aliases to
+# DATABASES and list them here. Several aliases shard rows by user id, and
+# login-path reads use the replicas listed for a shard. See mfa/routers.py.
+BIOMETRIC_DATABASES = []
+BIOMETRIC_READ_REPLICAS = {}
+
+DATABASE_ROUTERS = ['mfa.routers.BiometricRouter']
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -100,6 +110,15 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Let the front-end server send media files: 'X-Accel-Redirect' for nginx,
+# with an internal location at MEDIA_SENDFILE_PREFIX aliased to MEDIA_ROOT,
+# or 'X-Sendfile' for Apache and lighttpd. None serves them from Django.
+MEDIA_SENDFILE_HEADER = None
+MEDIA_SENDFILE_PREFIX = '/protected-media/'
+
+# Output of `manage.py build_face_models`, served under /mfa/face-models/
+FACE_MODEL_BUNDLE_DIR = BASE_DIR / 'face_models'
+
 LANGUAGE_CODE = 'en-us'
 
 TIME_ZONE = 'UTC'
@@ -126,3 +145,130 @@ LOGOUT_REDIRECT_URL = 'account_login'
 
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
+# Storage precision for enrolled face descriptors: 'float32', 'float16' or 'int8'
+FACE_DESCRIPTOR_STORAGE_DTYPE = 'float32'
+
+# Shared memory-mapped copy of every enrolled face descriptor, e.g.
+# BASE_DIR / 'face_descriptors.bin'. Build it with `manage.py build_descriptor_store`.
+# MFAProfile saves and deletes update it once they commit; writes that skip
+# save(), such as queryset.update() or raw SQL, need a rebuild, since face
+# logins read the store before the database.
+FACE_DESCRIPTOR_STORE_PATH = None
+
+# Trained IVF-PQ index for face identification, e.g. BASE_DIR / 'face_index.npz'.
+# Publish it with `manage.py build_face_index` (rerun it as enrollment grows);
+# below mfa.identification.MIN_INDEX_FACES it is an exact scan instead, and a
+# worker retrains its copy once it holds twice the faces it was trained on.
+# Workers load it at startup and again whenever the file is replaced. Face
+# changes committed since the build reach every worker through the
+# mfa.FaceIndexChange log, so writes that skip save() need a rebuild here too.
+# The log keeps a day of changes (mfa.identification.CHANGE_RETENTION), and a
+# worker rebuilds its own index rather than replay onto one published more
+# than half of that ago, so rerun the command at least every 12 hours.
+# Without a path every worker builds its own on its first identification.
+FACE_INDEX_PATH = None
+
+# After each face enrollment a background scan records every other account
+# whose face is closer than this (see mfa.duplicates); flagging also sets
+# MFAProfile.face_flagged on the enrolling account for review
+FACE_DUPLICATE_THRESHOLD = 0.4
+FACE_DUPLICATE_FLAG_ACCOUNTS = False
+
+# Face logins after the password step must send a burst of frames, which is
+# checked for liveness; a single descriptor could be replayed from a photo.
+# face_identify follows the same rule. Turn off only for old clients.
+FACE_LOGIN_REQUIRE_BURST = True
+
+# Passwordless face login at /accounts/face/identify/, which searches every
+# enrolled account for the closest face. Off unless a deployment opts in.
+# One search across the whole population risks far more false accepts than
+# one comparison after the password step, so it needs a stricter distance
+# than that check's 0.4.
+FACE_IDENTIFY_ENABLED = False
+FACE_IDENTIFY_THRESHOLD = 0.3
+
+# Key shared with the fingerprint service (its --result-key) for the signed
+# verification results that complete a fingerprint login, and how many
+# seconds such a result stays valid. Fingerprint login is off without a key.
+FINGERPRINT_RESULT_KEY = None
+FINGERPRINT_RESULT_MAX_AGE = 60
+
+# Shared secrets accepted in the X-Gateway-Key header of the batch face verification API
+FACE_GATEWAY_API_KEYS = []
+
+# (max attempts, window in seconds) per key for the login and face matching views
+LOGIN_RATE_LIMITS = {
+    'ip': (50, 300),
+    'email': (10, 300),
+    'user': (10, 300),
+}
+
+# Rate-limit counters get their own cache so other entries cannot evict them.
+# Point it at Redis or Memcached when running more than one worker process.
+LOGIN_RATE_LIMIT_CACHE = 'ratelimit'
+
+# Lifetime of the signed cookie that carries a user from the password step to
+# MFA, and the cache holding the nonces of handoffs that were already used.
+# Like the rate-limit cache it must be shared by every worker process; with
+# DEBUG off, startup logs a warning for either one left in local memory.
+MFA_HANDOFF_MAX_AGE = 300
+MFA_HANDOFF_CACHE = 'handoff'
+
+# Serve the MFA login and face setup views from accounts.async_views and
+# mfa.async_views. Turn on when running under ASGI (config.asgi); WSGI
+# servers would run them through a per-request event loop instead.
+ASYNC_LOGIN_VIEWS = False
+
+# Threads comparing face descriptors for the async views; None picks up to 4
+# depending on the CPU count
+FACE_MATCH_WORKERS = None
+
+# Security audit events (see audit.pipeline) are buffered in memory and
+# written in batches by a background thread: once AUDIT_BATCH_SIZE are
+# waiting or every AUDIT_FLUSH_INTERVAL seconds. Past AUDIT_BUFFER_SIZE
+# unwritten events, recorders wait up to AUDIT_FULL_WAIT seconds for room
+# and then drop the event. Batches also go to a size-rotated JSON-lines
+# file; set AUDIT_LOG_FILE to None to keep them in the database only.
+# The test runner turns the background thread and the file off.
+# Fingerprint enrollments and verifications are decided by the fingerprint
+# service, which appends them in the same format to its own file
+# (--audit-log, fingerprint_audit.jsonl by default). Fingerprint logins are
+# recorded here too, both outcomes, when fingerprint_login receives the result.
+AUDIT_BACKGROUND_FLUSH = True
+AUDIT_BATCH_SIZE = 500
+AUDIT_FLUSH_INTERVAL = 2.0
+AUDIT_BUFFER_SIZE = 50_000
+AUDIT_FULL_WAIT = 0.05
+AUDIT_LOG_FILE = BASE_DIR / 'audit.jsonl'
+AUDIT_LOG_MAX_BYTES = 10 * 2**20
+AUDIT_LOG_BACKUPS = 5
+
+TEST_RUNNER = 'audit.testing.AuditTestRunner'
+
+# Clients allowed to scrape /metrics. The numbers are per process, so scrape
+# every worker rather than going through the load balancer.
+# The check uses REMOTE_ADDR, which is the proxy's address when nginx or
+# another reverse proxy on the same host forwards requests: every visitor
+# then looks like 127.0.0.1. Behind such a proxy, empty this list and give
+# the scraper a token from METRICS_TOKENS instead.
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Bearer tokens accepted in the Authorization header of /metrics from any address
+METRICS_TOKENS = []
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'ratelimit': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ratelimit',
+        'OPTIONS': {'MAX_ENTRIES': 100_000},
+    },
+    'handoff': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'handoff',
+        'OPTIONS': {'MAX_ENTRIES': 100_000},
+    },
+}
+
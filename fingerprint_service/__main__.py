@@ -0,0 +1,47 @@
+"""
+Headless fingerprint service daemon.
+
+    python -m fingerprint_service --host 0.0.0.0 --device /dev/ttyUSB0 --db /var/lib/fingerprint.db
+    python -m fingerprint_service --device simulated:convert=0.1 --log-file ''
+
+SIGTERM or SIGINT stops it gracefully: no new connections or commands are
+accepted, in-flight captures get ``--drain-timeout`` seconds to finish, and
+the scanner and template store are closed before exit.
+"""
+import argparse
+import asyncio
+import logging
+import signal
+import sys
+
+from fingerprint_service.service import add_service_arguments, configure_logging, service_from_args
+
+
+async def run(service) -> None:
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, service.request_shutdown)
+    await service.serve()
+
+
+def main(argv=None) -> int:
+    parser = add_service_arguments(argparse.ArgumentParser(
+        prog="python -m fingerprint_service", description="Fingerprint scanner WebSocket service"))
+    args = parser.parse_args(argv)
+    configure_logging(args.log_file)
+
+    try:
+        service = service_from_args(args)
+    except Exception as e:
+        logging.error(f"Service setup failed: {str(e)}")
+        return 1
+    try:
+        asyncio.run(run(service))
+    finally:
+        service.close()
+    logging.info("Service exited")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""
+Encryption keyring and maintenance commands for the fingerprint template store.
+
+The key file holds one Fernet key per line, newest (primary) first; a file
+with a single key is the original ``key.key`` format. New templates are
+encrypted with the primary key and any key in the file can decrypt.
+
+Rotating keys while the service runs::
+
+    python -m fingerprint_service.keys rotate      # add a primary key, re-encrypt every row
+    python -m fingerprint_service.keys rotate      # after an interruption: resumes from the checkpoint
+    python -m fingerprint_service.keys prune       # drop retired keys once nothing uses them
+
+    python -m fingerprint_service.keys migrate     # convert legacy base64 TEXT rows to raw BLOBs
+
+Each batch is its own short write transaction, so the service keeps
+enrolling and verifying during a run. A running service checks the key
+file before every encryption, so new templates use the new primary key
+from then on, and re-reads it when it meets a token its current keys
+cannot decrypt.
+"""
+import argparse
+import hashlib
+import logging
+import os
+import sys
+import threading
+from typing import List
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+
+
+class Keyring:
+    """MultiFernet over a key file, reloaded when the file changes"""
+
+    def __init__(self, path: str = 'key.key'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._signature = None
+        if not os.path.exists(path):
+            self._write([Fernet.generate_key()])
+        self.reload()
+
+    def _read(self) -> List[bytes]:
+        with open(self.path, 'rb') as key_file:
+            return [line.strip() for line in key_file.read().splitlines() if line.strip()]
+
+    def _write(self, keys: List[bytes]) -> None:
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'wb') as key_file:
+            key_file.write(b'\n'.join(keys))
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, self.path)
+
+    def reload(self) -> None:
+        with self._lock:
+            self.keys = self._read()
+            if not self.keys:
+                raise ValueError(f"No keys found in {self.path}")
+            self.cipher = MultiFernet([Fernet(key) for key in self.keys])
+            self._signature = self._stat()
+
+    def _stat(self) -> tuple:
+        # The file is replaced, never edited: a new inode is the reliable sign,
+        # since two writes can land within one mtime tick
+        stat = os.stat(self.path)
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def refresh(self) -> bool:
+        """Reload if the key file changed on disk; True when it did. Costs one stat()"""
+        if self._stat() == self._signature:
+            return False
+        self.reload()
+        return True
+
+    @property
+    def primary_id(self) -> str:
+        return hashlib.sha256(self.keys[0]).hexdigest()[:16]
+
+    def encrypt(self, data: bytes) -> bytes:
+        # A rotation in another process adds a primary key; don't keep using the retired one
+        self.refresh()
+        return self.cipher.encrypt(data)
+
+    def decrypt(self, token: bytes) -> bytes:
+        try:
+            return self.cipher.decrypt(token)
+        except InvalidToken:
+            # Another process may have rotated in a key we have not loaded yet
+            if self.refresh():
+                return self.cipher.decrypt(token)
+            raise
+
+    def rotate(self, token: bytes) -> bytes:
+        return self.cipher.rotate(token)
+
+    def add_primary_key(self) -> None:
+        self._write([Fernet.generate_key()] + self._read())
+        self.reload()
+
+    def prune(self) -> int:
+        """Keep only the primary key, returning how many keys were removed"""
+        removed = len(self.keys) - 1
+        self._write(self.keys[:1])
+        self.reload()
+        return removed
+
+
+def rotation_checkpoint(conn):
+    """Return (primary_key_id, last_row_id) of an unfinished rotation, or None"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS key_rotation (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            primary_key_id TEXT NOT NULL,
+            last_row_id INTEGER NOT NULL
+        )
+    ''')
+    return conn.execute('SELECT primary_key_id, last_row_id FROM key_rotation WHERE id = 1').fetchone()
+
+
+def save_rotation_checkpoint(conn, primary_key_id: str, last_row_id: int) -> None:
+    conn.execute(
+        'INSERT OR REPLACE INTO key_rotation (id, primary_key_id, last_row_id) VALUES (1, ?, ?)',
+        (primary_key_id, last_row_id)
+    )
+
+
+def rotate_templates(store, keyring: Keyring, batch_size: int = 500) -> int:
+    """
+    Re-encrypt every template under the primary key in bounded batches.
+
+    Progress is checkpointed in the ``key_rotation`` table after each batch,
+    so an interrupted run continues where it stopped. Returns the number of
+    rows rewritten by this run.
+    """
+    conn = store.connection()
+    checkpoint = rotation_checkpoint(conn)
+    last_row_id = checkpoint[1] if checkpoint and checkpoint[0] == keyring.primary_id else 0
+
+    rewritten = 0
+    while True:
+        batch = conn.execute(
+            'SELECT id, fingerprint_data FROM fingerprints WHERE id > ? ORDER BY id LIMIT ?',
+            (last_row_id, batch_size)
+        ).fetchall()
+        if not batch:
+            break
+
+        updates = [(store.encode_token(keyring.rotate(store.decode_token(data))), row_id)
+                   for row_id, data in batch]
+        last_row_id = batch[-1][0]
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('UPDATE fingerprints SET fingerprint_data = ? WHERE id = ?', updates)
+            save_rotation_checkpoint(conn, keyring.primary_id, last_row_id)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        rewritten += len(updates)
+        logging.info(f"Re-encrypted {rewritten} templates (last id {last_row_id})")
+
+    conn.execute('DELETE FROM key_rotation')
+    return rewritten
+
+
+def templates_readable_by_primary(store, keyring: Keyring, batch_size: int = 500) -> bool:
+    """True when every stored template decrypts with the primary key alone"""
+    primary = Fernet(keyring.keys[0])
+    conn = store.connection()
+    last_row_id = 0
+    while True:
+        batch = conn.execute(
+            'SELECT id, fingerprint_data FROM fingerprints WHERE id > ? ORDER BY id LIMIT ?',
+            (last_row_id, batch_size)
+        ).fetchall()
+        if not batch:
+            return True
+        for row_id, data in batch:
+            try:
+                primary.decrypt(store.decode_token(data))
+            except InvalidToken:
+                logging.error(f"Template {row_id} is not encrypted with the primary key")
+                return False
+        last_row_id = batch[-1][0]
+
+
+def main(argv=None) -> int:
+    from fingerprint_service.store import TemplateStore
+
+    parser = argparse.ArgumentParser(description="Fingerprint template key management")
+    parser.add_argument('command', choices=['rotate', 'prune', 'migrate'])
+    parser.add_argument('--db', default='fingerprint.db')
+    parser.add_argument('--key-file', default='key.key')
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    keyring = Keyring(args.key_file)
+    store = TemplateStore(args.db, keyring, cache_size=0)
+    try:
+        if args.command == 'rotate':
+            conn = store.connection()
+            checkpoint = rotation_checkpoint(conn)
+            if checkpoint and checkpoint[0] == keyring.primary_id:
+                logging.info(f"Resuming interrupted rotation after row {checkpoint[1]}")
+            else:
+                keyring.add_primary_key()
+                # Record the target key before touching rows so a crash resumes instead of adding another key
+                save_rotation_checkpoint(conn, keyring.primary_id, 0)
+                logging.info(f"Added primary key {keyring.primary_id}")
+            logging.info(f"Rotation finished: {rotate_templates(store, keyring, args.batch_size)} templates")
+        elif args.command == 'prune':
+            if not templates_readable_by_primary(store, keyring, args.batch_size):
+                logging.error("Refusing to prune: run rotate first")
+                return 1
+            logging.info(f"Removed {keyring.prune()} retired keys")
+        else:
+            logging.info(f"Converted {store.migrate_to_blobs(args.batch_size)} templates to BLOB storage")
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+Drive concurrent enroll/verify sessions against a running fingerprint service.
+
+Start the service with a simulated or replayed scanner, for example::
+
+    python -m fingerprint_service --device simulated:convert=0.1 --device simulated:convert=0.1
+
+then run::
+
+    python -m fingerprint_service.loadtest --clients 8 --rounds 5
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, List
+
+import numpy as np
+import websockets
+
+
+async def run_command(url: str, command: str, email: str) -> Dict:
+    started = time.perf_counter()
+    async with websockets.connect(url) as websocket:
+        await websocket.send(json.dumps({'command': command, 'email': email}))
+        while True:
+            reply = json.loads(await websocket.recv())
+            # Progress and queue notices precede the final reply
+            if reply.get('status') in ('info', 'queued') or reply.get('progress') == 100:
+                continue
+            return {'command': command, 'status': reply.get('status'),
+                    'seconds': time.perf_counter() - started}
+
+
+async def client(url: str, number: int, rounds: int, results: List[Dict]) -> None:
+    email = f'loadtest-{number}@example.com'
+    results.append(await run_command(url, 'enroll', email))
+    for _ in range(rounds):
+        results.append(await run_command(url, 'verify', email))
+
+
+def summarize(results: List[Dict], elapsed: float) -> None:
+    print(f"{len(results)} commands in {elapsed:.2f}s ({len(results) / elapsed:.2f}/s)")
+    for command in ('enroll', 'verify'):
+        rows = [r for r in results if r['command'] == command]
+        if not rows:
+            continue
+        seconds = np.array([r['seconds'] for r in rows])
+        ok = sum(r['status'] == 'success' for r in rows)
+        print(f"  {command:<7} n={len(rows):<5} ok={ok:<5} "
+              f"p50={np.percentile(seconds, 50):.3f}s p95={np.percentile(seconds, 95):.3f}s "
+              f"max={seconds.max():.3f}s")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='ws://127.0.0.1:8765')
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=3, help="Verifications per client after enrolling")
+    args = parser.parse_args()
+
+    results: List[Dict] = []
+    started = time.perf_counter()
+    await asyncio.gather(*(client(args.url, n, args.rounds, results) for n in range(args.clients)))
+    summarize(results, time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
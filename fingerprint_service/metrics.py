@@ -0,0 +1,23 @@
+"""
+Fingerprint service metrics, kept in the same registry type as the site's.
+
+Each command is counted by outcome and timed end to end; the phases split
+that time into waiting for a sensor, capturing, decrypting the stored
+template and writing a new one. The ``stats`` WebSocket command returns
+them.
+"""
+from metrics.registry import REGISTRY
+
+COMMANDS = REGISTRY.counter(
+    'fingerprint_commands_total', "WebSocket commands by name and response status", ('command', 'status')
+)
+COMMAND_SECONDS = REGISTRY.histogram(
+    'fingerprint_command_seconds', "Time from receiving a command to sending its response", ('command',)
+)
+PHASE_SECONDS = REGISTRY.histogram(
+    'fingerprint_phase_seconds', "Time spent in each phase of an enrollment or verification", ('phase',)
+)
+
+
+def time_phase(phase):
+    return PHASE_SECONDS.time(phase=phase)
@@ -0,0 +1,184 @@
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from fingerprint_service.worker import CaptureCancelled, ScanJob, ScannerBusy
+
+# Lower runs first: someone at the door waits on a verification, enrollments can queue
+VERIFY = 0
+ENROLL = 1
+
+
+class Device:
+    """One sensor, the thread that owns it and its usage counters"""
+
+    def __init__(self, device_id: Hashable, scanner: Any):
+        self.id = device_id
+        self.scanner = scanner
+        self.current: Optional[ScanJob] = None
+        self.current_started = 0.0
+        self.jobs_done = 0
+        self.busy_seconds = 0.0
+        self.started = time.monotonic()
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def busy(self) -> bool:
+        return self.current is not None
+
+    def utilization(self) -> float:
+        """Share of the device's lifetime spent running jobs"""
+        now = time.monotonic()
+        busy = self.busy_seconds + (now - self.current_started if self.current is not None else 0.0)
+        return busy / max(now - self.started, 1e-9)
+
+
+class QueuedJob:
+    def __init__(self, job: ScanJob, priority: int, device_id: Optional[Hashable], sequence: int):
+        self.job = job
+        self.priority = priority
+        self.device_id = device_id
+        self.sequence = sequence
+        self.queued_at = time.monotonic()
+
+
+class DevicePool:
+    """
+    Runs scanner jobs on several sensors, each owned by its own thread.
+
+    Serial calls such as readImage block for tens of milliseconds each, so
+    they never run on the asyncio loop; coroutines submit jobs and await the
+    resulting futures.
+
+    All devices share one queue. A job pinned to a device only runs there;
+    any other job goes to whichever device frees up first. Verifications
+    run before enrollments, and a job's priority improves by one level for
+    every ``aging`` seconds it waits, so a steady stream of verifications
+    cannot starve enrollment forever.
+    """
+
+    def __init__(self, scanners: Dict[Hashable, Any], max_queue: int = 16, aging: float = 30.0):
+        if not scanners:
+            raise ValueError("A device pool needs at least one scanner")
+        self.devices: Dict[Hashable, Device] = {
+            device_id: Device(device_id, scanner) for device_id, scanner in scanners.items()
+        }
+        # Per device, so adding sensors also adds queue room
+        self.max_queue = max_queue * len(self.devices)
+        self.aging = aging
+        self._queue: List[QueuedJob] = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._stopping = False
+        for device in self.devices.values():
+            device.thread = threading.Thread(target=self._run, args=(device,),
+                                             name=f"scanner-{device.id}", daemon=True)
+            device.thread.start()
+
+    @property
+    def busy(self) -> bool:
+        """True when every device is running a job"""
+        return all(device.busy for device in self.devices.values())
+
+    def queue_depth(self, device_id: Optional[Hashable] = None) -> int:
+        """Jobs waiting for any device, or only those device_id could run"""
+        with self._cond:
+            if device_id is None:
+                return len(self._queue)
+            return sum(1 for queued in self._queue if queued.device_id in (None, device_id))
+
+    def position(self, priority: int = ENROLL, device_id: Optional[Hashable] = None) -> int:
+        """Rough place in line a new job would get; 0 means a device is free for it"""
+        eligible = [self.devices[device_id]] if device_id is not None else list(self.devices.values())
+        with self._cond:
+            ahead = sum(
+                1 for queued in self._queue
+                if queued.priority <= priority and (device_id is None or queued.device_id in (None, device_id))
+            )
+        idle = sum(1 for device in eligible if not device.busy)
+        return 0 if idle > ahead else ahead - idle + 1
+
+    def submit(self, func: Callable[..., Any], *args: Any, priority: int = ENROLL,
+               device_id: Optional[Hashable] = None, timeout: Optional[float] = 60.0) -> ScanJob:
+        """Queue func(scanner, job, *args), optionally pinned to device_id"""
+        if device_id is not None and device_id not in self.devices:
+            raise KeyError(f"Unknown scanner device {device_id}")
+        job = ScanJob(func, args, timeout)
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                raise ScannerBusy("Scanner queue is full")
+            self._queue.append(QueuedJob(job, priority, device_id, next(self._sequence)))
+            self._cond.notify_all()
+        return job
+
+    async def run(self, func: Callable[..., Any], *args: Any, priority: int = ENROLL,
+                  device_id: Optional[Hashable] = None, timeout: Optional[float] = 60.0) -> Any:
+        """Submit a job and await its result, cancelling it if the caller goes away"""
+        job = self.submit(func, *args, priority=priority, device_id=device_id, timeout=timeout)
+        try:
+            return await asyncio.wrap_future(job.future)
+        except asyncio.CancelledError:
+            job.cancelled.set()
+            raise
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Per-device load, for status reports"""
+        return [
+            {
+                'device': device.id,
+                'busy': device.busy,
+                'jobs': device.jobs_done,
+                'utilization': round(device.utilization(), 3),
+                'queue_depth': self.queue_depth(device.id),
+            }
+            for device in self.devices.values()
+        ]
+
+    def _effective_priority(self, queued: QueuedJob, now: float) -> tuple:
+        waited_levels = int((now - queued.queued_at) // self.aging) if self.aging else 0
+        return queued.priority - waited_levels, queued.sequence
+
+    def _next_job(self, device: Device) -> Optional[ScanJob]:
+        with self._cond:
+            while True:
+                candidates = [queued for queued in self._queue if queued.device_id in (None, device.id)]
+                if candidates:
+                    now = time.monotonic()
+                    chosen = min(candidates, key=lambda queued: self._effective_priority(queued, now))
+                    self._queue.remove(chosen)
+                    return chosen.job
+                if self._stopping:
+                    return None
+                self._cond.wait()
+
+    def _run(self, device: Device) -> None:
+        while True:
+            job = self._next_job(device)
+            if job is None:
+                break
+            if job.cancelled.is_set() or not job.future.set_running_or_notify_cancel():
+                continue
+            device.current_started = time.monotonic()
+            device.current = job
+            try:
+                job.check()
+                job.future.set_result(job.func(device.scanner, job, *job.args))
+            except Exception as e:
+                if not isinstance(e, CaptureCancelled):
+                    logging.error(f"Scanner {device.id} job failed: {str(e)}")
+                job.future.set_exception(e)
+            finally:
+                device.busy_seconds += time.monotonic() - device.current_started
+                device.jobs_done += 1
+                device.current = None
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Let queued jobs finish, then stop every device thread"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for device in self.devices.values():
+            device.thread.join(timeout)
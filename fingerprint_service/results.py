@@ -0,0 +1,59 @@
+"""
+Verification results the fingerprint service signs for Django.
+
+The browser talks to the service and relays its verify response to
+Django, so Django only completes a fingerprint login on a result it can
+check: a JSON payload with the email, outcome and issue time, followed by
+an HMAC-SHA256 of it under a key both sides share (``--result-key`` or
+FINGERPRINT_RESULT_KEY here, the FINGERPRINT_RESULT_KEY setting in
+Django). Nothing here imports Django.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import time
+from typing import Any, Dict, Optional
+
+# Seconds a result may claim to be from the future, for clocks slightly apart
+CLOCK_SKEW = 5.0
+
+
+class InvalidResult(ValueError):
+    pass
+
+
+def _encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _mac(key: str, payload: str) -> str:
+    return _encode(hmac.new(key.encode(), payload.encode('ascii'), hashlib.sha256).digest())
+
+
+def sign_result(key: str, email: str, outcome: str, issued_at: Optional[float] = None) -> str:
+    """A token stating that email's verification ended in outcome ('success' or 'failure')"""
+    payload = _encode(json.dumps({
+        'email': email,
+        'outcome': outcome,
+        'issued_at': time.time() if issued_at is None else issued_at,
+    }, sort_keys=True).encode())
+    return f'{payload}.{_mac(key, payload)}'
+
+
+def read_result(key: str, token: Any, max_age: float) -> Dict[str, Any]:
+    """The payload of a token signed with key at most max_age seconds ago; raises InvalidResult otherwise"""
+    if not isinstance(token, str) or '.' not in token:
+        raise InvalidResult("Malformed result")
+    payload, mac = token.rsplit('.', 1)
+    if not hmac.compare_digest(mac, _mac(key, payload)):
+        raise InvalidResult("Bad signature")
+    result = json.loads(_decode(payload))
+    age = time.time() - result['issued_at']
+    if not -CLOCK_SKEW <= age <= max_age:
+        raise InvalidResult("Expired result")
+    return result
@@ -0,0 +1,242 @@
+import json
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+TEMPLATE_SIZE = 512
+
+
+class Scanner(ABC):
+    """
+    The subset of the PyFingerprint API the service relies on.
+
+    Every backend exposes the same camelCase methods so the service code
+    never needs to know whether it is talking to a real sensor.
+    """
+
+    @abstractmethod
+    def verifyPassword(self) -> bool:
+        ...
+
+    @abstractmethod
+    def readImage(self) -> bool:
+        ...
+
+    @abstractmethod
+    def convertImage(self, charBufferNumber: int = 0x01) -> None:
+        ...
+
+    @abstractmethod
+    def downloadCharacteristics(self, charBufferNumber: int = 0x01) -> List[int]:
+        ...
+
+
+class SimulatedScanner(Scanner):
+    """
+    Hardware-free scanner with configurable latencies and deterministic templates.
+
+    A simulated finger stays on the sensor for ``present_polls`` readImage
+    calls and is lifted for ``absent_polls`` calls, so enrollment's
+    place/remove/place cycle completes on its own. Templates depend only on
+    ``seed`` and ``finger``, so the same finger always yields the same bytes.
+    """
+
+    def __init__(self, read_latency: float = 0.05, convert_latency: float = 0.3,
+                 download_latency: float = 0.15, seed: int = 0, finger: int = 0,
+                 present_polls: int = 1, absent_polls: int = 1):
+        self.read_latency = read_latency
+        self.convert_latency = convert_latency
+        self.download_latency = download_latency
+        self.seed = seed
+        self.finger = finger
+        self.present_polls = present_polls
+        self.absent_polls = absent_polls
+        self._polls = 0
+        self._converted: Optional[int] = None
+
+    def template_for(self, finger: int) -> List[int]:
+        rng = np.random.default_rng([self.seed, finger])
+        return rng.integers(0, 256, TEMPLATE_SIZE, dtype=np.uint8).tolist()
+
+    def verifyPassword(self) -> bool:
+        return True
+
+    def readImage(self) -> bool:
+        time.sleep(self.read_latency)
+        cycle = self.present_polls + self.absent_polls
+        present = self._polls % cycle < self.present_polls
+        self._polls += 1
+        if present:
+            self._converted = None
+        return present
+
+    def convertImage(self, charBufferNumber: int = 0x01) -> None:
+        time.sleep(self.convert_latency)
+        self._converted = self.finger
+
+    def downloadCharacteristics(self, charBufferNumber: int = 0x01) -> List[int]:
+        time.sleep(self.download_latency)
+        if self._converted is None:
+            raise Exception("No image converted into the char buffer")
+        return self.template_for(self._converted)
+
+
+class RecordingScanner(Scanner):
+    """
+    Pass-through wrapper that writes every device call to a JSONL session file.
+
+    Each service start records a fresh session over any earlier one, since
+    replay expects a single session beginning with verifyPassword.
+    """
+
+    def __init__(self, scanner: Any, path: str):
+        self.scanner = scanner
+        self.path = path
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self._file = open(path, 'w', encoding='utf-8')
+
+    def _call(self, method: str, *args: Any) -> Any:
+        offset = time.monotonic() - self.started
+        error = None
+        result = None
+        try:
+            result = getattr(self.scanner, method)(*args)
+            return result
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            entry = {
+                'method': method,
+                'args': list(args),
+                'result': result,
+                'error': error,
+                'offset': round(offset, 6),
+                'duration': round(time.monotonic() - self.started - offset, 6)
+            }
+            with self._lock:
+                self._file.write(json.dumps(entry) + '\n')
+                self._file.flush()
+
+    def verifyPassword(self) -> bool:
+        return self._call('verifyPassword')
+
+    def readImage(self) -> bool:
+        return self._call('readImage')
+
+    def convertImage(self, charBufferNumber: int = 0x01) -> None:
+        return self._call('convertImage', charBufferNumber)
+
+    def downloadCharacteristics(self, charBufferNumber: int = 0x01) -> List[int]:
+        return self._call('downloadCharacteristics', charBufferNumber)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ReplayScanner(Scanner):
+    """
+    Plays a recorded session back call by call.
+
+    Each call sleeps for the recorded duration divided by ``speed`` (pass
+    ``speed=0`` to skip waiting). With ``loop`` the session restarts when it
+    runs out, which is what load tests want. A recording starts with the
+    ``verifyPassword`` call made at start-up; replays consume it once and
+    loop back to the first capture after it.
+    """
+
+    def __init__(self, path: str, speed: float = 1.0, loop: bool = True):
+        with open(path, encoding='utf-8') as f:
+            self.entries: List[Dict[str, Any]] = [json.loads(line) for line in f if line.strip()]
+        if not self.entries:
+            raise ValueError(f"Recorded session {path} is empty")
+        self.speed = speed
+        self.loop = loop
+        self.position = 0
+        methods = [entry['method'] for entry in self.entries]
+        self.first_capture = next((i for i, method in enumerate(methods) if method != 'verifyPassword'), None)
+        if self.first_capture is None:
+            raise ValueError(f"Recorded session {path} has no captures")
+
+    def _next(self, method: str) -> Any:
+        if self.position >= len(self.entries):
+            if not self.loop:
+                raise Exception("Recorded session exhausted")
+            self.position = self.first_capture
+        entry = self.entries[self.position]
+        self.position += 1
+        if entry['method'] != method:
+            raise Exception(f"Replay expected {entry['method']} but the service called {method}")
+        if self.speed:
+            time.sleep(entry['duration'] / self.speed)
+        if entry.get('error'):
+            raise Exception(entry['error'])
+        return entry['result']
+
+    def verifyPassword(self) -> bool:
+        if self.position < self.first_capture:
+            return self._next('verifyPassword')
+        # Sessions recorded without the start-up call
+        return True
+
+    def readImage(self) -> bool:
+        return self._next('readImage')
+
+    def convertImage(self, charBufferNumber: int = 0x01) -> None:
+        return self._next('convertImage')
+
+    def downloadCharacteristics(self, charBufferNumber: int = 0x01) -> List[int]:
+        return self._next('downloadCharacteristics')
+
+
+def _parse_options(text: str) -> Dict[str, str]:
+    options = {}
+    for part in filter(None, text.split(',')):
+        key, _, value = part.partition('=')
+        options[key.strip()] = value.strip()
+    return options
+
+
+def open_scanner(spec: str = 'serial:/dev/ttyUSB0', baudrate: int = 57600,
+                 record_to: Optional[str] = None) -> Scanner:
+    """
+    Build a scanner from a spec string.
+
+    ``serial:/dev/ttyUSB0``                      real PyFingerprint sensor
+    ``simulated:read=0.05,convert=0.3,seed=1``   SimulatedScanner
+    ``replay:session.jsonl,speed=10``            ReplayScanner
+
+    ``record_to`` wraps the result in a RecordingScanner.
+    """
+    kind, _, rest = spec.partition(':')
+    if kind == 'serial':
+        from pyfingerprint.pyfingerprint import PyFingerprint
+        scanner = PyFingerprint(rest or '/dev/ttyUSB0', baudrate, 0xFFFFFFFF, 0x00000000)
+    elif kind == 'simulated':
+        options = _parse_options(rest)
+        scanner = SimulatedScanner(
+            read_latency=float(options.get('read', 0.05)),
+            convert_latency=float(options.get('convert', 0.3)),
+            download_latency=float(options.get('download', 0.15)),
+            seed=int(options.get('seed', 0)),
+            finger=int(options.get('finger', 0)),
+            present_polls=int(options.get('present', 1)),
+            absent_polls=int(options.get('absent', 1)),
+        )
+    elif kind == 'replay':
+        path, _, options = rest.partition(',')
+        options = _parse_options(options)
+        scanner = ReplayScanner(path, speed=float(options.get('speed', 1.0)),
+                                loop=options.get('loop', '1') != '0')
+    else:
+        raise ValueError(f"Unknown scanner backend: {kind}")
+
+    if record_to:
+        logging.info(f"Recording scanner session to {record_to}")
+        scanner = RecordingScanner(scanner, record_to)
+    return scanner
@@ -0,0 +1,459 @@
+"""
+The fingerprint service core: scanner pool, template store and WebSocket server.
+
+Nothing here imports tkinter. ``python -m fingerprint_service`` runs it as
+a headless daemon and ``fingerprint_app.py`` puts a Tk window on top of the
+same object.
+
+The service appends enrollment and verification outcomes to its own audit
+log in the format of Django's ``AUDIT_LOG_FILE``. With a result key, each
+verification response also carries a signed result (see
+``fingerprint_service.results``) that the browser hands to Django to
+complete the login.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import websockets
+
+from audit.sink import JSONLinesSink
+from fingerprint_service.keys import Keyring
+from fingerprint_service.metrics import COMMAND_SECONDS, COMMANDS, PHASE_SECONDS, time_phase
+from fingerprint_service.pool import ENROLL, VERIFY, DevicePool
+from fingerprint_service.results import sign_result
+from fingerprint_service.scanner import RecordingScanner, Scanner, open_scanner
+from fingerprint_service.store import TemplateStore
+from metrics.registry import REGISTRY
+from fingerprint_service.worker import ScannerBusy, CaptureCancelled, ScanJob
+
+AUDIT_LOG_MAX_BYTES = 10 * 2**20
+AUDIT_LOG_BACKUPS = 5
+# AuditEvent.email, so the log can be loaded into the database
+AUDIT_EMAIL_LENGTH = 254
+
+
+def configure_logging(log_file: Optional[str] = 'fingerprint_service.log') -> None:
+    """Log to stdout and, unless log_file is empty, to a file"""
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=handlers
+    )
+
+
+def scanner_spec_for(device: str) -> str:
+    """Accept a bare device path as well as an open_scanner spec"""
+    return device if ':' in device else f'serial:{device}'
+
+
+class FingerprintService:
+    """
+    Owns the scanner pool and template store and serves them over WebSocket.
+
+    Scanners are numbered by their position in ``scanner_specs``; a client
+    pins a command to one by sending its number as ``device``.
+
+    ``serve()`` runs until ``request_shutdown()`` is called, then stops
+    accepting connections and commands, waits up to ``drain_timeout``
+    seconds for in-flight captures to finish and closes the remaining
+    connections. The pool and store live until ``close()``, so a front
+    end can stop and restart the server.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, scanner_specs: Optional[List[str]] = None,
+                 baudrate: int = 57600, db_path: str = 'fingerprint.db', key_file: str = 'key.key',
+                 record_to: Optional[str] = None, drain_timeout: float = 30.0, audit_log: Optional[str] = None,
+                 result_key: Optional[str] = None):
+        self.host = host
+        self.port = port
+        # e.g. "serial:/dev/ttyUSB0", "simulated:convert=0.1" or "replay:session.jsonl,speed=10";
+        # FINGERPRINT_SCANNER separates several with ';'
+        self.scanner_specs = scanner_specs or os.environ.get('FINGERPRINT_SCANNER', 'serial:/dev/ttyUSB0').split(';')
+        self.baudrate = baudrate
+        self.record_to = record_to or os.environ.get('FINGERPRINT_SCANNER_RECORD')
+        self.drain_timeout = drain_timeout
+        audit_log = audit_log if audit_log is not None else os.environ.get('FINGERPRINT_AUDIT_LOG')
+        self.audit_sink = JSONLinesSink(audit_log, AUDIT_LOG_MAX_BYTES, AUDIT_LOG_BACKUPS) if audit_log else None
+        # Shared with Django's FINGERPRINT_RESULT_KEY; without it verifications cannot log anyone in
+        self.result_key = result_key or os.environ.get('FINGERPRINT_RESULT_KEY')
+        self.server = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.accepting = False
+        self.in_flight = 0
+        self._shutdown: Optional[asyncio.Event] = None
+
+        # Holds every key in the key file so templates survive a rotation
+        self.cipher = Keyring(key_file)
+        self.store = TemplateStore(db_path, self.cipher)
+
+        # Initialize scanners and the threads that own them; a sensor that
+        # fails to open keeps its number so pinned clients stay correct
+        self.scanners: Dict[int, Scanner] = {}
+        for device_id, spec in enumerate(self.scanner_specs):
+            scanner = self.setup_scanner(device_id, spec)
+            if scanner:
+                self.scanners[device_id] = scanner
+        self.pool = DevicePool(self.scanners) if self.scanners else None
+
+    def setup_scanner(self, device_id: int, spec: str) -> Optional[Scanner]:
+        """Initialize one fingerprint scanner"""
+        record_to = self.record_to
+        if record_to and len(self.scanner_specs) > 1:
+            record_to = f'{record_to}.{device_id}'
+        try:
+            scanner = open_scanner(spec, baudrate=self.baudrate, record_to=record_to)
+            if scanner.verifyPassword():
+                logging.info(f"Fingerprint scanner {device_id} ({spec}) initialized successfully")
+                return scanner
+            else:
+                raise Exception("Scanner password verification failed")
+        except Exception as e:
+            logging.error(f"Scanner {device_id} ({spec}) initialization failed: {str(e)}")
+            return None
+
+    @property
+    def running(self) -> bool:
+        return self.server is not None
+
+    async def serve(self) -> None:
+        """Serve WebSocket clients until request_shutdown(), then drain"""
+        self.loop = asyncio.get_running_loop()
+        self._shutdown = asyncio.Event()
+        self.server = await websockets.serve(self.handle_websocket, self.host, self.port)
+        self.accepting = True
+        logging.info(f"Server listening on ws://{self.host}:{self.port}")
+        try:
+            await self._shutdown.wait()
+        finally:
+            await self.drain()
+            self.server = None
+            logging.info("Server stopped")
+
+    async def drain(self) -> None:
+        """Refuse new work, let in-flight captures finish, then drop the connections"""
+        self.accepting = False
+        self.server.close(close_connections=False)
+        deadline = self.loop.time() + self.drain_timeout
+        if self.in_flight:
+            logging.info(f"Waiting for {self.in_flight} in-flight commands")
+        while self.in_flight and self.loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        if self.in_flight:
+            logging.warning(f"Closing with {self.in_flight} commands still running")
+        self.server.close()
+        await self.server.wait_closed()
+
+    def request_shutdown(self) -> None:
+        """Ask serve() to drain and return; safe to call from any thread or a signal handler"""
+        if self.loop is not None and self._shutdown is not None:
+            self.loop.call_soon_threadsafe(self._shutdown.set)
+
+    def start_in_thread(self) -> threading.Thread:
+        """Run serve() on its own event loop in a daemon thread"""
+        thread = threading.Thread(target=asyncio.run, args=(self.serve(),), name="websocket-server", daemon=True)
+        thread.start()
+        return thread
+
+    def close(self) -> None:
+        """Stop the scanner threads once queued jobs finish, then close any recordings and the store"""
+        if self.pool:
+            self.pool.stop(timeout=5)
+        for scanner in self.scanners.values():
+            if isinstance(scanner, RecordingScanner):
+                scanner.close()
+        if self.audit_sink is not None:
+            self.audit_sink.close()
+        self.store.close()
+
+    async def handle_websocket(self, websocket: websockets.WebSocketServerProtocol, path: str) -> None:
+        """Handle WebSocket connections and messages"""
+        try:
+            async for message in websocket:
+                try:
+                    data = json.loads(message)
+                    command = data.get('command')
+
+                    handler = {
+                        'enroll': self.handle_enrollment,
+                        'verify': self.handle_verification,
+                        'status': self.handle_status,
+                        'stats': self.handle_stats
+                    }.get(command)
+                    if handler is None:
+                        response = {'status': 'error', 'message': 'Invalid command'}
+                    elif not self.accepting and command not in ('status', 'stats'):
+                        response = {'status': 'error', 'message': 'Service is shutting down'}
+                    else:
+                        self.in_flight += 1
+                        try:
+                            with COMMAND_SECONDS.time(command=command):
+                                response = await handler(websocket, data)
+                        finally:
+                            self.in_flight -= 1
+                        COMMANDS.inc(command=command, status=response.get('status'))
+
+                    await websocket.send(json.dumps(response))
+
+                except json.JSONDecodeError:
+                    await websocket.send(json.dumps({
+                        'status': 'error',
+                        'message': 'Invalid JSON data'
+                    }))
+        except websockets.exceptions.ConnectionClosed:
+            logging.info("Client connection closed")
+        except Exception as e:
+            logging.error(f"WebSocket error: {str(e)}")
+
+    def audit(self, websocket: Any, kind: str, data: Dict[str, Any], response: Dict[str, Any]) -> Dict[str, Any]:
+        """Append the outcome of an enroll or verify command to the audit log and return response"""
+        # A busy scanner never captured anything
+        if self.audit_sink is None or response.get('status') == 'busy':
+            return response
+        email = data.get('email')
+        address = getattr(websocket, 'remote_address', None)
+        event = {
+            'created_at': datetime.now(timezone.utc),
+            'kind': kind,
+            'outcome': 'success' if response.get('status') == 'success' else 'failure',
+            'user_id': None,
+            'email': email[:AUDIT_EMAIL_LENGTH] if isinstance(email, str) else '',
+            'ip': address[0] if address else None,
+            'path': '',
+            'detail': {'service': 'fingerprint', 'device': data.get('device'), 'message': response.get('message')},
+        }
+        try:
+            self.audit_sink.write([event])
+        except OSError as e:
+            logging.error(f"Could not append to the audit log: {str(e)}")
+        return response
+
+    async def handle_enrollment(self, websocket: websockets.WebSocketServerProtocol, data: Dict[str, Any]) -> Dict[
+        str, str]:
+        """Handle fingerprint enrollment process"""
+        return self.audit(websocket, 'fingerprint_enrollment', data, await self.enroll(websocket, data))
+
+    async def enroll(self, websocket: websockets.WebSocketServerProtocol, data: Dict[str, Any]) -> Dict[str, str]:
+        """Capture two matching templates and store them"""
+        if not self.pool:
+            return {'status': 'error', 'message': 'Scanner not initialized'}
+
+        try:
+            user_email = data.get('email')
+            if not user_email:
+                return {'status': 'error', 'message': 'Email is required'}
+
+            # Both captures run as one job so no other client can use the sensor in between
+            first_template, second_template = await self.run_scanner_job(
+                websocket, ENROLL, data.get('device'), self.capture_enrollment, self.progress_sender(websocket))
+
+            # Compare templates
+            if np.array_equal(first_template, second_template):
+                # Encrypt and store off the event loop
+                await self.store.save_template_async(user_email, first_template)
+
+                await websocket.send(json.dumps({
+                    'status': 'success',
+                    'message': 'Fingerprint enrolled successfully',
+                    'progress': 100
+                }))
+
+                return {'status': 'success', 'message': 'Enrollment complete'}
+            else:
+                return {'status': 'error', 'message': 'Fingerprints did not match'}
+
+        except ScannerBusy:
+            return {'status': 'busy', 'message': 'Scanner busy, try again shortly'}
+        except KeyError:
+            return {'status': 'error', 'message': 'Unknown scanner device'}
+        except CaptureCancelled as e:
+            return {'status': 'error', 'message': str(e)}
+        except Exception as e:
+            logging.error(f"Enrollment error: {str(e)}")
+            return {'status': 'error', 'message': str(e)}
+
+    async def run_scanner_job(self, websocket: websockets.WebSocketServerProtocol, priority: int,
+                              device_id: Optional[int], func: Callable[..., Any], *args: Any) -> Any:
+        """Run a capture on a scanner thread, telling the client where it is queued"""
+        if device_id is not None:
+            device_id = int(device_id) if str(device_id).isdigit() else device_id
+            if device_id not in self.pool.devices:
+                raise KeyError(device_id)
+        position = self.pool.position(priority, device_id)
+        if position and position < self.pool.max_queue:
+            await websocket.send(json.dumps({
+                'status': 'queued',
+                'message': f'Scanner busy, queued at position {position}',
+                'position': position
+            }))
+        submitted = time.perf_counter()
+
+        def timed(scanner: Scanner, job: ScanJob) -> Any:
+            PHASE_SECONDS.observe(time.perf_counter() - submitted, phase='queue_wait')
+            with time_phase('capture'):
+                return func(scanner, job, *args)
+
+        job = self.pool.submit(timed, priority=priority, device_id=device_id)
+        result = asyncio.wrap_future(job.future)
+        closed = asyncio.ensure_future(websocket.wait_closed())
+        try:
+            await asyncio.wait({result, closed}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            closed.cancel()
+        if not result.done():
+            # Client went away: free the sensor for the next one in line
+            job.cancelled.set()
+        return await result
+
+    def progress_sender(self, websocket: websockets.WebSocketServerProtocol) -> Callable[[str, int], None]:
+        """Build a callback the scanner thread can use to post progress messages"""
+        loop = asyncio.get_running_loop()
+
+        def send(message: str, progress: int) -> None:
+            payload = json.dumps({'status': 'info', 'message': message, 'progress': progress})
+            asyncio.run_coroutine_threadsafe(websocket.send(payload), loop)
+
+        return send
+
+    def acquire_fingerprint(self, scanner: Scanner, job: ScanJob, notify: Callable[[str, int], None],
+                            message: str, progress: int) -> np.ndarray:
+        """Acquire fingerprint template from scanner (runs on the scanner thread)"""
+        notify(message, progress)
+
+        while not scanner.readImage():
+            job.sleep(0.1)
+
+        scanner.convertImage(0x01)
+        return np.array(scanner.downloadCharacteristics(), dtype=np.uint8)
+
+    def wait_for_finger_removal(self, scanner: Scanner, job: ScanJob,
+                                notify: Callable[[str, int], None]) -> None:
+        """Wait for finger to be removed from scanner (runs on the scanner thread)"""
+        notify('Remove your finger...', 33)
+
+        while scanner.readImage():
+            job.sleep(0.1)
+
+    def capture_enrollment(self, scanner: Scanner, job: ScanJob,
+                           notify: Callable[[str, int], None]) -> tuple:
+        """Capture the two enrollment templates in one exclusive session"""
+        first_template = self.acquire_fingerprint(scanner, job, notify, "Place your finger on the scanner...", 0)
+        self.wait_for_finger_removal(scanner, job, notify)
+        second_template = self.acquire_fingerprint(scanner, job, notify, "Place the same finger again...", 66)
+        return first_template, second_template
+
+    def capture_verification(self, scanner: Scanner, job: ScanJob,
+                             notify: Callable[[str, int], None]) -> np.ndarray:
+        """Capture a single template for verification"""
+        return self.acquire_fingerprint(scanner, job, notify, "Place your finger on the scanner...", 0)
+
+    async def handle_status(self, websocket: websockets.WebSocketServerProtocol, data: Dict[str, Any]) -> Dict[
+        str, Any]:
+        """Report scanner availability without touching the device"""
+        return {
+            'status': 'success',
+            'scanner': 'connected' if self.pool else 'not connected',
+            'busy': bool(self.pool and self.pool.busy),
+            'queue_depth': self.pool.queue_depth() if self.pool else 0,
+            'devices': self.pool.stats() if self.pool else [],
+            'accepting': self.accepting
+        }
+
+    async def handle_stats(self, websocket: websockets.WebSocketServerProtocol, data: Dict[str, Any]) -> Dict[
+        str, Any]:
+        """Return this process's metrics, as data or in the Prometheus text format"""
+        if data.get('format') == 'prometheus':
+            return {'status': 'success', 'metrics': REGISTRY.render()}
+        return {'status': 'success', 'metrics': REGISTRY.snapshot()}
+
+    async def handle_verification(self, websocket: websockets.WebSocketServerProtocol, data: Dict[str, Any]) -> Dict[
+        str, str]:
+        """Handle fingerprint verification process"""
+        return self.audit(websocket, 'fingerprint', data, await self.verify(websocket, data))
+
+    def signed(self, response: Dict[str, str], email: str, outcome: str) -> Dict[str, str]:
+        """response with a result Django can trust, when a result key is configured"""
+        if self.result_key:
+            response['result'] = sign_result(self.result_key, email, outcome)
+        return response
+
+    async def verify(self, websocket: websockets.WebSocketServerProtocol, data: Dict[str, Any]) -> Dict[str, str]:
+        """Capture one template and compare it with the stored one"""
+        if not self.pool:
+            return {'status': 'error', 'message': 'Scanner not initialized'}
+
+        try:
+            user_email = data.get('email')
+            if not user_email:
+                return {'status': 'error', 'message': 'Email is required'}
+
+            # Acquire fingerprint
+            current_template = await self.run_scanner_job(
+                websocket, VERIFY, data.get('device'), self.capture_verification, self.progress_sender(websocket))
+
+            # Get stored template (cached after the first decrypt)
+            stored_template = await self.store.load_template_async(user_email)
+
+            if stored_template is not None:
+                if np.array_equal(current_template, stored_template):
+                    return self.signed({'status': 'success', 'message': 'Fingerprint verified'}, user_email, 'success')
+
+            return self.signed({'status': 'error', 'message': 'Verification failed'}, user_email, 'failure')
+
+        except ScannerBusy:
+            return {'status': 'busy', 'message': 'Scanner busy, try again shortly'}
+        except KeyError:
+            return {'status': 'error', 'message': 'Unknown scanner device'}
+        except CaptureCancelled as e:
+            return {'status': 'error', 'message': str(e)}
+        except Exception as e:
+            logging.error(f"Verification error: {str(e)}")
+            return {'status': 'error', 'message': str(e)}
+
+
+def add_service_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    """Flags shared by the daemon and the Tk front end"""
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--device', action='append', dest='devices',
+                        help="Serial device path, or a scanner spec such as simulated:convert=0.1. "
+                             "Repeat for several scanners; defaults to $FINGERPRINT_SCANNER or /dev/ttyUSB0")
+    parser.add_argument('--baudrate', type=int, default=57600)
+    parser.add_argument('--db', default='fingerprint.db', help="Template database path")
+    parser.add_argument('--key-file', default='key.key')
+    parser.add_argument('--record-to', default=None, help="Record scanner calls to this JSONL file")
+    parser.add_argument('--log-file', default='fingerprint_service.log', help="Empty to log to stdout only")
+    parser.add_argument('--audit-log', default='fingerprint_audit.jsonl',
+                        help="JSON-lines audit log of enrollments and verifications; empty to disable")
+    parser.add_argument('--result-key', default=None,
+                        help="Key shared with Django's FINGERPRINT_RESULT_KEY for signing verification results; "
+                             "defaults to $FINGERPRINT_RESULT_KEY")
+    parser.add_argument('--drain-timeout', type=float, default=30.0,
+                        help="Seconds to let in-flight captures finish on shutdown")
+    return parser
+
+
+def service_from_args(args: argparse.Namespace) -> FingerprintService:
+    return FingerprintService(
+        host=args.host,
+        port=args.port,
+        scanner_specs=[scanner_spec_for(device) for device in args.devices] if args.devices else None,
+        baudrate=args.baudrate,
+        db_path=args.db,
+        key_file=args.key_file,
+        record_to=args.record_to,
+        drain_timeout=args.drain_timeout,
+        audit_log=args.audit_log,
+        result_key=args.result_key,
+    )
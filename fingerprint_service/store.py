@@ -0,0 +1,212 @@
+import asyncio
+import base64
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+from fingerprint_service.metrics import time_phase
+
+# Bumped by migrate_to_blobs once no legacy base64 TEXT rows remain
+SCHEMA_VERSION = 1
+
+
+class TemplateCache:
+    """Bounded LRU of decrypted templates keyed by email"""
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._items: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so a read that raced a write is not cached
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, email: str) -> Optional[np.ndarray]:
+        with self._lock:
+            template = self._items.get(email)
+            if template is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(email)
+            self.hits += 1
+            return template
+
+    def put(self, email: str, template: np.ndarray, generation: int) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._items[email] = template
+            self._items.move_to_end(email)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, email: str) -> None:
+        with self._lock:
+            self.generation += 1
+            self._items.pop(email, None)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class TemplateStore:
+    """
+    Encrypted fingerprint template storage for the scanner service.
+
+    The database runs in WAL mode so readers never block the writer, and
+    every thread gets its own connection. Async callers go through a small
+    dedicated executor so SELECTs and Fernet work stay off the event loop.
+    Decrypted templates are cached by email until that email re-enrolls.
+
+    Templates are stored as the raw bytes of their Fernet token in a BLOB
+    column. Rows written before that change hold base64 TEXT; they stay
+    readable and are converted by ``migrate_to_blobs``.
+    """
+
+    def __init__(self, path: str, cipher, cache_size: int = 256, workers: int = 2):
+        self.path = path
+        self.cipher = cipher
+        self.cache = TemplateCache(cache_size)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="template-db")
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self.setup()
+
+    def connection(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Each connection is only used by its own thread; close() runs from another
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=30000')
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def setup(self) -> None:
+        """Create the fingerprints table and its email index"""
+        conn = self.connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                id INTEGER PRIMARY KEY,
+                user_email TEXT UNIQUE NOT NULL,
+                fingerprint_data BLOB NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_user_email
+            ON fingerprints(user_email)
+        ''')
+
+    @staticmethod
+    def encode_token(token: bytes) -> bytes:
+        """Fernet tokens are urlsafe base64; store the bytes underneath"""
+        return base64.urlsafe_b64decode(token)
+
+    @staticmethod
+    def decode_token(value) -> bytes:
+        """Turn a stored value back into a Fernet token"""
+        if isinstance(value, str):
+            # Legacy row: the token wrapped in a second, standard base64 layer
+            return base64.b64decode(value)
+        return base64.urlsafe_b64encode(value)
+
+    def save_template(self, email: str, template: np.ndarray) -> None:
+        """Encrypt and upsert a template, dropping any cached copy"""
+        with time_phase('storage'):
+            encrypted_data = self.encode_token(self.cipher.encrypt(np.asarray(template, dtype=np.uint8).tobytes()))
+            conn = self.connection()
+            # BEGIN IMMEDIATE takes the write lock up front, so concurrent writers
+            # queue on busy_timeout instead of failing with "database is locked"
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('''
+                    INSERT OR REPLACE INTO fingerprints
+                    (user_email, fingerprint_data, updated_at)
+                    VALUES (?, ?, ?)
+                ''', (email, encrypted_data, datetime.now()))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            finally:
+                self.cache.invalidate(email)
+
+    def load_template(self, email: str) -> Optional[np.ndarray]:
+        """Return the decrypted template for email, or None if not enrolled"""
+        template = self.cache.get(email)
+        if template is not None:
+            return template
+        return self._read_template(email)
+
+    def _read_template(self, email: str) -> Optional[np.ndarray]:
+        generation = self.cache.generation
+        row = self.connection().execute(
+            'SELECT fingerprint_data FROM fingerprints WHERE user_email = ?', (email,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        with time_phase('decrypt'):
+            decrypted_data = self.cipher.decrypt(self.decode_token(row[0]))
+        template = np.frombuffer(decrypted_data, dtype=np.uint8)
+        self.cache.put(email, template, generation)
+        return template
+
+    def migrate_to_blobs(self, batch_size: int = 500) -> int:
+        """
+        Rewrite legacy base64 TEXT rows as raw BLOBs in short batches.
+
+        Safe to interrupt and rerun: each batch commits on its own and only
+        rows still stored as text are selected. Returns the number converted.
+        """
+        conn = self.connection()
+        converted = 0
+        while True:
+            batch = conn.execute(
+                "SELECT id, fingerprint_data FROM fingerprints WHERE typeof(fingerprint_data) = 'text' LIMIT ?",
+                (batch_size,)
+            ).fetchall()
+            if not batch:
+                break
+            updates = [(self.encode_token(self.decode_token(data)), row_id) for row_id, data in batch]
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.executemany('UPDATE fingerprints SET fingerprint_data = ? WHERE id = ?', updates)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            converted += len(updates)
+        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        return converted
+
+    async def save_template_async(self, email: str, template: np.ndarray) -> None:
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.save_template, email, template)
+
+    async def load_template_async(self, email: str) -> Optional[np.ndarray]:
+        template = self.cache.get(email)
+        if template is not None:
+            return template
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._read_template, email)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
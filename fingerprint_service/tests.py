@@ -0,0 +1,449 @@
+import asyncio
+import base64
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+from cryptography.fernet import Fernet
+
+from fingerprint_service.keys import (
+    Keyring, rotate_templates, rotation_checkpoint, save_rotation_checkpoint, templates_readable_by_primary,
+)
+from fingerprint_service.pool import ENROLL, VERIFY, DevicePool
+from fingerprint_service.results import InvalidResult, read_result, sign_result
+from fingerprint_service.scanner import RecordingScanner, ReplayScanner, Scanner, SimulatedScanner
+from fingerprint_service.service import FingerprintService
+from fingerprint_service.store import SCHEMA_VERSION, TemplateStore
+from metrics.registry import REGISTRY
+
+
+def capture(scanner, job):
+    """A verification capture without progress messages"""
+    while not scanner.readImage():
+        job.sleep(0.01)
+    scanner.convertImage(0x01)
+    return scanner.downloadCharacteristics()
+
+
+def simulated_scanners(count):
+    return {
+        device_id: SimulatedScanner(read_latency=0.01, convert_latency=0.03, download_latency=0.01, seed=device_id)
+        for device_id in range(count)
+    }
+
+
+class DevicePoolTests(unittest.TestCase):
+    def run_captures(self, devices, jobs):
+        pool = DevicePool(simulated_scanners(devices), max_queue=jobs)
+        try:
+            started = time.perf_counter()
+            submitted = [pool.submit(capture, priority=VERIFY) for _ in range(jobs)]
+            for job in submitted:
+                job.future.result(timeout=10)
+            return time.perf_counter() - started, pool.stats()
+        finally:
+            pool.stop()
+
+    def test_throughput_scales_with_devices(self):
+        one, _ = self.run_captures(1, 16)
+        four, stats = self.run_captures(4, 16)
+        self.assertLess(four, one / 2.5)
+        # Every device took a share of the work
+        self.assertTrue(all(device['jobs'] >= 2 for device in stats))
+        self.assertTrue(all(device['utilization'] > 0.5 for device in stats))
+
+    def test_verifications_run_before_enrollments(self):
+        pool = DevicePool(simulated_scanners(1))
+        release = threading.Event()
+        order = []
+        try:
+            blocker = pool.submit(lambda scanner, job: release.wait(5))
+            while not pool.devices[0].busy:
+                time.sleep(0.001)
+            jobs = [
+                pool.submit(lambda scanner, job, name=name: order.append(name), priority=priority)
+                for name, priority in (('enroll-1', ENROLL), ('enroll-2', ENROLL), ('verify', VERIFY))
+            ]
+            self.assertEqual(pool.queue_depth(), 3)
+            self.assertEqual(pool.position(VERIFY), 2)
+            release.set()
+            for job in [blocker, *jobs]:
+                job.future.result(timeout=5)
+        finally:
+            pool.stop()
+        self.assertEqual(order, ['verify', 'enroll-1', 'enroll-2'])
+
+    def test_waiting_enrollments_age_past_new_verifications(self):
+        pool = DevicePool(simulated_scanners(1), aging=0.05)
+        release = threading.Event()
+        order = []
+        try:
+            blocker = pool.submit(lambda scanner, job: release.wait(5))
+            enroll = pool.submit(lambda scanner, job: order.append('enroll'), priority=ENROLL)
+            time.sleep(0.12)
+            verify = pool.submit(lambda scanner, job: order.append('verify'), priority=VERIFY)
+            release.set()
+            for job in (blocker, enroll, verify):
+                job.future.result(timeout=5)
+        finally:
+            pool.stop()
+        self.assertEqual(order, ['enroll', 'verify'])
+
+    def test_pinned_jobs_stay_on_their_device(self):
+        scanners = simulated_scanners(3)
+        pool = DevicePool(scanners)
+        try:
+            jobs = [pool.submit(lambda scanner, job: scanner, device_id=2) for _ in range(6)]
+            used = {job.future.result(timeout=5) for job in jobs}
+        finally:
+            pool.stop()
+        self.assertEqual(used, {scanners[2]})
+        with self.assertRaises(KeyError):
+            pool.submit(capture, device_id=7)
+
+
+class ScannerSessionTests(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'session.jsonl')
+
+    def record(self, captures=2, finger=3):
+        scanner = RecordingScanner(
+            SimulatedScanner(read_latency=0, convert_latency=0, download_latency=0, finger=finger, present_polls=10),
+            self.path,
+        )
+        self.assertTrue(scanner.verifyPassword())
+        templates = [capture(scanner, None) for _ in range(captures)]
+        scanner.close()
+        return templates
+
+    def test_simulated_finger_comes_and_goes(self):
+        scanner = SimulatedScanner(read_latency=0, convert_latency=0, download_latency=0, present_polls=2)
+        self.assertEqual([scanner.readImage() for _ in range(6)], [True, True, False, True, True, False])
+        with self.assertRaises(Exception):
+            scanner.downloadCharacteristics()
+        scanner.convertImage()
+        self.assertEqual(scanner.downloadCharacteristics(), scanner.template_for(0))
+
+    def test_recording_replays_from_start_up_and_loops(self):
+        templates = self.record()
+        with open(self.path) as session:
+            self.assertEqual(json.loads(session.readline())['method'], 'verifyPassword')
+
+        replay = ReplayScanner(self.path, speed=0)
+        self.assertTrue(replay.verifyPassword())
+        replayed = [capture(replay, None) for _ in range(4)]
+        self.assertEqual(replayed, templates * 2)
+
+    def test_recording_again_replaces_the_previous_session(self):
+        self.record(finger=1)
+        templates = self.record(finger=4)
+        replay = ReplayScanner(self.path, speed=0)
+        replay.verifyPassword()
+        self.assertEqual([capture(replay, None) for _ in range(4)], templates * 2)
+
+    def test_scanner_backends_must_implement_the_whole_api(self):
+        class ReadOnlyScanner(Scanner):
+            def readImage(self):
+                return False
+
+        with self.assertRaises(TypeError):
+            ReadOnlyScanner()
+
+    def test_replay_without_loop_runs_out(self):
+        templates = self.record(captures=1)
+        replay = ReplayScanner(self.path, speed=0, loop=False)
+        replay.verifyPassword()
+        self.assertEqual(capture(replay, None), templates[0])
+        with self.assertRaisesRegex(Exception, "exhausted"):
+            replay.readImage()
+
+    def test_replay_reports_calls_out_of_order_and_recorded_errors(self):
+        with open(self.path, 'w') as session:
+            session.write(json.dumps({'method': 'readImage', 'args': [], 'result': True, 'error': None,
+                                      'offset': 0, 'duration': 0}) + '\n')
+            session.write(json.dumps({'method': 'convertImage', 'args': [1], 'result': None,
+                                      'error': 'Sensor fault', 'offset': 0, 'duration': 0}) + '\n')
+        replay = ReplayScanner(self.path, speed=0)
+        # A session recorded without start-up still answers verifyPassword
+        self.assertTrue(replay.verifyPassword())
+        with self.assertRaisesRegex(Exception, "expected readImage"):
+            replay.downloadCharacteristics()
+        with self.assertRaisesRegex(Exception, "Sensor fault"):
+            replay.convertImage()
+
+
+def template(number):
+    return np.full(16, number, dtype=np.uint8)
+
+
+class TemplateStoreTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.path = os.path.join(directory, 'fingerprint.db')
+        self.cipher = Fernet(Fernet.generate_key())
+        self.store = TemplateStore(self.path, self.cipher, cache_size=2)
+        self.addCleanup(self.store.close)
+
+    def test_cache_is_bounded_and_dropped_on_re_enrollment(self):
+        for number, email in enumerate(('ada@example.com', 'bob@example.com', 'cy@example.com')):
+            self.store.save_template(email, template(number))
+            self.store.load_template(email)
+        self.assertEqual(len(self.store.cache), 2)
+        self.assertIsNone(self.store.cache.get('ada@example.com'))
+
+        self.store.load_template('bob@example.com')
+        hits = self.store.cache.hits
+        self.assertEqual(self.store.load_template('bob@example.com').tolist(), template(1).tolist())
+        self.assertEqual(self.store.cache.hits, hits + 1)
+
+        self.store.save_template('bob@example.com', template(9))
+        self.assertIsNone(self.store.cache.get('bob@example.com'))
+        self.assertEqual(self.store.load_template('bob@example.com').tolist(), template(9).tolist())
+
+        # A read that started before a re-enrollment must not cache what it read
+        generation = self.store.cache.generation
+        self.store.save_template('cy@example.com', template(5))
+        self.store.cache.put('cy@example.com', template(2), generation)
+        self.assertIsNone(self.store.cache.get('cy@example.com'))
+
+    def test_concurrent_writers_queue_for_the_lock(self):
+        other = TemplateStore(self.path, self.cipher)
+        self.addCleanup(other.close)
+        self.assertEqual(self.store.connection().execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+        def enroll(store, writer):
+            for number in range(20):
+                store.save_template(f'user{writer}-{number}@example.com', template(number))
+
+        threads = [threading.Thread(target=enroll, args=(store, writer))
+                   for writer, store in enumerate([self.store, other] * 4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.store.connection().execute('SELECT COUNT(*) FROM fingerprints').fetchone()[0], 160)
+
+        # A writer waits behind a held lock; readers carry on meanwhile
+        holder = sqlite3.connect(self.path, isolation_level=None)
+        self.addCleanup(holder.close)
+        holder.execute('BEGIN IMMEDIATE')
+        writer = threading.Thread(target=other.save_template, args=('user0-0@example.com', template(99)))
+        writer.start()
+        writer.join(0.2)
+        self.assertTrue(writer.is_alive())
+        self.assertEqual(self.store.load_template('user1-3@example.com').tolist(), template(3).tolist())
+        holder.execute('COMMIT')
+        writer.join()
+        self.assertEqual(self.store.load_template('user0-0@example.com').tolist(), template(99).tolist())
+
+    def test_blob_and_legacy_text_rows_read_alike(self):
+        token = self.cipher.encrypt(template(4).tobytes())
+        self.store.connection().execute(
+            'INSERT INTO fingerprints (user_email, fingerprint_data) VALUES (?, ?)',
+            ('legacy@example.com', base64.b64encode(token).decode())
+        )
+        self.store.save_template('blob@example.com', template(4))
+        rows = dict(self.store.connection().execute('SELECT user_email, typeof(fingerprint_data) FROM fingerprints'))
+        self.assertEqual(rows, {'legacy@example.com': 'text', 'blob@example.com': 'blob'})
+
+        self.assertEqual(TemplateStore.decode_token(base64.b64encode(token).decode()), token)
+        self.assertEqual(TemplateStore.decode_token(TemplateStore.encode_token(token)), token)
+        self.assertLess(len(TemplateStore.encode_token(token)), len(token))
+        for email in rows:
+            self.assertEqual(self.store.load_template(email).tolist(), template(4).tolist())
+
+
+class KeyRotationTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.key_file = os.path.join(directory, 'key.key')
+        # The running service's keyring and store
+        self.keyring = Keyring(self.key_file)
+        self.store = TemplateStore(os.path.join(directory, 'fingerprint.db'), self.keyring)
+        self.addCleanup(self.store.close)
+
+    def start_rotation(self):
+        """What `keys rotate` does before rewriting rows, from another process"""
+        keyring = Keyring(self.key_file)
+        self.assertIsNone(rotation_checkpoint(self.store.connection()))
+        keyring.add_primary_key()
+        save_rotation_checkpoint(self.store.connection(), keyring.primary_id, 0)
+        return keyring
+
+    def test_service_encrypts_with_the_new_key_after_rotation(self):
+        self.store.save_template('ada@example.com', template(1))
+        keyring = self.start_rotation()
+        self.assertEqual(rotate_templates(self.store, keyring), 1)
+
+        # Enrolled after the rotation by the service, which has not decrypted anything since
+        self.store.save_template('bob@example.com', template(2))
+        self.assertEqual(self.keyring.primary_id, keyring.primary_id)
+        self.assertTrue(templates_readable_by_primary(self.store, keyring))
+        self.assertEqual(keyring.prune(), 1)
+
+        for email in ('ada@example.com', 'bob@example.com'):
+            self.store.cache.invalidate(email)
+        self.assertEqual(self.store.load_template('ada@example.com').tolist(), template(1).tolist())
+        self.assertEqual(self.store.load_template('bob@example.com').tolist(), template(2).tolist())
+
+    def test_interrupted_rotation_resumes_from_its_checkpoint(self):
+        for number in range(3):
+            self.store.save_template(f'user{number}@example.com', template(number))
+        keyring = self.start_rotation()
+        rotate = keyring.rotate
+        calls = []
+
+        def rotate_once(token):
+            if calls:
+                raise RuntimeError("killed")
+            calls.append(token)
+            return rotate(token)
+
+        with mock.patch.object(keyring, 'rotate', side_effect=rotate_once), self.assertRaises(RuntimeError):
+            rotate_templates(self.store, keyring, batch_size=1)
+        self.assertEqual(rotation_checkpoint(self.store.connection()), (keyring.primary_id, 1))
+        with self.assertLogs(level='ERROR'):
+            self.assertFalse(templates_readable_by_primary(self.store, keyring))
+
+        self.assertEqual(rotate_templates(self.store, keyring, batch_size=1), 2)
+        self.assertIsNone(rotation_checkpoint(self.store.connection()))
+        self.assertTrue(templates_readable_by_primary(self.store, keyring))
+
+    def test_legacy_text_rows_stay_readable_and_migrate_to_blobs(self):
+        token = self.keyring.encrypt(template(7).tobytes())
+        self.store.connection().execute(
+            'INSERT INTO fingerprints (user_email, fingerprint_data) VALUES (?, ?)',
+            ('ada@example.com', base64.b64encode(token).decode())
+        )
+        self.store.save_template('bob@example.com', template(8))
+        self.assertEqual(self.store.load_template('ada@example.com').tolist(), template(7).tolist())
+
+        self.assertEqual(self.store.migrate_to_blobs(batch_size=1), 1)
+        conn = self.store.connection()
+        self.assertEqual(
+            conn.execute('SELECT DISTINCT typeof(fingerprint_data) FROM fingerprints').fetchall(), [('blob',)]
+        )
+        self.assertEqual(conn.execute('PRAGMA user_version').fetchone()[0], SCHEMA_VERSION)
+        self.store.cache.invalidate('ada@example.com')
+        self.assertEqual(self.store.load_template('ada@example.com').tolist(), template(7).tolist())
+        self.assertEqual(self.store.migrate_to_blobs(), 0)
+
+
+class FakeWebSocket:
+    remote_address = ('192.0.2.7', 50000)
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+    async def wait_closed(self):
+        await asyncio.Event().wait()
+
+
+class FingerprintServiceTests(unittest.TestCase):
+    def make_service(self, *scanner_specs, record_to=None, audit_log=None, result_key=None):
+        directory = tempfile.mkdtemp()
+        service = FingerprintService(
+            scanner_specs=list(scanner_specs),
+            db_path=os.path.join(directory, 'fingerprint.db'),
+            key_file=os.path.join(directory, 'key.key'),
+            record_to=record_to,
+            audit_log=audit_log,
+            result_key=result_key,
+        )
+        self.addCleanup(service.close)
+        return service
+
+    def test_status_reports_every_device(self):
+        service = self.make_service('simulated:convert=0.01', 'simulated:convert=0.01,seed=1')
+        status = asyncio.run(service.handle_status(None, {}))
+        self.assertEqual(status['scanner'], 'connected')
+        self.assertEqual([device['device'] for device in status['devices']], [0, 1])
+        self.assertEqual(status['queue_depth'], 0)
+
+    def test_stats_report_store_phases(self):
+        REGISTRY.clear()
+        service = self.make_service('simulated:convert=0.01')
+        service.store.save_template('ada@example.com', np.arange(8, dtype=np.uint8))
+        service.store.cache.invalidate('ada@example.com')
+        service.store.load_template('ada@example.com')
+
+        stats = asyncio.run(service.handle_stats(None, {}))['metrics']['fingerprint_phase_seconds']
+        phases = {sample['labels']['phase']: sample['count'] for sample in stats['samples']}
+        self.assertEqual(phases, {'decrypt': 1, 'storage': 1})
+        text = asyncio.run(service.handle_stats(None, {'format': 'prometheus'}))['metrics']
+        self.assertIn('fingerprint_phase_seconds_count{phase="storage"} 1', text)
+
+    def test_recorded_service_session_replays(self):
+        path = os.path.join(tempfile.mkdtemp(), 'session.jsonl')
+        service = self.make_service('simulated:read=0,convert=0,download=0,finger=2', record_to=path)
+        template = service.pool.submit(capture).future.result(timeout=5)
+        # close() flushes and closes the recording
+        service.close()
+        self.assertTrue(service.scanners[0]._file.closed)
+
+        replay = self.make_service(f'replay:{path},speed=0')
+        self.assertIsNotNone(replay.pool)
+        for _ in range(2):
+            self.assertEqual(replay.pool.submit(capture).future.result(timeout=5), template)
+
+    def test_verification_outcomes_are_audited(self):
+        path = os.path.join(tempfile.mkdtemp(), 'audit.jsonl')
+        service = self.make_service('simulated:read=0,convert=0,download=0,present=10', audit_log=path)
+        template = np.array(service.scanners[0].template_for(0), dtype=np.uint8)
+        service.store.save_template('ada@example.com', template)
+
+        async def verify(email):
+            return await service.handle_verification(FakeWebSocket(), {'command': 'verify', 'email': email})
+
+        self.assertEqual(asyncio.run(verify('ada@example.com'))['status'], 'success')
+        self.assertEqual(asyncio.run(verify('bob@example.com'))['status'], 'error')
+        service.close()
+
+        with open(path) as log_file:
+            events = [json.loads(line) for line in log_file]
+        self.assertEqual(
+            [(event['kind'], event['outcome'], event['email'], event['ip']) for event in events],
+            [('fingerprint', 'success', 'ada@example.com', '192.0.2.7'),
+             ('fingerprint', 'failure', 'bob@example.com', '192.0.2.7')],
+        )
+        self.assertEqual(events[1]['detail']['message'], 'Verification failed')
+
+    def test_verification_results_are_signed_for_django(self):
+        service = self.make_service('simulated:read=0,convert=0,download=0,present=10', result_key='shared-key')
+        template = np.array(service.scanners[0].template_for(0), dtype=np.uint8)
+        service.store.save_template('ada@example.com', template)
+
+        async def verify(email):
+            return await service.handle_verification(FakeWebSocket(), {'command': 'verify', 'email': email})
+
+        for email, outcome in (('ada@example.com', 'success'), ('bob@example.com', 'failure')):
+            result = read_result('shared-key', asyncio.run(verify(email))['result'], max_age=60)
+            self.assertEqual((result['email'], result['outcome']), (email, outcome))
+        self.assertNotIn('result', asyncio.run(verify('')))
+
+
+class SignedResultTests(unittest.TestCase):
+    def test_tampered_foreign_and_stale_results_are_refused(self):
+        token = sign_result('shared-key', 'ada@example.com', 'success')
+        self.assertEqual(read_result('shared-key', token, max_age=60)['outcome'], 'success')
+
+        mac = token.rsplit('.', 1)[1]
+        forged = base64.urlsafe_b64encode(json.dumps({
+            'email': 'ada@example.com', 'outcome': 'success', 'issued_at': time.time() + 3600,
+        }).encode()).decode().rstrip('=')
+        for bad in (f'{forged}.{mac}', 'no-signature', None):
+            with self.assertRaises(InvalidResult):
+                read_result('shared-key', bad, max_age=60)
+        with self.assertRaisesRegex(InvalidResult, "signature"):
+            read_result('other-key', token, max_age=60)
+        with self.assertRaisesRegex(InvalidResult, "Expired"):
+            read_result('shared-key', sign_result('shared-key', 'ada@example.com', 'success', issued_at=time.time() - 61), 60)
@@ -0,0 +1,35 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+
+class ScannerBusy(Exception):
+    """Raised when the scanner queue is full"""
+
+
+class CaptureCancelled(Exception):
+    """Raised inside a job when its client went away or it timed out"""
+
+
+class ScanJob:
+    """A unit of work that runs on the scanner thread with exclusive device access"""
+
+    def __init__(self, func: Callable[..., Any], args: tuple, timeout: Optional[float]):
+        self.func = func
+        self.args = args
+        self.future: Future = Future()
+        self.cancelled = threading.Event()
+        self.deadline = time.monotonic() + timeout if timeout else None
+
+    def check(self) -> None:
+        """Abort the job if it was cancelled or ran past its deadline"""
+        if self.cancelled.is_set():
+            raise CaptureCancelled("Capture cancelled")
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise CaptureCancelled("Timed out waiting for the scanner")
+
+    def sleep(self, seconds: float) -> None:
+        """Wait between polls, waking early on cancellation"""
+        if self.cancelled.wait(seconds):
+            self.check()
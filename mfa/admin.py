@@ -2,4 +2,10 @@ from django.contrib import admin
 
 from mfa.models import *
 
-admin.site.register(MFAProfile)
\ No newline at end of file
+admin.site.register(MFAProfile)
+
+
+@admin.register(DuplicateFaceMatch)
+class DuplicateFaceMatchAdmin(admin.ModelAdmin):
+    list_display = ('user', 'matched_user', 'distance', 'reviewed', 'created_at')
+    list_filter = ('reviewed',)
\ No newline at end of file
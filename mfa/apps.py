@@ -5,3 +5,5 @@ class MfaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mfa'
 
+    def ready(self):
+        import mfa.signals
@@ -0,0 +1,59 @@
+"""Native async versions of the MFA setup views, routed when ASYNC_LOGIN_VIEWS is on"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
+from django.shortcuts import render
+from django.views.decorators.csrf import csrf_exempt
+
+from accounts.metrics import time_phase
+from audit.pipeline import record_event
+from mfa.codec import encode_descriptor
+from mfa.duplicates import schedule_duplicate_scan
+from mfa.executor import run_cpu_bound
+from mfa.models import MFAProfile
+
+
+@login_required
+@csrf_exempt
+async def setup_face(request):
+    if request.method != "POST":
+        # The page reads user.mfaprofile lazily, which is a blocking query
+        return await sync_to_async(render)(request, 'mfa/setup-face.html')
+
+    try:
+        facial_data = json.loads(request.body).get("facialId")
+    except (json.JSONDecodeError, AttributeError):
+        return JsonResponse({"message": "Invalid JSON data received."}, status=400)
+    if not facial_data:
+        return JsonResponse({"message": "No facial data received."}, status=400)
+
+    try:
+        with time_phase('setup-face', 'descriptor_encode'):
+            binary_data = await run_cpu_bound(
+                encode_descriptor, facial_data, dtype=settings.FACE_DESCRIPTOR_STORAGE_DTYPE
+            )
+    except Exception as e:
+        record_event('face_enrollment', 'failure', request=request, user=await request.auser(), message=str(e))
+        return JsonResponse({"message": f"Invalid facial data format: {str(e)}"}, status=400)
+
+    try:
+        user = await request.auser()
+        with time_phase('setup-face', 'storage'):
+            mfa_profile, created = await MFAProfile.objects.for_user(user).defer(
+                'fingerprint_data'
+            ).aget_or_create(user=user)
+            mfa_profile.face_data = binary_data
+            await mfa_profile.asave()
+        # on_commit needs the connection asave used
+        await sync_to_async(schedule_duplicate_scan)(mfa_profile)
+        record_event('face_enrollment', 'success', request=request, user=user)
+    except Exception as e:
+        return JsonResponse({"message": f"Error processing face enrollment: {str(e)}"}, status=500)
+
+    return JsonResponse({
+        "message": "Face ID successfully enrolled.",
+        "status": "success"
+    })
@@ -0,0 +1,172 @@
+"""
+Measuring false accept and false reject rates to pick the face match threshold.
+
+Every pair of descriptors is either genuine (same person) or impostor
+(different people). Enrolled accounts hold one descriptor each, so stored
+faces only yield impostor pairs; genuine pairs come from labelled samples,
+several captures per person, passed alongside.
+
+A million descriptors make ~5e11 pairs, far too many to hold, so distances
+are never kept: each worker takes a block of rows, walks the later rows in
+blocks, and adds the distances to fixed-width histograms. Descriptors are
+first spooled to a memory-mapped file, which the workers read without
+copying, so memory use depends on the block size and worker count but not
+on the population. The FAR/FRR curves are cumulative sums of the two
+histograms.
+
+Nothing here imports Django, so worker processes start cheaply.
+"""
+import math
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Rough bytes per pair in flight: float32 products and distances, int64 bin indices, masks
+BYTES_PER_PAIR = 24
+MIN_BLOCK, MAX_BLOCK = 256, 8192
+
+Spool = namedtuple('Spool', ['directory', 'count', 'dim'])
+Histograms = namedtuple('Histograms', ['genuine', 'impostor', 'max_distance'])
+
+
+def spool_descriptors(directory, batches, dim):
+    """
+    Write (labels, descriptors) batches to directory as flat files and return a Spool.
+
+    Rows with equal labels are the same person. Batches are written as they
+    arrive, so a population larger than memory never has to fit at once.
+    """
+    count = 0
+    with open(os.path.join(directory, 'descriptors.f32'), 'wb') as vectors, \
+            open(os.path.join(directory, 'labels.i64'), 'wb') as labels:
+        for batch_labels, batch_vectors in batches:
+            batch_vectors = np.ascontiguousarray(batch_vectors, dtype=np.float32)
+            if batch_vectors.ndim != 2 or batch_vectors.shape[1] != dim:
+                raise ValueError(f"Expected descriptors of length {dim}, got shape {batch_vectors.shape}")
+            vectors.write(batch_vectors.tobytes())
+            labels.write(np.ascontiguousarray(batch_labels, dtype=np.int64).tobytes())
+            count += len(batch_vectors)
+    return Spool(directory, count, dim)
+
+
+def open_spool(spool):
+    if not spool.count:
+        return np.empty((0, spool.dim), dtype=np.float32), np.empty(0, dtype=np.int64)
+    vectors = np.memmap(os.path.join(spool.directory, 'descriptors.f32'), dtype=np.float32, mode='r',
+                        shape=(spool.count, spool.dim))
+    labels = np.memmap(os.path.join(spool.directory, 'labels.i64'), dtype=np.int64, mode='r', shape=(spool.count,))
+    return vectors, labels
+
+
+def block_size_for(memory_mb, workers):
+    """Square block edge that keeps every worker's pair buffers within memory_mb in total"""
+    pairs = memory_mb * 2 ** 20 / max(1, workers) / BYTES_PER_PAIR
+    return int(min(MAX_BLOCK, max(MIN_BLOCK, math.isqrt(int(pairs)))))
+
+
+def histogram_rows(spool, start, stop, block, bins, max_distance):
+    """Genuine and impostor histograms of pairs (i, j) with start <= i < stop and i < j"""
+    vectors, labels = open_spool(spool)
+    genuine = np.zeros(bins, dtype=np.int64)
+    impostor = np.zeros(bins, dtype=np.int64)
+    rows = np.array(vectors[start:stop])
+    row_labels = np.array(labels[start:stop])
+    row_norms = np.einsum('ij,ij->i', rows, rows)
+    scale = bins / max_distance
+
+    for column in range(start, spool.count, block):
+        columns = np.array(vectors[column:column + block])
+        column_norms = np.einsum('ij,ij->i', columns, columns)
+        squared = row_norms[:, None] + column_norms[None, :] - 2.0 * (rows @ columns.T)
+        np.maximum(squared, 0, out=squared)
+        bin_index = np.minimum((np.sqrt(squared) * scale).astype(np.int64), bins - 1)
+        same = row_labels[:, None] == np.array(labels[column:column + block])[None, :]
+        if column < stop:
+            # The diagonal block: keep only pairs above the diagonal
+            upper = (np.arange(start, stop)[:, None] < np.arange(column, column + len(columns))[None, :])
+            genuine += np.bincount(bin_index[same & upper], minlength=bins)
+            impostor += np.bincount(bin_index[~same & upper], minlength=bins)
+        else:
+            genuine += np.bincount(bin_index[same], minlength=bins)
+            impostor += np.bincount(bin_index[~same], minlength=bins)
+    return genuine, impostor
+
+
+def pair_histograms(spool, block, bins=2000, max_distance=2.0, workers=1):
+    """
+    Histograms of every pair's distance over [0, max_distance), split by genuine and impostor.
+
+    Distances past max_distance land in the last bin. Row blocks go to a
+    process pool when workers > 1 and there is more than one block.
+    """
+    genuine = np.zeros(bins, dtype=np.int64)
+    impostor = np.zeros(bins, dtype=np.int64)
+    starts = range(0, spool.count, block)
+    if workers > 1 and len(starts) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(histogram_rows, spool, start, min(start + block, spool.count), block, bins, max_distance)
+                for start in starts
+            ]
+            results = (future.result() for future in futures)
+            for block_genuine, block_impostor in results:
+                genuine += block_genuine
+                impostor += block_impostor
+    else:
+        for start in starts:
+            block_genuine, block_impostor = histogram_rows(
+                spool, start, min(start + block, spool.count), block, bins, max_distance
+            )
+            genuine += block_genuine
+            impostor += block_impostor
+    return Histograms(genuine, impostor, max_distance)
+
+
+def error_curves(histograms, target_far=1e-4, check=(0.4, 0.6)):
+    """
+    FAR and FRR at each bin's upper edge, the equal error rate and a recommended threshold.
+
+    A pair is accepted when its distance is below the threshold. The
+    recommendation is the largest threshold whose FAR stays within
+    target_far. Rates are None without pairs of that kind.
+    """
+    genuine, impostor, max_distance = histograms
+    thresholds = np.linspace(0, max_distance, len(genuine) + 1)[1:]
+    genuine_total, impostor_total = int(genuine.sum()), int(impostor.sum())
+    far = np.cumsum(impostor) / impostor_total if impostor_total else None
+    frr = 1.0 - np.cumsum(genuine) / genuine_total if genuine_total else None
+
+    def rates_at(threshold):
+        # Index of the last bin lying wholly below the threshold
+        index = int(np.searchsorted(thresholds, threshold, side='right')) - 1
+        return {
+            'threshold': float(threshold),
+            'far': float(far[index]) if far is not None and index >= 0 else None,
+            'frr': float(frr[index]) if frr is not None and index >= 0 else None,
+        }
+
+    report = {
+        'genuine_pairs': genuine_total,
+        'impostor_pairs': impostor_total,
+        'target_far': target_far,
+        'recommended_threshold': None,
+        'eer': None,
+        'eer_threshold': None,
+        'current': [rates_at(threshold) for threshold in check],
+        'curve': {
+            'threshold': thresholds.round(6).tolist(),
+            'far': far.tolist() if far is not None else None,
+            'frr': frr.tolist() if frr is not None else None,
+        },
+    }
+    if far is not None:
+        within = np.flatnonzero(far <= target_far)
+        if len(within):
+            report['recommended_threshold'] = float(thresholds[within[-1]])
+    if far is not None and frr is not None:
+        crossing = int(np.argmin(np.abs(far - frr)))
+        report['eer'] = float((far[crossing] + frr[crossing]) / 2)
+        report['eer_threshold'] = float(thresholds[crossing])
+    return report
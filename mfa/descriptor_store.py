@@ -0,0 +1,309 @@
+"""
+Memory-mapped face descriptor file shared by every worker process.
+
+Layout (little-endian)::
+
+    header      64 bytes   magic, version, dim, capacity, count
+    vectors     capacity x dim float32
+    user_ids    capacity int64
+    tombstones  ceil(capacity / 8) bytes, one bit per row
+    slots       2 x capacity (rounded up to a power of two) int64
+
+Readers map the file read-only, so the descriptor set lives once in the page
+cache no matter how many workers serve logins. Writers serialise on an
+``flock`` of a sidecar lock file, append the new row and only then bump
+``count``, so readers never observe a half-written row. Replacing or deleting
+a user sets the tombstone bit of its old row. When the file is full it is
+compacted into a file of twice the capacity and atomically renamed over the
+old one; readers notice the new inode and remap. Every file, the first one
+included, is built under a temporary name and renamed into place, so a
+reader never maps a file that is still being laid out.
+
+``slots`` is an open-addressing hash table, probed linearly from a
+Fibonacci hash of the user id, holding the newest row of every user ever
+written (-1 marks an empty slot). The writer points a user's slot at a new
+row after writing the row and before publishing it, so ``get`` costs a few
+probes of the shared mapping and no reader builds an index of its own.
+"""
+import fcntl
+import mmap
+import os
+import struct
+import threading
+
+import numpy as np
+
+MAGIC = b'BIOFACE1'
+VERSION = 2
+HEADER = struct.Struct('<8sIIQQ')
+HEADER_SIZE = 64
+COUNT_OFFSET = 24
+DEFAULT_CAPACITY = 1024
+EMPTY_SLOT = -1
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+
+
+def slot_count(capacity):
+    """Hash table size for capacity rows: at most half full, and a power of two"""
+    return 1 << (2 * capacity - 1).bit_length()
+
+
+def home_slot(user_id, slots):
+    """Where probing for user_id starts in a table of slots entries"""
+    return ((user_id * HASH_MULTIPLIER) & 0xFFFFFFFFFFFFFFFF) >> (64 - slots.bit_length() + 1)
+
+
+def find_slot(slots, user_ids, user_id):
+    """The slot holding user_id's row, or the empty slot where it would go"""
+    mask = len(slots) - 1
+    slot = home_slot(user_id, len(slots))
+    while True:
+        row = int(slots[slot])
+        if row == EMPTY_SLOT or user_ids[row] == user_id:
+            return slot
+        slot = (slot + 1) & mask
+
+
+def fill_slots(slots, user_ids):
+    """Point slots at every row of user_ids, which must be distinct, probing all rows at once"""
+    rows = np.arange(len(user_ids))
+    homes = (user_ids.astype(np.uint64) * np.uint64(HASH_MULTIPLIER)) >> np.uint64(64 - len(slots).bit_length() + 1)
+    positions = homes.astype(np.int64)
+    while len(rows):
+        # Of the rows reaching the same empty slot the first takes it; the rest probe on
+        free = np.flatnonzero(slots[positions] == EMPTY_SLOT)
+        _, first = np.unique(positions[free], return_index=True)
+        placed = free[first]
+        slots[positions[placed]] = rows[placed]
+        waiting = np.ones(len(rows), dtype=bool)
+        waiting[placed] = False
+        rows, positions = rows[waiting], (positions[waiting] + 1) & (len(slots) - 1)
+
+
+class Mapping:
+    """One mapped generation of the file"""
+
+    def __init__(self, mapped, inode, views):
+        self.mapped = mapped
+        self.inode = inode
+        self.vectors, self.user_ids, self.tombstones, self.slots = views
+
+    def count(self):
+        return struct.unpack_from('<Q', self.mapped, COUNT_OFFSET)[0]
+
+    def row_of(self, user_id, count):
+        """Newest row holding user_id among the first count rows, dead or alive"""
+        row = int(self.slots[find_slot(self.slots, self.user_ids, user_id)])
+        # A row the writer has not published yet replaces one it already tombstoned
+        return row if EMPTY_SLOT < row < count else None
+
+
+class DescriptorStore:
+    def __init__(self, path, dim=128):
+        self.path = os.fspath(path)
+        self.lock_path = self.path + '.lock'
+        self.dim = dim
+        self._mapping = None
+        self._map_lock = threading.Lock()
+
+    # Layout helpers
+
+    def _offsets(self, capacity):
+        ids_offset = HEADER_SIZE + capacity * self.dim * 4
+        tombstones_offset = ids_offset + capacity * 8
+        slots_offset = tombstones_offset + (capacity + 7) // 8
+        size = slots_offset + slot_count(capacity) * 8
+        return ids_offset, tombstones_offset, slots_offset, size
+
+    def _views_for(self, buffer, capacity):
+        ids_offset, tombstones_offset, slots_offset, _ = self._offsets(capacity)
+        vectors = np.frombuffer(buffer, dtype='<f4', count=capacity * self.dim, offset=HEADER_SIZE)
+        return (
+            vectors.reshape(capacity, self.dim),
+            np.frombuffer(buffer, dtype='<i8', count=capacity, offset=ids_offset),
+            np.frombuffer(buffer, dtype=np.uint8, count=(capacity + 7) // 8, offset=tombstones_offset),
+            np.frombuffer(buffer, dtype='<i8', count=slot_count(capacity), offset=slots_offset),
+        )
+
+    def _create(self, path, capacity):
+        *_, size = self._offsets(capacity)
+        with open(path, 'wb') as f:
+            f.truncate(size)
+            f.write(HEADER.pack(MAGIC, VERSION, self.dim, capacity, 0))
+
+    # Reader side
+
+    def _refresh(self):
+        """The Mapping of the current file, remapping when a writer replaced it"""
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return None
+        mapping = self._mapping
+        if mapping is not None and mapping.inode == inode:
+            return mapping
+        with self._map_lock:
+            if self._mapping is None or self._mapping.inode != inode:
+                with open(self.path, 'rb') as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, version, dim, capacity, _ = HEADER.unpack_from(mapped)
+                if magic != MAGIC or dim != self.dim:
+                    mapped.close()
+                    raise ValueError(f"{self.path} is not a {self.dim}-d descriptor store")
+                if version != VERSION:
+                    mapped.close()
+                    raise ValueError(f"{self.path} has layout version {version}; run build_descriptor_store")
+                # Older mappings are left to the GC: live NumPy views may still reference them
+                self._mapping = Mapping(mapped, inode, self._views_for(mapped, capacity))
+            return self._mapping
+
+    def _snapshot(self):
+        mapping = self._refresh()
+        if mapping is None:
+            return None
+        return mapping.count(), mapping.vectors, mapping.user_ids, mapping.tombstones
+
+    @staticmethod
+    def _is_dead(tombstones, rows):
+        return (tombstones[rows >> 3] >> (rows & 7).astype(np.uint8)) & 1 == 1
+
+    def __len__(self):
+        snapshot = self._snapshot()
+        if snapshot is None:
+            return 0
+        count, _, _, tombstones = snapshot
+        return count - int(np.unpackbits(tombstones, bitorder='little')[:count].sum())
+
+    def get(self, user_id):
+        """Return a read-only view of user_id's descriptor, or None if absent"""
+        mapping = self._refresh()
+        if mapping is None:
+            return None
+        row = mapping.row_of(int(user_id), mapping.count())
+        # A dead newest row means the user was deleted; a replacement is always appended later
+        if row is None or (mapping.tombstones[row >> 3] >> (row & 7)) & 1:
+            return None
+        return mapping.vectors[row]
+
+    def fetch(self, wanted_ids):
+        """Return (user_ids, vectors) for the live rows among wanted_ids"""
+        mapping = self._refresh()
+        if mapping is None:
+            return [], np.empty((0, self.dim), dtype=np.float32)
+        count = mapping.count()
+        rows = [mapping.row_of(int(user_id), count) for user_id in set(np.asarray(wanted_ids, dtype=np.int64).tolist())]
+        rows = np.array(sorted(row for row in rows if row is not None), dtype=np.int64)
+        rows = rows[~self._is_dead(mapping.tombstones, rows)]
+        return mapping.user_ids[rows].tolist(), mapping.vectors[rows]
+
+    def live(self):
+        """Return (user_ids, vectors) views plus a boolean mask of live rows"""
+        snapshot = self._snapshot()
+        if snapshot is None:
+            return np.empty(0, dtype=np.int64), np.empty((0, self.dim), dtype=np.float32), np.empty(0, dtype=bool)
+        count, vectors, user_ids, tombstones = snapshot
+        alive = np.unpackbits(tombstones, bitorder='little')[:count] == 0
+        return user_ids[:count], vectors[:count], alive
+
+    # Writer side
+
+    def _locked(self):
+        lock = open(self.lock_path, 'a+b')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def _write(self, user_id, vector):
+        with self._locked():
+            if not os.path.exists(self.path):
+                empty = np.empty((0, self.dim), dtype=np.float32)
+                self._replace(np.empty(0, dtype=np.int64), empty, DEFAULT_CAPACITY)
+            self._tombstone_and_append(user_id, vector)
+
+    def _tombstone_and_append(self, user_id, vector):
+        with open(self.path, 'r+b') as f:
+            mapped = mmap.mmap(f.fileno(), 0)
+        try:
+            _, _, _, capacity, count = HEADER.unpack_from(mapped)
+            vectors, user_ids, tombstones, slots = self._views_for(mapped, capacity)
+            # Older rows of the user were tombstoned when this one replaced them
+            slot = find_slot(slots, user_ids, user_id)
+            row = int(slots[slot])
+            if row != EMPTY_SLOT:
+                tombstones[row >> 3] |= 1 << (row & 7)
+            full = vector is not None and count == capacity
+            if vector is not None and not full:
+                vectors[count] = vector
+                user_ids[count] = user_id
+                mapped.flush()
+                slots[slot] = count
+                mapped.flush()
+                # Publishing the row is the very last write readers can see
+                struct.pack_into('<Q', mapped, COUNT_OFFSET, count + 1)
+            del vectors, user_ids, tombstones, slots
+            mapped.flush()
+        finally:
+            mapped.close()
+
+        if full:
+            self._grow(capacity)
+            self._tombstone_and_append(user_id, vector)
+
+    def _grow(self, capacity):
+        """Compact live rows into a file of twice the capacity and swap it in"""
+        user_ids, vectors, alive = DescriptorStore(self.path, self.dim).live()
+        self._replace(user_ids[alive], vectors[alive], capacity * 2)
+
+    def _replace(self, user_ids, vectors, capacity):
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        self._create(tmp_path, capacity)
+        with open(tmp_path, 'r+b') as f:
+            mapped = mmap.mmap(f.fileno(), 0)
+            target_vectors, target_ids, target_tombstones, target_slots = self._views_for(mapped, capacity)
+            target_vectors[:len(user_ids)] = vectors
+            target_ids[:len(user_ids)] = user_ids
+            target_slots[:] = EMPTY_SLOT
+            fill_slots(target_slots, np.asarray(user_ids, dtype=np.int64))
+            struct.pack_into('<Q', mapped, COUNT_OFFSET, len(user_ids))
+            del target_vectors, target_ids, target_tombstones, target_slots
+            mapped.flush()
+            mapped.close()
+        os.replace(tmp_path, self.path)
+
+    def put(self, user_id, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        if vector.shape != (self.dim,):
+            raise ValueError(f"Descriptor must have {self.dim} values")
+        self._write(int(user_id), vector)
+
+    def delete(self, user_id):
+        if os.path.exists(self.path):
+            self._write(int(user_id), None)
+
+    def rebuild(self, user_ids, vectors):
+        """Replace the whole file with the given rows"""
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        capacity = DEFAULT_CAPACITY
+        while capacity < len(user_ids):
+            capacity *= 2
+        with self._locked():
+            self._replace(user_ids, vectors, capacity)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_descriptor_store():
+    """Return the process-wide store, or None when FACE_DESCRIPTOR_STORE_PATH is unset"""
+    global _store
+    from django.conf import settings
+
+    path = getattr(settings, 'FACE_DESCRIPTOR_STORE_PATH', None)
+    if not path:
+        return None
+    if _store is None or _store.path != os.fspath(path):
+        with _store_lock:
+            if _store is None or _store.path != os.fspath(path):
+                _store = DescriptorStore(path)
+    return _store
@@ -0,0 +1,103 @@
+"""
+Looking for the same face enrolled under several accounts.
+
+Comparing a new enrollment against every stored face is far too slow for
+the enrollment request, so ``schedule_duplicate_scan`` queues it on a
+background thread once the enrollment commits. The scan walks stored
+descriptors in blocks, from the shared descriptor store when there is one
+and from the database otherwise, and measures a whole block against the
+new face at once. Every account closer than ``FACE_DUPLICATE_THRESHOLD`` is
+recorded as a ``DuplicateFaceMatch`` for review, replacing the matches of
+any earlier enrollment that nobody has reviewed yet; with
+``FACE_DUPLICATE_FLAG_ACCOUNTS`` on, the enrolling account's
+``face_flagged`` is set as well.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from mfa.codec import decode_descriptor
+from mfa.descriptor_store import get_descriptor_store
+from mfa.identification import FACE_DESCRIPTOR_DIM, iter_face_descriptors
+from mfa.models import DuplicateFaceMatch, MFAProfile
+
+logger = logging.getLogger(__name__)
+
+SCAN_BLOCK_SIZE = 8192
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='duplicate-faces')
+    return _executor
+
+
+def iter_descriptor_blocks(block_size=SCAN_BLOCK_SIZE):
+    """(user_ids, descriptors) blocks of every enrolled face"""
+    store = get_descriptor_store()
+    if store is not None and len(store):
+        user_ids, vectors, alive = store.live()
+        for start in range(0, len(user_ids), block_size):
+            live = alive[start:start + block_size]
+            yield user_ids[start:start + block_size][live], vectors[start:start + block_size][live]
+    else:
+        yield from iter_face_descriptors(batch_size=block_size)
+
+
+def scan_blocks(descriptor, blocks, threshold, exclude=None):
+    """[(user_id, distance)] closer than threshold, nearest first, skipping user id exclude"""
+    matches = []
+    for user_ids, vectors in blocks:
+        distances = np.linalg.norm(vectors - descriptor, axis=1)
+        close = np.flatnonzero((distances < threshold) & (user_ids != exclude))
+        matches.extend(zip(user_ids[close].tolist(), distances[close].tolist()))
+    return sorted(matches, key=lambda match: match[1])
+
+
+def scan_enrollment(user_id, block_size=SCAN_BLOCK_SIZE):
+    """Record the accounts whose face matches user_id's; returns the matches found"""
+    face_data = MFAProfile.objects.for_user(user_id).filter(user_id=user_id).values_list('face_data', flat=True).first()
+    if not face_data:
+        return []
+    descriptor = decode_descriptor(face_data)
+    if descriptor.shape != (FACE_DESCRIPTOR_DIM,):
+        return []
+
+    blocks = iter_descriptor_blocks(block_size)
+    matches = scan_blocks(descriptor, blocks, settings.FACE_DUPLICATE_THRESHOLD, exclude=user_id)
+    recorded = DuplicateFaceMatch.objects.for_user(user_id)
+    with transaction.atomic(using=recorded.db):
+        # Matches against a replaced face are stale; reviewed ones stay as the reviewer's record
+        recorded.filter(user_id=user_id, reviewed=False).delete()
+        for matched_user_id, distance in matches:
+            recorded.update_or_create(user_id=user_id, matched_user_id=matched_user_id, defaults={'distance': distance})
+    if matches:
+        logger.warning("Face enrolled by user %s matches %d other account(s)", user_id, len(matches))
+        if settings.FACE_DUPLICATE_FLAG_ACCOUNTS:
+            MFAProfile.objects.for_user(user_id).filter(user_id=user_id).update(face_flagged=True)
+    return matches
+
+
+def run_scan(user_id):
+    try:
+        return scan_enrollment(user_id)
+    except Exception:
+        logger.exception("Duplicate face scan failed for user %s", user_id)
+        return None
+
+
+def schedule_duplicate_scan(profile):
+    """Scan profile's face on the background thread once the current transaction commits"""
+    if profile.face_data:
+        user_id = profile.user_id
+        transaction.on_commit(lambda: get_executor().submit(run_scan, user_id), using=profile._state.db)
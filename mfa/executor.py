@@ -0,0 +1,37 @@
+"""
+Bounded worker pool for the CPU-bound parts of async biometric views.
+
+NumPy releases the GIL for most array maths, so a handful of threads keeps
+descriptor comparisons off the event loop. ``FACE_MATCH_WORKERS`` caps how
+many run at once; further calls queue for a worker instead of starting
+threads of their own.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_workers():
+    return getattr(settings, 'FACE_MATCH_WORKERS', None) or min(4, os.cpu_count() or 1)
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=get_workers(), thread_name_prefix='face-match')
+    return _executor
+
+
+async def run_cpu_bound(func, *args, **kwargs):
+    """Await func(*args, **kwargs) on the shared worker pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), partial(func, *args, **kwargs))
@@ -0,0 +1,195 @@
+"""
+The face-api model weights the login and enrollment pages download.
+
+``static/models`` holds every network face-api ships, most of which no
+page loads. ``build_bundle`` copies just the networks named in
+``faceapi.nets.<net>.loadFrom...`` calls in the templates into
+``FACE_MODEL_BUNDLE_DIR``. Every shard and manifest gets a content hash in
+its name, the manifests are rewritten to point at the hashed shards, and
+each file gets ``.gz`` (and ``.br`` when the brotli package is installed)
+siblings. ``bundle.json`` maps each net to its manifest.
+
+``serve_face_model`` sends those files with the best encoding the browser
+accepts and, since a name never changes meaning, as immutable for a year.
+Until a bundle is built, pages fall back to ``static/models``.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+from pathlib import Path
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.templatetags.static import static
+from django.urls import reverse
+from django.utils.http import parse_etags
+from django.views.decorators.http import require_safe
+
+from accounts.media import IMMUTABLE, file_etag
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# faceapi.nets attribute -> file name prefix of its manifest and shards
+NET_MODELS = {
+    'tinyFaceDetector': 'tiny_face_detector_model',
+    'ssdMobilenetv1': 'ssd_mobilenetv1_model',
+    'mtcnn': 'mtcnn_model',
+    'faceLandmark68Net': 'face_landmark_68_model',
+    'faceLandmark68TinyNet': 'face_landmark_68_tiny_model',
+    'faceRecognitionNet': 'face_recognition_model',
+    'faceExpressionNet': 'face_expression_model',
+    'ageGenderNet': 'age_gender_model',
+}
+NET_LOAD = re.compile(r'faceapi\.nets\.(\w+)\.load')
+INDEX_FILE = 'bundle.json'
+# Preferred first when the browser accepts several
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+SAFE_NAME = re.compile(r'^[\w.-]+$')
+
+
+def nets_used_by_templates(template_dirs):
+    """Every faceapi net a template under template_dirs loads"""
+    nets = set()
+    for directory in template_dirs:
+        for path in Path(directory).rglob('*.html'):
+            nets.update(NET_LOAD.findall(path.read_text(encoding='utf-8')))
+    unknown = nets - set(NET_MODELS)
+    if unknown:
+        raise ValueError(f"Templates load face-api nets with no known weights: {', '.join(sorted(unknown))}")
+    return sorted(nets)
+
+
+def hashed_name(name, data, suffix=''):
+    return f'{name}.{hashlib.sha256(data).hexdigest()[:16]}{suffix}'
+
+
+def write_encoded(output_dir, name, data):
+    """Write name and its precompressed siblings; return the bytes written per encoding"""
+    sizes = {'identity': len(data)}
+    (output_dir / name).write_bytes(data)
+    # mtime=0 keeps the .gz identical across builds of the same input
+    compressed = {'gzip': gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        compressed['br'] = brotli.compress(data, quality=11)
+    for encoding, suffix in ENCODINGS:
+        if encoding in compressed:
+            (output_dir / (name + suffix)).write_bytes(compressed[encoding])
+            sizes[encoding] = len(compressed[encoding])
+    return sizes
+
+
+def build_bundle(source_dir, output_dir, nets):
+    """
+    Replace output_dir with hashed, precompressed copies of the given nets.
+
+    Returns the index written to ``bundle.json``. Raises FileNotFoundError
+    when a manifest or one of its shards is missing: a partial bundle would
+    only fail later, in the browser.
+    """
+    source_dir, output_dir = Path(source_dir), Path(output_dir)
+    files = {}
+    index = {'nets': {}, 'files': {}}
+    for net in nets:
+        model = NET_MODELS[net]
+        manifest = json.loads((source_dir / f'{model}-weights_manifest.json').read_text())
+        for group in manifest:
+            hashed_paths = []
+            for shard in group['paths']:
+                data = (source_dir / shard).read_bytes()
+                name = hashed_name(shard, data)
+                files[name] = data
+                hashed_paths.append(name)
+            group['paths'] = hashed_paths
+        data = json.dumps(manifest, separators=(',', ':')).encode()
+        # Ends in .json so loadFromUri takes it as the manifest itself
+        name = hashed_name(f'{model}-weights_manifest', data, '.json')
+        files[name] = data
+        index['nets'][net] = name
+
+    if output_dir.exists():
+        shutil.rmtree(output_dir)
+    output_dir.mkdir(parents=True)
+    for name, data in files.items():
+        index['files'][name] = write_encoded(output_dir, name, data)
+    (output_dir / INDEX_FILE).write_text(json.dumps(index, indent=2, sort_keys=True))
+    return index
+
+
+_index_cache = {}
+
+
+def load_index():
+    """The built bundle's index, or None when there is none; re-read when the file changes"""
+    path = os.path.join(settings.FACE_MODEL_BUNDLE_DIR, INDEX_FILE)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _index_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path) as index_file:
+            cached = _index_cache[path] = (mtime, json.load(index_file))
+    return cached[1]
+
+
+def model_url(net):
+    """What to pass to faceapi.nets.<net>.loadFromUri"""
+    index = load_index()
+    if index and net in index['nets']:
+        return reverse('face-model', args=[index['nets'][net]])
+    return static('models')
+
+
+def accepted_encodings(header):
+    """Content codings the Accept-Encoding header allows, ignoring q=0 entries"""
+    accepted = set()
+    for item in (header or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding and quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+@require_safe
+def serve_face_model(request, name):
+    index = load_index()
+    if not index or not SAFE_NAME.match(name) or name not in index['files']:
+        raise Http404("Unknown face model file")
+
+    accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING'))
+    encoding, path = None, os.path.join(settings.FACE_MODEL_BUNDLE_DIR, name)
+    for candidate, suffix in ENCODINGS:
+        if (candidate in accepted or '*' in accepted) and candidate in index['files'][name]:
+            encoding, path = candidate, path + suffix
+            break
+    try:
+        stat = os.stat(path)
+    except OSError:
+        raise Http404("Unknown face model file")
+
+    etag = file_etag(stat)
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+    else:
+        content_type = 'application/json' if name.endswith('.json') else 'application/octet-stream'
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    response['Cache-Control'] = IMMUTABLE
+    response['Vary'] = 'Accept-Encoding'
+    return response
@@ -3,8 +3,9 @@ from django.shortcuts import render
 from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.conf import settings
+from .codec import decode_descriptor, encode_descriptor
 from .models import MFAProfile
-import struct
 import numpy as np
 import json
 import secrets
@@ -54,7 +55,9 @@ def register_fingerprint(request):
         if not stored_challenge:
             return JsonResponse({'error': 'Invalid challenge'}, status=400)
 
-        mfa_profile, created = MFAProfile.objects.get_or_create(user=request.user)
+        mfa_profile, created = MFAProfile.objects.for_user(request.user).defer('face_data').get_or_create(
+            user=request.user
+        )
 
         credential_binary = json.dumps(credential_data).encode('utf-8')
         mfa_profile.fingerprint_data = credential_binary
@@ -87,14 +90,16 @@ def setup_face(request):
             # Convert the array to binary data
             try:
                 # Convert the facial data array to bytes
-                binary_data = struct.pack('f' * len(facial_data), *facial_data)
+                binary_data = encode_descriptor(facial_data, dtype=settings.FACE_DESCRIPTOR_STORAGE_DTYPE)
             except Exception as e:
                 return JsonResponse({
                     "message": f"Invalid facial data format: {str(e)}"
                 }, status=400)
 
             # Get or create MFAProfile
-            mfa_profile, created = MFAProfile.objects.get_or_create(user=request.user)
+            mfa_profile, created = MFAProfile.objects.for_user(request.user).defer('fingerprint_data').get_or_create(
+                user=request.user
+            )
             mfa_profile.face_data = binary_data
             mfa_profile.save()
 
@@ -115,20 +120,11 @@ def setup_face(request):
     return render(request, 'mfa/setup-face.html')
 
 
-def convert_binary_to_array(binary_data):
-    """Convert binary data back to facial descriptor array"""
-    float_count = len(binary_data) // struct.calcsize('f')
-    return struct.unpack('f' * float_count, binary_data)
-
-
 def verify_face(stored_face_data, new_face_descriptor):
     if stored_face_data:
-        # Convert stored binary data back to array
-        stored_descriptor = convert_binary_to_array(stored_face_data)
-
-        # Convert to numpy arrays for distance calculation
-        stored_array = np.array(stored_descriptor)
-        new_array = np.array(new_face_descriptor)
+        # Decode stored binary data into a descriptor view
+        stored_array = decode_descriptor(stored_face_data)
+        new_array = np.asarray(new_face_descriptor, dtype=np.float32)
 
         # Calculate Euclidean distance
         distance = np.linalg.norm(stored_array - new_array)
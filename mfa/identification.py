@@ -0,0 +1,327 @@
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+from mfa.codec import decode_descriptor
+from mfa.descriptor_store import get_descriptor_store
+from mfa.index import FlatIndex, IVFPQIndex, index_from_arrays
+from mfa.models import FaceIndexChange, MFAProfile
+from mfa.routers import biometric_databases, group_by_shard
+
+logger = logging.getLogger(__name__)
+
+FACE_DESCRIPTOR_DIM = 128
+# Change ids are handed out on insert, so a slow transaction can commit a
+# lower id after higher ones; every catch-up re-reads this many ids back
+CHANGE_LOOKBACK = 100
+# Change rows older than this are deleted, at most once per PRUNE_INTERVAL in
+# each process. An index that last caught up more than half of it ago may
+# have missed pruned rows, so it is rebuilt instead of replayed.
+CHANGE_RETENTION = timedelta(days=1)
+PRUNE_INTERVAL = timedelta(minutes=10)
+# Fewer enrolled faces than this are scanned exactly instead of trained on
+MIN_INDEX_FACES = 1000
+# An index is retrained once it holds this many times the faces it was trained on
+RETRAIN_GROWTH = 2
+
+_index = None
+_index_lock = threading.Lock()
+_last_pruned = None
+
+
+def iter_face_descriptors(batch_size=2000):
+    """Yield (user_ids, descriptors) batches for every enrolled face, shard by shard"""
+    ids, vectors = [], []
+    for alias in biometric_databases():
+        rows = (
+            MFAProfile.objects.using(alias)
+            .exclude(face_data__isnull=True)
+            .values_list('user_id', 'face_data')
+            .iterator(chunk_size=batch_size)
+        )
+        for user_id, face_data in rows:
+            vector = decode_descriptor(face_data)
+            if len(vector) != FACE_DESCRIPTOR_DIM:
+                continue
+            ids.append(user_id)
+            vectors.append(vector)
+            if len(ids) == batch_size:
+                yield np.array(ids, dtype=np.int64), np.vstack(vectors)
+                ids, vectors = [], []
+    if ids:
+        yield np.array(ids, dtype=np.int64), np.vstack(vectors)
+
+
+def read_face_descriptors(user_ids):
+    """Like fetch_face_descriptors, but always from the databases, which commit before the store is written"""
+    ids, vectors = [], []
+    for alias, shard_user_ids in group_by_shard(user_ids).items():
+        rows = MFAProfile.objects.using(alias).filter(user_id__in=shard_user_ids).values_list('user_id', 'face_data')
+        for user_id, face_data in rows:
+            if not face_data:
+                continue
+            vector = decode_descriptor(face_data)
+            if len(vector) == FACE_DESCRIPTOR_DIM:
+                ids.append(user_id)
+                vectors.append(vector)
+    if not ids:
+        return [], np.empty((0, FACE_DESCRIPTOR_DIM), dtype=np.float32)
+    return ids, np.vstack(vectors)
+
+
+def fetch_face_descriptors(user_ids):
+    """Load exact descriptors for a short list of candidates, from the shared store when configured"""
+    store = get_descriptor_store()
+    if store is not None:
+        return store.fetch(user_ids)
+    return read_face_descriptors(user_ids)
+
+
+def get_face_descriptor(user_id):
+    """
+    Return user_id's enrolled descriptor, or None when face ID is not set up.
+
+    Reads the shared descriptor store first and only falls back to the
+    database when the store is disabled or has no row for the user.
+    """
+    store = get_descriptor_store()
+    if store is not None:
+        descriptor = store.get(user_id)
+        if descriptor is not None:
+            return descriptor
+    face_data = MFAProfile.objects.for_login(user_id).values_list('face_data', flat=True).get(user_id=user_id)
+    return decode_descriptor(face_data) if face_data else None
+
+
+async def aget_face_descriptor(user_id):
+    """Async get_face_descriptor; the shared store is an in-memory read and stays inline"""
+    store = get_descriptor_store()
+    if store is not None:
+        descriptor = store.get(user_id)
+        if descriptor is not None:
+            return descriptor
+    face_data = await MFAProfile.objects.for_login(user_id).values_list('face_data', flat=True).aget(user_id=user_id)
+    return decode_descriptor(face_data) if face_data else None
+
+
+def build_face_index(**index_kwargs):
+    """
+    A fresh index of every stored face descriptor.
+
+    An IVF-PQ index trained on them all, or an exact FlatIndex while there
+    are fewer than MIN_INDEX_FACES.
+    """
+    store = get_descriptor_store()
+    if store is not None and len(store):
+        ids, vectors, alive = store.live()
+        ids, vectors = ids[alive], vectors[alive]
+    else:
+        batches = list(iter_face_descriptors())
+        ids = np.concatenate([batch_ids for batch_ids, _ in batches]) if batches else np.empty(0, dtype=np.int64)
+        vectors = (np.vstack([batch_vectors for _, batch_vectors in batches]) if batches
+                   else np.empty((0, FACE_DESCRIPTOR_DIM), dtype=np.float32))
+    if len(ids) < MIN_INDEX_FACES:
+        index = FlatIndex(dim=FACE_DESCRIPTOR_DIM)
+    else:
+        index = IVFPQIndex(dim=FACE_DESCRIPTOR_DIM, **index_kwargs)
+        index.train(vectors)
+    index.add(ids, vectors)
+    return index
+
+
+def needs_training(index):
+    """Whether index holds too many faces for how, or whether, it was trained"""
+    if isinstance(index, FlatIndex):
+        return len(index) >= MIN_INDEX_FACES
+    if not index.is_trained:
+        return True
+    return len(index) > RETRAIN_GROWTH * max(index.training_size, MIN_INDEX_FACES)
+
+
+def face_index_path():
+    return getattr(settings, 'FACE_INDEX_PATH', None)
+
+
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def recent_face_changes(alias, newest_seen=0):
+    """(id, user_id) of alias's face changes from CHANGE_LOOKBACK before newest_seen on"""
+    return list(
+        FaceIndexChange.objects.using(alias)
+        .filter(id__gt=newest_seen - CHANGE_LOOKBACK)
+        .values_list('id', 'user_id')
+    )
+
+
+def prune_face_changes():
+    """Delete change rows older than CHANGE_RETENTION, unless this process did so within PRUNE_INTERVAL"""
+    global _last_pruned
+    now = timezone.now()
+    if _last_pruned is not None and now - _last_pruned < PRUNE_INTERVAL:
+        return
+    _last_pruned = now
+    for alias in biometric_databases():
+        FaceIndexChange.objects.using(alias).filter(created_at__lt=now - CHANGE_RETENTION).delete()
+
+
+class FaceIndex:
+    """
+    A FlatIndex or IVFPQIndex and the face changes already in it.
+
+    ``applied`` maps each shard alias to the ids of its newest FaceIndexChange
+    rows that the index reflects, and ``synced_at`` is the time.time() they
+    were read at. ``path`` and ``signature`` identify the published file it
+    was loaded from, if any.
+    """
+
+    def __init__(self, index, applied, path=None, signature=None, synced_at=None):
+        self.index = index
+        self.applied = applied
+        self.path = path
+        self.signature = signature
+        self.synced_at = time.time() if synced_at is None else synced_at
+
+    @classmethod
+    def build(cls, path=None, signature=None, **index_kwargs):
+        synced_at = time.time()
+        # Changes read first are certainly in the rows read after them
+        applied = {alias: frozenset(change_id for change_id, _ in recent_face_changes(alias))
+                   for alias in biometric_databases()}
+        return cls(build_face_index(**index_kwargs), applied, path, signature, synced_at)
+
+    @classmethod
+    def load(cls, path):
+        signature = file_signature(path)
+        with np.load(path, allow_pickle=False) as data:
+            arrays = dict(data)
+        applied = {alias: frozenset() for alias in biometric_databases()}
+        for alias, change_id in zip(arrays.pop('change_aliases').tolist(), arrays.pop('change_ids').tolist()):
+            applied[alias] = applied.get(alias, frozenset()) | {change_id}
+        synced_at = float(arrays.pop('synced_at')) if 'synced_at' in arrays else signature[1] / 1e9
+        return cls(index_from_arrays(arrays), applied, path, signature, synced_at)
+
+    def save(self, path):
+        """Publish the index to path in one os.replace, so workers never see half a file"""
+        change_aliases = [alias for alias, change_ids in self.applied.items() for _ in change_ids]
+        change_ids = [change_id for change_ids in self.applied.values() for change_id in change_ids]
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                change_aliases=np.array(change_aliases, dtype=str),
+                change_ids=np.array(change_ids, dtype=np.int64),
+                synced_at=np.array(self.synced_at),
+                **self.index.to_arrays(),
+            )
+        os.replace(tmp_path, path)
+
+    def is_stale(self):
+        """Whether a newer index was published to FACE_INDEX_PATH since this one was loaded"""
+        path = face_index_path()
+        if path != self.path:
+            return True
+        return path is not None and file_signature(path) != self.signature
+
+    def caught_up(self):
+        """This index with every face change committed since it was built, as a copy"""
+        synced_at = time.time()
+        if synced_at - self.synced_at > CHANGE_RETENTION.total_seconds() / 2:
+            logger.info("The face index last caught up too long ago to replay changes; rebuilding it")
+            return FaceIndex.build(self.path, self.signature)
+        prune_face_changes()
+        applied, changed = {}, set()
+        for alias in biometric_databases():
+            seen = self.applied.get(alias, frozenset())
+            rows = recent_face_changes(alias, max(seen, default=0))
+            changed.update(user_id for change_id, user_id in rows if change_id not in seen)
+            newest = max((change_id for change_id, _ in rows), default=max(seen, default=0))
+            applied[alias] = frozenset(
+                change_id for change_id in seen.union(change_id for change_id, _ in rows)
+                if change_id > newest - CHANGE_LOOKBACK
+            )
+        if not changed:
+            return FaceIndex(self.index, applied, self.path, self.signature, synced_at)
+        if self.index.is_trained:
+            index = self.index.copy()
+            index.remove(list(changed))
+            ids, vectors = read_face_descriptors(changed)
+            index.add(ids, vectors)
+            if not needs_training(index):
+                return FaceIndex(index, applied, self.path, self.signature, synced_at)
+        logger.info("Retraining the face index in this process")
+        return FaceIndex.build(self.path, self.signature)
+
+
+def open_face_index():
+    path = face_index_path()
+    if path is not None:
+        try:
+            return FaceIndex.load(path)
+        except FileNotFoundError:
+            logger.warning("No face index at %s; training one in this process. "
+                           "Publish one with manage.py build_face_index.", path)
+    return FaceIndex.build(path)
+
+
+def get_face_index():
+    """
+    This process's face index, caught up with every committed face change.
+
+    Searches keep the index object they were handed; catching up swaps in a
+    modified copy rather than changing it under them.
+    """
+    global _index
+    with _index_lock:
+        if _index is None or _index.is_stale():
+            _index = open_face_index()
+        _index = _index.caught_up()
+        return _index.index
+
+
+def warm_face_index():
+    """
+    Load the published index at startup, so the first identification does not wait for it.
+
+    Without FACE_INDEX_PATH there is nothing to load, and training here would
+    run k-means in every worker as it starts; the first identification
+    builds the index instead.
+    """
+    if face_index_path() is None:
+        return
+    try:
+        get_face_index()
+    except DatabaseError:
+        logger.exception("Could not load the face index; the first identification will retry")
+
+
+def reset_face_index():
+    global _index, _last_pruned
+    with _index_lock:
+        _index = None
+        _last_pruned = None
+
+
+def record_face_change(instance):
+    """Note a change to instance's face for every worker's index, inside the transaction making it"""
+    FaceIndexChange.objects.using(instance._state.db).create(user_id=instance.user_id)
+
+
+def identify_face(face_descriptor, k=5):
+    """Return the k enrolled users closest to face_descriptor as (user_id, distance)"""
+    query = np.asarray(face_descriptor, dtype=np.float32)
+    if query.shape != (FACE_DESCRIPTOR_DIM,):
+        raise ValueError(f"Face descriptor must have {FACE_DESCRIPTOR_DIM} values")
+    return get_face_index().search(query, k=k, fetch_vectors=fetch_face_descriptors)
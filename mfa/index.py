@@ -0,0 +1,295 @@
+import copy
+
+import numpy as np
+
+
+def _assign(data, centroids, chunk_size=8192):
+    """Index of the nearest centroid for every row, computed in bounded chunks"""
+    # ||x||^2 is constant per row, so argmin only needs ||c||^2 - 2 x.c
+    centroid_norms = np.einsum('ij,ij->i', centroids, centroids)
+    labels = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), chunk_size):
+        scores = data[start:start + chunk_size] @ centroids.T
+        scores *= -2.0
+        scores += centroid_norms
+        labels[start:start + chunk_size] = np.argmin(scores, axis=1)
+    return labels
+
+
+def kmeans(data, k, iterations=20, seed=0):
+    """Plain Lloyd k-means returning a (k, dim) float32 centroid matrix"""
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), size=k, replace=len(data) < k)].copy()
+
+    for _ in range(iterations):
+        labels = _assign(data, centroids)
+        order = np.argsort(labels, kind='stable')
+        counts = np.bincount(labels, minlength=k)
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        sums = np.add.reduceat(data[order], starts, axis=0)
+        centroids[filled] = sums / counts[filled, None]
+
+        # Re-seed empty clusters from random points so every list stays usable
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), size=len(empty))]
+
+    return centroids
+
+
+class IVFPQIndex:
+    """
+    Inverted-file index with product-quantized residuals for 1:N face search.
+
+    Vectors are bucketed by their nearest coarse centroid and each residual is
+    stored as ``m`` one-byte codes, so a 128-d float32 descriptor costs 16 bytes
+    instead of 512. Search scans only the ``nprobe`` closest buckets using
+    asymmetric distance tables, then re-ranks a short list with exact distances
+    when a ``fetch_vectors`` callable is supplied.
+    """
+
+    def __init__(self, dim=128, nlist=None, m=16, nbits=8, nprobe=8):
+        if dim % m:
+            raise ValueError("dim must be divisible by m")
+        self.dim = dim
+        self.nlist = nlist
+        self.m = m
+        self.ksub = 1 << nbits
+        self.dsub = dim // m
+        self.nprobe = nprobe
+        self.coarse_centroids = None
+        self.pq_centroids = None
+        # How many vectors train() was given, before any sampling
+        self.training_size = 0
+        self._list_ids = []
+        self._list_codes = []
+
+    @property
+    def is_trained(self):
+        return self.coarse_centroids is not None
+
+    def __len__(self):
+        return sum(len(ids) for ids in self._list_ids)
+
+    def train(self, vectors, max_training_points=65536, seed=0):
+        """Learn coarse centroids and PQ codebooks from a sample of vectors"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if len(vectors) == 0:
+            raise ValueError("Cannot train an index without vectors")
+        rng = np.random.default_rng(seed)
+        self.training_size = len(vectors)
+        if len(vectors) > max_training_points:
+            vectors = vectors[rng.choice(len(vectors), size=max_training_points, replace=False)]
+
+        nlist = self.nlist or max(1, min(4096, int(4 * np.sqrt(len(vectors)))))
+        self.nlist = min(nlist, len(vectors))
+        self.coarse_centroids = kmeans(vectors, self.nlist, seed=seed)
+
+        residuals = vectors - self.coarse_centroids[_assign(vectors, self.coarse_centroids)]
+        ksub = min(self.ksub, len(vectors))
+        self.pq_centroids = np.zeros((self.m, self.ksub, self.dsub), dtype=np.float32)
+        for j in range(self.m):
+            sub = residuals[:, j * self.dsub:(j + 1) * self.dsub]
+            self.pq_centroids[j, :ksub] = kmeans(sub, ksub, iterations=10, seed=seed + j)
+            self.pq_centroids[j, ksub:] = np.inf
+        self._prepare_tables()
+
+        self._list_ids = [np.empty(0, dtype=np.int64) for _ in range(self.nlist)]
+        self._list_codes = [np.empty((0, self.m), dtype=np.uint8) for _ in range(self.nlist)]
+
+    def copy(self):
+        """A copy whose add and remove leave this index untouched; the arrays themselves are shared"""
+        clone = copy.copy(self)
+        clone._list_ids = list(self._list_ids)
+        clone._list_codes = list(self._list_codes)
+        return clone
+
+    def to_arrays(self):
+        """The index as a dict of arrays, e.g. for np.savez"""
+        arrays = {'params': np.array([self.dim, self.nlist or 0, self.m, self.ksub, self.nprobe], dtype=np.int64)}
+        if self.is_trained:
+            arrays.update(
+                coarse_centroids=self.coarse_centroids,
+                pq_centroids=self.pq_centroids,
+                training_size=np.array(self.training_size, dtype=np.int64),
+                list_sizes=np.array([len(ids) for ids in self._list_ids], dtype=np.int64),
+                ids=np.concatenate(self._list_ids),
+                codes=np.concatenate(self._list_codes),
+            )
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Rebuild an index from the output of to_arrays"""
+        dim, nlist, m, ksub, nprobe = (int(value) for value in arrays['params'])
+        index = cls(dim=dim, nlist=nlist or None, m=m, nbits=ksub.bit_length() - 1, nprobe=nprobe)
+        if 'coarse_centroids' in arrays:
+            index.coarse_centroids = np.ascontiguousarray(arrays['coarse_centroids'], dtype=np.float32)
+            index.pq_centroids = np.ascontiguousarray(arrays['pq_centroids'], dtype=np.float32)
+            index._prepare_tables()
+            bounds = np.concatenate(([0], np.cumsum(arrays['list_sizes'])))
+            index._list_ids = [arrays['ids'][start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+            index._list_codes = [arrays['codes'][start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+            index.training_size = int(arrays['training_size']) if 'training_size' in arrays else len(index)
+        return index
+
+    def _prepare_tables(self):
+        # Cached pieces of ||r - c||^2 = ||r||^2 - 2 r.c + ||c||^2 for search
+        finite = np.where(np.isfinite(self.pq_centroids), self.pq_centroids, 0.0)
+        self._pq_transposed = np.ascontiguousarray(finite.transpose(0, 2, 1))
+        self._pq_norms = np.where(
+            np.isfinite(self.pq_centroids[:, :, 0]),
+            np.einsum('mkd,mkd->mk', finite, finite),
+            np.inf,
+        ).astype(np.float32)
+
+    def _encode(self, residuals):
+        codes = np.empty((len(residuals), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            sub = residuals[:, j * self.dsub:(j + 1) * self.dsub]
+            centroids = self.pq_centroids[j]
+            finite = np.isfinite(centroids[:, 0])
+            codes[:, j] = _assign(sub, centroids[finite])
+        return codes
+
+    def add(self, ids, vectors):
+        """Encode vectors and append them to their inverted lists"""
+        if not self.is_trained:
+            raise RuntimeError("Index must be trained before adding vectors")
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if len(ids) != len(vectors):
+            raise ValueError("ids and vectors must have the same length")
+        if len(ids) == 0:
+            return
+
+        labels = _assign(vectors, self.coarse_centroids)
+        codes = self._encode(vectors - self.coarse_centroids[labels])
+        order = np.argsort(labels, kind='stable')
+        bounds = np.searchsorted(labels[order], np.arange(self.nlist + 1))
+        for list_no in np.flatnonzero(np.diff(bounds)):
+            chunk = order[bounds[list_no]:bounds[list_no + 1]]
+            self._list_ids[list_no] = np.concatenate((self._list_ids[list_no], ids[chunk]))
+            self._list_codes[list_no] = np.concatenate((self._list_codes[list_no], codes[chunk]))
+
+    def remove(self, ids):
+        """Drop every entry whose id is in ids"""
+        ids = np.asarray(ids, dtype=np.int64)
+        for list_no, list_ids in enumerate(self._list_ids):
+            keep = ~np.isin(list_ids, ids)
+            if not keep.all():
+                self._list_ids[list_no] = list_ids[keep]
+                self._list_codes[list_no] = self._list_codes[list_no][keep]
+
+    def search(self, query, k=5, nprobe=None, rerank=None, fetch_vectors=None):
+        """
+        Return up to k ``(id, distance)`` pairs nearest to query.
+
+        Distances are approximate unless ``fetch_vectors(ids)`` is given, in
+        which case the best ``rerank`` candidates are re-scored exactly.
+        """
+        if not self.is_trained:
+            return []
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+
+        coarse = np.sum((self.coarse_centroids - query) ** 2, axis=1)
+        probes = np.argpartition(coarse, nprobe - 1)[:nprobe] if nprobe < self.nlist else np.arange(self.nlist)
+
+        probes = [list_no for list_no in probes if len(self._list_ids[list_no])]
+        if not probes:
+            return []
+
+        # One (nprobe, m, ksub) batch of asymmetric distance tables
+        residuals = (query - self.coarse_centroids[probes]).reshape(len(probes), self.m, self.dsub)
+        tables = np.matmul(residuals.transpose(1, 0, 2), self._pq_transposed).transpose(1, 0, 2)
+        tables *= -2.0
+        tables += self._pq_norms
+        tables += np.einsum('pmd,pmd->pm', residuals, residuals)[:, :, None]
+
+        subspaces = np.arange(self.m)
+        candidate_ids = []
+        candidate_distances = []
+        for table, list_no in zip(tables, probes):
+            candidate_distances.append(table[subspaces, self._list_codes[list_no]].sum(axis=1))
+            candidate_ids.append(self._list_ids[list_no])
+
+        ids = np.concatenate(candidate_ids)
+        distances = np.concatenate(candidate_distances)
+
+        shortlist = k if fetch_vectors is None else max(k, rerank or 8 * k)
+        if len(ids) > shortlist:
+            top = np.argpartition(distances, shortlist - 1)[:shortlist]
+            ids, distances = ids[top], distances[top]
+
+        if fetch_vectors is not None:
+            found_ids, vectors = fetch_vectors(ids)
+            ids = np.asarray(found_ids, dtype=np.int64)
+            if len(ids) == 0:
+                return []
+            distances = np.sum((np.asarray(vectors, dtype=np.float32) - query) ** 2, axis=1)
+
+        order = np.argsort(distances)[:k]
+        return [(int(ids[i]), float(np.sqrt(max(distances[i], 0.0)))) for i in order]
+
+
+class FlatIndex:
+    """
+    Exact search over vectors held in memory, with the same interface as IVFPQIndex.
+
+    For populations too small to train an IVFPQIndex on: k-means over a
+    handful of faces gives one or two lists and codebooks that fit nothing
+    enrolled later, while scanning a few hundred vectors costs next to nothing.
+    """
+
+    is_trained = True
+
+    def __init__(self, dim=128):
+        self.dim = dim
+        self.ids = np.empty(0, dtype=np.int64)
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, ids, vectors):
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if len(ids) != len(vectors):
+            raise ValueError("ids and vectors must have the same length")
+        self.ids = np.concatenate((self.ids, ids))
+        self.vectors = np.vstack((self.vectors, vectors))
+
+    def remove(self, ids):
+        keep = ~np.isin(self.ids, np.asarray(ids, dtype=np.int64))
+        self.ids, self.vectors = self.ids[keep], self.vectors[keep]
+
+    def copy(self):
+        """A copy whose add and remove leave this index untouched; both replace the arrays rather than write to them"""
+        return copy.copy(self)
+
+    def search(self, query, k=5, **kwargs):
+        """Return up to k ``(id, distance)`` pairs nearest to query; IVFPQIndex's tuning arguments are ignored"""
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        distances = np.sum((self.vectors - query) ** 2, axis=1)
+        order = np.argsort(distances)[:k]
+        return [(int(self.ids[i]), float(np.sqrt(distances[i]))) for i in order]
+
+    def to_arrays(self):
+        return {'flat_ids': self.ids, 'flat_vectors': self.vectors}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        index = cls(dim=arrays['flat_vectors'].shape[1])
+        index.ids = np.asarray(arrays['flat_ids'], dtype=np.int64)
+        index.vectors = np.ascontiguousarray(arrays['flat_vectors'], dtype=np.float32)
+        return index
+
+
+def index_from_arrays(arrays):
+    """Rebuild a FlatIndex or IVFPQIndex from its to_arrays output"""
+    if 'flat_ids' in arrays:
+        return FlatIndex.from_arrays(arrays)
+    return IVFPQIndex.from_arrays(arrays)
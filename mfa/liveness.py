@@ -0,0 +1,123 @@
+"""
+Scoring a burst of face frames sent in one login request.
+
+A single descriptor says little about whether a live person is in front of
+the camera, so face_login also takes a short burst: several frames, each
+with a descriptor, the detector's confidence and the 68 face landmarks.
+Everything that does not need the stored descriptor runs first, as whole
+array operations over the burst:
+
+* shape and NaN checks, and dropping frames the detector was unsure of
+* per-frame descriptor spread and norm, as in ``is_live_face``
+* consistency: every frame must describe the same face
+* temporal variation: a replayed descriptor or a photo held to the camera
+  barely changes between frames, while a live face always jitters a little
+
+Only a burst that passes is matched against the stored descriptor, by
+``match_burst``, which decides at the first frame where the outcome can no
+longer change.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+BURST_MIN_FRAMES = 3
+BURST_MAX_FRAMES = 10
+LANDMARK_POINTS = 68
+# Outer eye corners in the 68-point layout; their distance sets the face's scale
+LEFT_EYE_CORNER, RIGHT_EYE_CORNER = 36, 45
+
+MIN_DETECTION_SCORE = 0.5
+MIN_DESCRIPTOR_VARIATION = 0.1
+MIN_DESCRIPTOR_NORM = 0.1
+# Largest distance of one frame from the burst's median descriptor
+MAX_FRAME_SPREAD = 0.35
+# Median distance between consecutive descriptors below which frames are copies
+MIN_DESCRIPTOR_JITTER = 1e-3
+# Median landmark movement between frames, relative to the eye-corner distance
+MIN_LANDMARK_MOTION = 0.002
+MAX_LANDMARK_MOTION = 0.5
+# Frames that must match the stored descriptor for the burst to pass
+MIN_MATCHING_FRAMES = 3
+
+
+class BurstError(ValueError):
+    """A burst that is malformed rather than merely unconvincing"""
+
+
+Burst = namedtuple('Burst', ['descriptors', 'scores', 'landmarks'])
+Liveness = namedtuple('Liveness', ['live', 'reason', 'frames'])
+BurstMatch = namedtuple('BurstMatch', ['matched', 'frames_used', 'distances'])
+
+
+def parse_burst(frames):
+    """Turn the request's frame list into arrays, or raise BurstError"""
+    if not isinstance(frames, list) or not BURST_MIN_FRAMES <= len(frames) <= BURST_MAX_FRAMES:
+        raise BurstError(f"Send between {BURST_MIN_FRAMES} and {BURST_MAX_FRAMES} frames")
+    try:
+        descriptors = np.asarray([frame['descriptor'] for frame in frames], dtype=np.float32)
+        scores = np.asarray([frame['score'] for frame in frames], dtype=np.float32)
+        landmarks = np.asarray([frame['landmarks'] for frame in frames], dtype=np.float32)
+    except (KeyError, TypeError, ValueError):
+        raise BurstError("Every frame needs a descriptor, a score and landmarks")
+    if descriptors.ndim != 2 or not descriptors.shape[1]:
+        raise BurstError("Descriptors must all have the same length")
+    if landmarks.shape != (len(frames), LANDMARK_POINTS, 2) or scores.shape != (len(frames),):
+        raise BurstError(f"Each frame needs one score and {LANDMARK_POINTS} (x, y) landmarks")
+    if not (np.isfinite(descriptors).all() and np.isfinite(scores).all() and np.isfinite(landmarks).all()):
+        raise BurstError("Frames contain non-finite values")
+    return Burst(descriptors, scores, landmarks)
+
+
+def assess_liveness(burst):
+    """
+    Score a parsed burst without touching the database.
+
+    ``frames`` is a boolean mask of the frames worth matching. ``reason``
+    names the failed check: 'low_quality', 'inconsistent' or 'static'.
+    """
+    descriptors, scores, landmarks = burst
+    usable = (
+        (scores >= MIN_DETECTION_SCORE)
+        & (descriptors.std(axis=1) >= MIN_DESCRIPTOR_VARIATION)
+        & (np.linalg.norm(descriptors, axis=1) >= MIN_DESCRIPTOR_NORM)
+    )
+    if usable.sum() < BURST_MIN_FRAMES:
+        return Liveness(False, 'low_quality', usable)
+    good = descriptors[usable]
+
+    spread = np.linalg.norm(good - np.median(good, axis=0), axis=1)
+    if spread.max() > MAX_FRAME_SPREAD:
+        return Liveness(False, 'inconsistent', usable)
+
+    jitter = np.median(np.linalg.norm(np.diff(good, axis=0), axis=1))
+    points = landmarks[usable]
+    eye_distance = np.linalg.norm(points[:, LEFT_EYE_CORNER] - points[:, RIGHT_EYE_CORNER], axis=1)
+    if (eye_distance <= 0).any():
+        return Liveness(False, 'low_quality', usable)
+    # Mean point movement between consecutive frames, in eye-corner distances
+    motion = np.linalg.norm(np.diff(points, axis=0), axis=2).mean(axis=1) / eye_distance[1:]
+    if jitter < MIN_DESCRIPTOR_JITTER or np.median(motion) < MIN_LANDMARK_MOTION:
+        return Liveness(False, 'static', usable)
+    if np.median(motion) > MAX_LANDMARK_MOTION:
+        return Liveness(False, 'inconsistent', usable)
+    return Liveness(True, None, usable)
+
+
+def match_burst(stored, descriptors, threshold, needed=MIN_MATCHING_FRAMES):
+    """
+    Match frames against the stored descriptor in order, deciding as early as possible.
+
+    Passes once ``needed`` frames are under threshold and fails once too few
+    frames remain to get there. ``frames_used`` is how many frames that took.
+    """
+    distances = np.linalg.norm(descriptors - stored, axis=1)
+    hits = np.cumsum(distances < threshold)
+    misses = np.arange(1, len(distances) + 1) - hits
+    needed = min(needed, len(distances))
+    passed = np.flatnonzero(hits >= needed)
+    failed = np.flatnonzero(misses > len(distances) - needed)
+    if len(passed) and (not len(failed) or passed[0] < failed[0]):
+        return BurstMatch(True, int(passed[0]) + 1, distances[:passed[0] + 1])
+    decided = int(failed[0]) + 1 if len(failed) else len(distances)
+    return BurstMatch(False, decided, distances[:decided])
@@ -0,0 +1,63 @@
+import json
+import os
+import tempfile
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from accounts.benchmarking import seed_users, summarize, synthetic_population, throwaway_databases, time_calls
+from mfa.descriptor_store import get_descriptor_store
+from mfa.duplicates import SCAN_BLOCK_SIZE, scan_blocks, scan_enrollment
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the enrollment duplicate-face scan over a synthetic population: the block scan alone, "
+        "and the whole job reading from the database and from the shared descriptor store. "
+        "Runs against a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10_000, help="Size of the synthetic population")
+        parser.add_argument('--iterations', type=int, default=20, help="Timed scans per case")
+        parser.add_argument('--block-size', type=int, default=SCAN_BLOCK_SIZE)
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        count, block_size = options['users'], options['block_size']
+        population = synthetic_population(count, seed=options['seed'])
+        descriptors = population.descriptors
+        blocks = [
+            (np.arange(start + 1, min(start + block_size, count) + 1), descriptors[start:start + block_size])
+            for start in range(0, count, block_size)
+        ]
+        results = {
+            'scan.blocks': summarize(
+                time_calls(lambda: scan_blocks(descriptors[0], blocks, 0.4, exclude=1), options['iterations'], warmup=1),
+                count,
+            ),
+        }
+
+        with throwaway_databases():
+            users = seed_users(population)
+            user_id = users[0].pk
+            results['job.database'] = summarize(
+                time_calls(lambda: scan_enrollment(user_id, block_size), options['iterations'], warmup=1), count
+            )
+            with tempfile.TemporaryDirectory() as directory, \
+                    override_settings(FACE_DESCRIPTOR_STORE_PATH=os.path.join(directory, 'descriptors.bin')):
+                get_descriptor_store().rebuild([user.pk for user in users], descriptors)
+                results['job.store'] = summarize(
+                    time_calls(lambda: scan_enrollment(user_id, block_size), options['iterations'], warmup=1), count
+                )
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<14} p50={result['p50_us'] / 1000:9.1f}ms p95={result['p95_us'] / 1000:9.1f}ms "
+                f"{result['items_per_sec']:14,.0f} descriptors/s"
+            )
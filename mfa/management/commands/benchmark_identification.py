@@ -0,0 +1,74 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from mfa.index import IVFPQIndex
+
+
+def synthetic_descriptors(count, dim=128, seed=0):
+    """Random descriptors scaled like face-api output (unit-ish norm)"""
+    rng = np.random.default_rng(seed)
+    return (rng.standard_normal((count, dim), dtype=np.float32) / np.sqrt(dim)).astype(np.float32)
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000.0)
+
+
+class Command(BaseCommand):
+    help = "Compare IVF-PQ face identification against brute force on synthetic descriptors"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--k', type=int, default=5)
+        parser.add_argument('--nprobe', type=int, default=16)
+        parser.add_argument('--noise', type=float, default=0.02,
+                            help="Per-dimension noise added to enrolled descriptors to form probes")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        k = options['k']
+        rng = np.random.default_rng(options['seed'])
+
+        for size in options['sizes']:
+            vectors = synthetic_descriptors(size, seed=options['seed'])
+            ids = np.arange(size, dtype=np.int64)
+
+            started = time.perf_counter()
+            index = IVFPQIndex(nprobe=options['nprobe'])
+            index.train(vectors)
+            index.add(ids, vectors)
+            build_seconds = time.perf_counter() - started
+
+            def fetch_vectors(candidate_ids):
+                return candidate_ids, vectors[candidate_ids]
+
+            targets = rng.choice(size, size=options['queries'], replace=False)
+            probes = vectors[targets] + rng.normal(0, options['noise'], (len(targets), vectors.shape[1])).astype(np.float32)
+            squared_norms = np.einsum('ij,ij->i', vectors, vectors)
+
+            brute_times, index_times = [], []
+            recall_hits = top1_hits = 0
+            for target, probe in zip(targets, probes):
+                started = time.perf_counter()
+                distances = squared_norms - 2.0 * (vectors @ probe)
+                exact = np.argpartition(distances, k - 1)[:k]
+                brute_times.append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                found = index.search(probe, k=k, fetch_vectors=fetch_vectors)
+                index_times.append(time.perf_counter() - started)
+
+                found_ids = {user_id for user_id, _ in found}
+                recall_hits += len(found_ids & set(exact.tolist()))
+                top1_hits += bool(found) and found[0][0] == target
+
+            self.stdout.write(
+                f"n={size:>9,} build={build_seconds:7.1f}s "
+                f"recall@{k}={recall_hits / (k * len(targets)):.3f} "
+                f"top1={top1_hits / len(targets):.3f} | "
+                f"brute p50={percentile_ms(brute_times, 50):7.2f}ms p95={percentile_ms(brute_times, 95):7.2f}ms | "
+                f"ivfpq p50={percentile_ms(index_times, 50):7.2f}ms p95={percentile_ms(index_times, 95):7.2f}ms"
+            )
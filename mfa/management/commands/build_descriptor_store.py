@@ -0,0 +1,25 @@
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from mfa.descriptor_store import get_descriptor_store
+from mfa.identification import iter_face_descriptors
+
+
+class Command(BaseCommand):
+    help = "Rebuild the shared memory-mapped face descriptor file from MFAProfile rows"
+
+    def handle(self, *args, **options):
+        store = get_descriptor_store()
+        if store is None:
+            raise CommandError("FACE_DESCRIPTOR_STORE_PATH is not configured")
+
+        batches = list(iter_face_descriptors())
+        if batches:
+            user_ids = np.concatenate([ids for ids, _ in batches])
+            vectors = np.vstack([vectors for _, vectors in batches])
+        else:
+            user_ids = np.empty(0, dtype=np.int64)
+            vectors = np.empty((0, store.dim), dtype=np.float32)
+
+        store.rebuild(user_ids, vectors)
+        self.stdout.write(f"Wrote {len(user_ids)} descriptors to {store.path}")
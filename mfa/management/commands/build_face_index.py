@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from mfa.identification import CHANGE_LOOKBACK, FaceIndex, face_index_path
+from mfa.models import FaceIndexChange
+
+
+class Command(BaseCommand):
+    help = "Train the IVF-PQ face identification index and publish it to FACE_INDEX_PATH"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nlist', type=int, default=None,
+                            help="Coarse clusters; defaults to about 4 * sqrt(enrolled faces)")
+        parser.add_argument('--nprobe', type=int, default=8)
+
+    def handle(self, *args, **options):
+        path = face_index_path()
+        if path is None:
+            raise CommandError("FACE_INDEX_PATH is not configured")
+
+        face_index = FaceIndex.build(nlist=options['nlist'], nprobe=options['nprobe'])
+        face_index.save(path)
+
+        # Workers reload the new file before they next catch up, so older
+        # changes are never read again
+        pruned = 0
+        for alias, change_ids in face_index.applied.items():
+            if change_ids:
+                pruned += FaceIndexChange.objects.using(alias).filter(
+                    id__lte=max(change_ids) - CHANGE_LOOKBACK
+                ).delete()[0]
+
+        self.stdout.write(f"Wrote {len(face_index.index)} faces to {path} and pruned {pruned} applied changes")
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from mfa.face_models import brotli, build_bundle, nets_used_by_templates
+
+
+class Command(BaseCommand):
+    help = (
+        "Bundle the face-api weights the templates load into FACE_MODEL_BUNDLE_DIR, with "
+        "content-hashed names and precompressed gzip (and brotli, if installed) copies"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default=str(settings.BASE_DIR / 'static' / 'models'),
+                            help="Directory holding the face-api manifests and shards")
+        parser.add_argument('--output', default=str(settings.FACE_MODEL_BUNDLE_DIR))
+
+    def handle(self, *args, **options):
+        template_dirs = [directory for engine in settings.TEMPLATES for directory in engine.get('DIRS', [])]
+        try:
+            nets = nets_used_by_templates(template_dirs)
+            index = build_bundle(options['source'], options['output'], nets)
+        except (FileNotFoundError, ValueError) as e:
+            raise CommandError(f"Could not build the face model bundle: {e}")
+
+        totals = {}
+        for sizes in index['files'].values():
+            for encoding, size in sizes.items():
+                totals[encoding] = totals.get(encoding, 0) + size
+        self.stdout.write(f"Bundled {', '.join(nets)} into {options['output']}")
+        for encoding, total in sorted(totals.items(), key=lambda item: -item[1]):
+            self.stdout.write(f"  {encoding:<9} {total / 1024:8.1f} KiB")
+        if brotli is None:
+            self.stdout.write("  (install the brotli package for .br copies)")
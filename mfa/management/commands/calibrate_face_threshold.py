@@ -0,0 +1,104 @@
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.views import FACE_MATCH_THRESHOLD
+from mfa.calibration import block_size_for, error_curves, pair_histograms, spool_descriptors
+from mfa.identification import FACE_DESCRIPTOR_DIM, iter_face_descriptors
+
+
+def labelled_samples(path, batch_size):
+    """
+    (labels, descriptors) batches from an .npz with `descriptors` and `labels` arrays.
+
+    Sample labels become negative integers so they never collide with the
+    user ids labelling stored descriptors.
+    """
+    with np.load(path) as samples:
+        descriptors, labels = samples['descriptors'], samples['labels']
+    if len(descriptors) != len(labels):
+        raise ValueError("descriptors and labels must have the same length")
+    _, inverse = np.unique(labels, return_inverse=True)
+    for start in range(0, len(descriptors), batch_size):
+        yield -1 - inverse[start:start + batch_size], descriptors[start:start + batch_size]
+
+
+class Command(BaseCommand):
+    help = (
+        "Estimate false accept and false reject rates of face matching over all descriptor pairs "
+        "and recommend a threshold"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples',
+                            help="An .npz with `descriptors` and `labels`, several captures per person; "
+                                 "the only source of genuine pairs, since accounts store one face each")
+        parser.add_argument('--skip-stored', action='store_true', help="Use only the labelled samples")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--memory-mb', type=int, default=256,
+                            help="Budget for all workers' distance blocks; the population itself is spooled to disk")
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--bins', type=int, default=2000)
+        parser.add_argument('--max-distance', type=float, default=2.0)
+        parser.add_argument('--target-far', type=float, default=1e-4)
+        parser.add_argument('--spool-dir', help="Where to spool descriptors (default: a temporary directory)")
+        parser.add_argument('--output', help="Write the full report, curves included, as JSON")
+
+    def handle(self, *args, **options):
+        sources = []
+        if not options['skip_stored']:
+            sources.append(iter_face_descriptors(batch_size=options['batch_size']))
+        if options['samples']:
+            sources.append(labelled_samples(options['samples'], options['batch_size']))
+        if not sources:
+            raise CommandError("Nothing to calibrate: pass --samples or drop --skip-stored")
+
+        block = block_size_for(options['memory_mb'], options['workers'])
+        with tempfile.TemporaryDirectory(dir=options['spool_dir']) as directory:
+            started = time.perf_counter()
+            try:
+                spool = spool_descriptors(
+                    directory, (batch for source in sources for batch in source), FACE_DESCRIPTOR_DIM
+                )
+            except (KeyError, ValueError) as e:
+                raise CommandError(f"Could not read descriptors: {e}")
+            if spool.count < 2:
+                raise CommandError("Need at least two descriptors")
+            spooled = time.perf_counter()
+            histograms = pair_histograms(
+                spool, block, bins=options['bins'], max_distance=options['max_distance'], workers=options['workers']
+            )
+            finished = time.perf_counter()
+
+        # mfa.views.verify_face still compares against 0.6
+        report = error_curves(histograms, options['target_far'], check=(FACE_MATCH_THRESHOLD, 0.6))
+        report['meta'] = {
+            'descriptors': spool.count,
+            'block': block,
+            'workers': options['workers'],
+            'spool_seconds': round(spooled - started, 3),
+            'pair_seconds': round(finished - spooled, 3),
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+
+        def rate(value):
+            return 'n/a' if value is None else f'{value:.6f}'
+
+        self.stdout.write(
+            f"{spool.count} descriptors, {report['genuine_pairs']} genuine and {report['impostor_pairs']} impostor "
+            f"pairs in {finished - started:.1f}s (block {block}, {options['workers']} workers)"
+        )
+        for current in report['current']:
+            self.stdout.write(f"threshold {current['threshold']:.3f}: FAR {rate(current['far'])} FRR {rate(current['frr'])}")
+        if report['eer'] is not None:
+            self.stdout.write(f"EER {report['eer']:.6f} at {report['eer_threshold']:.3f}")
+        if report['recommended_threshold'] is None:
+            self.stdout.write(f"No threshold keeps FAR within {options['target_far']}")
+        else:
+            self.stdout.write(f"Recommended threshold for FAR <= {options['target_far']}: {report['recommended_threshold']:.3f}")
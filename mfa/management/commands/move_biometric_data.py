@@ -0,0 +1,84 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from mfa.models import DuplicateFaceMatch, FaceIndexChange, MFAProfile
+from mfa.routers import biometric_databases, shard_for
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy MFAProfile rows, with their users' duplicate-face matches and face index changes, "
+        "from one database to the shard BIOMETRIC_DATABASES assigns them. "
+        "Run it after pointing BIOMETRIC_DATABASES at the new layout; it also reshards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default='default', help="Database alias to read rows from")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--delete', action='store_true', help="Remove moved rows from the source")
+
+    def handle(self, *args, **options):
+        source = options['source']
+        if source not in connections:
+            raise CommandError(f"Unknown database alias {source}")
+        if biometric_databases() == [source]:
+            raise CommandError("BIOMETRIC_DATABASES routes everything to the source already")
+
+        moved = skipped = kept = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                MFAProfile.objects.using(source)
+                .filter(pk__gt=last_pk)
+                .order_by('pk')[:options['batch_size']]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            by_shard = defaultdict(list)
+            for profile in batch:
+                by_shard[shard_for(profile.user_id)].append(profile)
+
+            for alias, profiles in by_shard.items():
+                if alias == source:
+                    kept += len(profiles)
+                    continue
+                # Rows already on the target came from an earlier run or were
+                # written there since the router switched; they win
+                existing = set(
+                    MFAProfile.objects.using(alias)
+                    .filter(user_id__in=[profile.user_id for profile in profiles])
+                    .values_list('user_id', flat=True)
+                )
+                new = [profile for profile in profiles if profile.user_id not in existing]
+                new_user_ids = [profile.user_id for profile in new]
+                matches = list(DuplicateFaceMatch.objects.using(source).filter(user_id__in=new_user_ids))
+                # Replayed on the target, the changes make every worker re-read these faces from there
+                changes = list(FaceIndexChange.objects.using(source).filter(user_id__in=new_user_ids).order_by('pk'))
+                source_pks = [profile.pk for profile in profiles]
+                # The target hands out its own ids; the source's may already be taken there
+                for row in (*new, *matches, *changes):
+                    row.pk = None
+                with transaction.atomic(using=alias):
+                    MFAProfile.objects.using(alias).bulk_create(new)
+                    DuplicateFaceMatch.objects.using(alias).bulk_create(matches, ignore_conflicts=True)
+                    FaceIndexChange.objects.using(alias).bulk_create(changes)
+                moved += len(new)
+                skipped += len(existing)
+
+                if options['delete']:
+                    # _raw_delete skips post_delete, which would drop the users
+                    # from the face index and descriptor store
+                    user_ids = [profile.user_id for profile in profiles]
+                    MFAProfile.objects.using(source).filter(pk__in=source_pks)._raw_delete(source)
+                    DuplicateFaceMatch.objects.using(source).filter(user_id__in=user_ids)._raw_delete(source)
+                    FaceIndexChange.objects.using(source).filter(user_id__in=user_ids)._raw_delete(source)
+
+            self.stdout.write(f"Processed rows up to id {last_pk}: {moved} moved, {skipped} already there")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {moved} profiles, {skipped} already on their shard, {kept} stay on {source}"
+        ))
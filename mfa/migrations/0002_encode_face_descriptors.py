@@ -0,0 +1,50 @@
+from django.db import migrations
+
+from mfa.codec import decode_descriptor, encode_descriptor, is_legacy
+
+BATCH_SIZE = 500
+
+
+def _rewrite_face_data(apps, schema_editor, convert):
+    MFAProfile = apps.get_model('mfa', 'MFAProfile')
+    db_alias = schema_editor.connection.alias
+    last_pk = 0
+    while True:
+        batch = list(
+            MFAProfile.objects.using(db_alias)
+            .filter(pk__gt=last_pk, face_data__isnull=False)
+            .order_by('pk')
+            .only('pk', 'face_data')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        last_pk = batch[-1].pk
+
+        changed = []
+        for profile in batch:
+            blob = bytes(profile.face_data)
+            converted = convert(blob) if blob else None
+            if converted is not None:
+                profile.face_data = converted
+                changed.append(profile)
+        if changed:
+            MFAProfile.objects.using(db_alias).bulk_update(changed, ['face_data'])
+
+
+def encode_legacy_descriptors(apps, schema_editor):
+    _rewrite_face_data(apps, schema_editor, lambda blob: encode_descriptor(decode_descriptor(blob)) if is_legacy(blob) else None)
+
+
+def decode_to_legacy_descriptors(apps, schema_editor):
+    _rewrite_face_data(apps, schema_editor, lambda blob: None if is_legacy(blob) else decode_descriptor(blob).astype('<f4').tobytes())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mfa', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(encode_legacy_descriptors, decode_to_legacy_descriptors),
+    ]
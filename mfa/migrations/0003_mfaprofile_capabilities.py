@@ -0,0 +1,56 @@
+# Generated by Django 5.1.15 on 2026-10-18 07:39
+
+from django.db import migrations, models
+
+from mfa.codec import read_header
+
+BATCH_SIZE = 500
+
+
+def populate_capabilities(apps, schema_editor):
+    MFAProfile = apps.get_model('mfa', 'MFAProfile')
+    db_alias = schema_editor.connection.alias
+    last_pk = 0
+    while True:
+        batch = list(MFAProfile.objects.using(db_alias).filter(pk__gt=last_pk).order_by('pk')[:BATCH_SIZE])
+        if not batch:
+            break
+        last_pk = batch[-1].pk
+        for profile in batch:
+            face_data = bytes(profile.face_data) if profile.face_data else b''
+            header = read_header(face_data) if face_data else None
+            profile.has_face = bool(face_data)
+            profile.face_dim = header.dim if header else len(face_data) // 4
+            profile.has_fingerprint = bool(profile.fingerprint_data)
+        MFAProfile.objects.using(db_alias).bulk_update(batch, ['has_face', 'has_fingerprint', 'face_dim'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mfa', '0002_encode_face_descriptors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mfaprofile',
+            name='face_dim',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='mfaprofile',
+            name='has_face',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='mfaprofile',
+            name='has_fingerprint',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='mfaprofile',
+            name='fingerprint_data',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.RunPython(populate_capabilities, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.15 on 2026-10-18 07:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+from mfa.routers import user_link
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mfa', '0003_mfaprofile_capabilities'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mfaprofile',
+            name='user',
+            # Drops the constraint only where BIOMETRIC_DATABASES separates the tables
+            field=models.OneToOneField(related_name='mfaprofile', to=settings.AUTH_USER_MODEL, **user_link()),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.15 on 2026-10-18 08:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+from mfa.routers import user_link
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mfa', '0004_mfaprofile_user_no_constraint'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mfaprofile',
+            name='face_flagged',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='DuplicateFaceMatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('distance', models.FloatField()),
+                ('reviewed', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('matched_user', models.ForeignKey(related_name='+', to=settings.AUTH_USER_MODEL, **user_link())),
+                ('user', models.ForeignKey(related_name='+', to=settings.AUTH_USER_MODEL, **user_link())),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'matched_user'), name='unique_duplicate_face_pair')],
+            },
+        ),
+    ]
@@ -1,12 +1,91 @@
 from django.db import models
 from django.contrib.auth.models import User
 
-class MFAProfile(models.Model):
-    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="mfaprofile")
+from accounts.tracking import DirtyFieldsMixin
+from mfa.codec import read_header
+from mfa.routers import replica_for, shard_for, user_link
+
+
+class ShardedQuerySet(models.QuerySet):
+    """Rows stored on the biometric shard of the user they belong to"""
+
+    def for_user(self, user):
+        """Rows on the shard that holds user (a User or a user id)"""
+        return self.using(shard_for(getattr(user, 'pk', user)))
+
+    def for_login(self, user):
+        """Like for_user, but reading from a replica when one is configured"""
+        return self.using(replica_for(getattr(user, 'pk', user)))
+
+
+class MFAProfile(DirtyFieldsMixin, models.Model):
+    # Cascades in the database unless BIOMETRIC_DATABASES moves the row away
+    # from auth_user; mfa.signals.delete_mfa_profile_with_user deletes it then
+    user = models.OneToOneField(User, related_name="mfaprofile", **user_link())
     face_data = models.BinaryField(blank=True, null=True, editable=True)
     fingerprint_data = models.BinaryField(null=True, blank=True)
+    # Denormalized from the blobs so login pages never have to load them
+    has_face = models.BooleanField(default=False, editable=False)
+    has_fingerprint = models.BooleanField(default=False, editable=False)
+    face_dim = models.PositiveSmallIntegerField(default=0, editable=False)
+    # Set by the duplicate-face scan when FACE_DUPLICATE_FLAG_ACCOUNTS is on; cleared by a reviewer
+    face_flagged = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    CAPABILITY_FIELDS = ('has_face', 'has_fingerprint', 'face_dim')
+
+    objects = ShardedQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.user.username}'s profile"
+
+    def sync_capabilities(self):
+        """Recompute the capability columns from whichever blobs are loaded"""
+        deferred = self.get_deferred_fields()
+        if 'face_data' not in deferred:
+            self.has_face = bool(self.face_data)
+            self.face_dim = face_dimension(self.face_data) if self.face_data else 0
+        if 'fingerprint_data' not in deferred:
+            self.has_fingerprint = bool(self.fingerprint_data)
+
+    def save(self, *args, **kwargs):
+        self.sync_capabilities()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'face_data', 'fingerprint_data'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | set(self.CAPABILITY_FIELDS)
+        super().save(*args, **kwargs)
+
+
+class DuplicateFaceMatch(models.Model):
+    """An enrolled face that lies within FACE_DUPLICATE_THRESHOLD of another account's"""
+    # Stored on the enrolling user's shard; constrained like MFAProfile.user
+    user = models.ForeignKey(User, related_name='+', **user_link())
+    matched_user = models.ForeignKey(User, related_name='+', **user_link())
+    distance = models.FloatField()
+    reviewed = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'matched_user'], name='unique_duplicate_face_pair')]
+
+    def __str__(self):
+        return f"{self.user_id} looks like {self.matched_user_id} ({self.distance:.3f})"
+
+
+class FaceIndexChange(models.Model):
+    """A committed change to one user's enrolled face, replayed into every worker's identification index"""
+    # Written in the same transaction and on the same shard as the MFAProfile change
+    user_id = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Face change for {self.user_id}"
+
+
+def face_dimension(face_data):
+    header = read_header(face_data)
+    return header.dim if header else len(face_data) // 4
@@ -0,0 +1,119 @@
+"""
+Database routing for biometric tables.
+
+By default every biometric row stays in ``default``. To move them out,
+declare the extra aliases in ``DATABASES`` and list them in settings::
+
+    BIOMETRIC_DATABASES = ['biometric_0', 'biometric_1']
+    BIOMETRIC_READ_REPLICAS = {'biometric_0': ['biometric_0_replica']}
+
+With more than one alias, rows are hash-sharded by user id. Django cannot
+tell which user an unfiltered queryset is about, so code that reads or
+writes one user's row goes through ``MFAProfile.objects.for_user()`` (or
+``for_login()`` for replica reads), and code that scans every row loops
+over ``biometric_databases()``. Queries with no user at all fall back to
+the first shard.
+
+While they share ``auth_user``'s database, biometric rows have a real
+foreign key that cascades. Once they live elsewhere they reference users by
+id only: they cannot be joined to users, and user deletion cleans them up
+through a signal instead of a database cascade (see ``user_link``).
+"""
+import random
+import zlib
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, models
+
+BIOMETRIC_APP_LABELS = {'mfa'}
+
+
+def biometric_databases():
+    """Shard aliases in order; ``['default']`` when nothing is configured"""
+    return list(getattr(settings, 'BIOMETRIC_DATABASES', None) or [DEFAULT_DB_ALIAS])
+
+
+def biometrics_are_separate():
+    return biometric_databases() != [DEFAULT_DB_ALIAS]
+
+
+def user_link():
+    """
+    on_delete and db_constraint for a biometric model's foreign keys to users.
+
+    Read when models and migrations load, so a change to BIOMETRIC_DATABASES
+    applies to the tables migrated after it.
+    """
+    if biometrics_are_separate():
+        return {'on_delete': models.DO_NOTHING, 'db_constraint': False}
+    return {'on_delete': models.CASCADE, 'db_constraint': True}
+
+
+def shard_for(user_id):
+    """Primary alias holding user_id's biometric rows"""
+    aliases = biometric_databases()
+    if len(aliases) == 1:
+        return aliases[0]
+    return aliases[zlib.crc32(str(int(user_id)).encode()) % len(aliases)]
+
+
+def read_alias(alias):
+    """A read replica of the shard alias, or the shard itself if it has none"""
+    replicas = getattr(settings, 'BIOMETRIC_READ_REPLICAS', {}).get(alias)
+    return random.choice(replicas) if replicas else alias
+
+
+def replica_for(user_id):
+    return read_alias(shard_for(user_id))
+
+
+def group_by_shard(user_ids):
+    """Map each shard alias to the user ids it holds"""
+    groups = defaultdict(list)
+    for user_id in user_ids:
+        groups[shard_for(user_id)].append(int(user_id))
+    return dict(groups)
+
+
+def is_biometric(model_or_instance):
+    return model_or_instance._meta.app_label in BIOMETRIC_APP_LABELS
+
+
+class BiometricRouter:
+    """Sends biometric models to their user's shard and keeps everything else on default"""
+
+    def _route(self, model, hints):
+        instance = hints.get('instance')
+        if not is_biometric(model):
+            # Django would otherwise follow a biometric instance onto its shard,
+            # e.g. for profile.user
+            if instance is not None and is_biometric(instance):
+                return DEFAULT_DB_ALIAS
+            return None
+
+        user_id = None
+        if instance is not None:
+            # A biometric row, or the user it belongs to (user.mfaprofile)
+            user_id = getattr(instance, 'user_id', None) if is_biometric(instance) else instance.pk
+        if user_id is None:
+            return biometric_databases()[0]
+        return shard_for(user_id)
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_biometric(obj1) or is_biometric(obj2):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label in BIOMETRIC_APP_LABELS:
+            return db in biometric_databases()
+        if db != DEFAULT_DB_ALIAS and db in biometric_databases():
+            return False
+        return None
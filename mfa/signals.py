@@ -0,0 +1,65 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from mfa.codec import decode_descriptor
+from mfa.descriptor_store import get_descriptor_store
+from mfa.identification import record_face_change
+from mfa.models import DuplicateFaceMatch, MFAProfile
+from mfa.routers import biometric_databases, biometrics_are_separate
+
+
+def face_data_saved(update_fields):
+    # Saves of other columns leave the face where it was, and face_data may not even be loaded
+    return update_fields is None or 'face_data' in update_fields
+
+
+@receiver(post_save, sender=MFAProfile)
+def sync_face_index_on_save(sender, instance, created=False, update_fields=None, **kwargs):
+    # Profiles are created before any face is enrolled
+    if face_data_saved(update_fields) and not (created and not instance.face_data):
+        record_face_change(instance)
+
+
+@receiver(post_delete, sender=MFAProfile)
+def sync_face_index_on_delete(sender, instance, **kwargs):
+    record_face_change(instance)
+
+
+def write_descriptor_on_commit(instance, descriptor):
+    """
+    Put descriptor (or delete, for None) in the shared store once instance's transaction commits.
+
+    Logins trust the store before the database, so a rolled-back enrollment must never reach it.
+    """
+    store = get_descriptor_store()
+    if store is None:
+        return
+    user_id = instance.user_id
+    if descriptor is None:
+        transaction.on_commit(lambda: store.delete(user_id), using=instance._state.db)
+    else:
+        transaction.on_commit(lambda: store.put(user_id, descriptor), using=instance._state.db)
+
+
+@receiver(post_save, sender=MFAProfile)
+def sync_descriptor_store_on_save(sender, instance, update_fields=None, **kwargs):
+    if face_data_saved(update_fields):
+        write_descriptor_on_commit(instance, decode_descriptor(instance.face_data) if instance.face_data else None)
+
+
+@receiver(post_delete, sender=MFAProfile)
+def sync_descriptor_store_on_delete(sender, instance, **kwargs):
+    write_descriptor_on_commit(instance, None)
+
+
+@receiver(post_delete, sender=User)
+def delete_mfa_profile_with_user(sender, instance, **kwargs):
+    # Stands in for ON DELETE CASCADE, which cannot span databases
+    if not biometrics_are_separate():
+        return
+    MFAProfile.objects.for_user(instance).filter(user_id=instance.pk).delete()
+    for alias in biometric_databases():
+        DuplicateFaceMatch.objects.using(alias).filter(Q(user_id=instance.pk) | Q(matched_user_id=instance.pk)).delete()
@@ -0,0 +1,11 @@
+from django import template
+
+from mfa import face_models
+
+register = template.Library()
+
+
+@register.simple_tag
+def face_model_url(net):
+    """``{% face_model_url 'tinyFaceDetector' %}``: the hashed manifest of a net, or static/models"""
+    return face_models.model_url(net)
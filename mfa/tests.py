@@ -1,3 +1,769 @@
-from django.test import TestCase
+import gzip
+import importlib
+import json
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.apps import apps as django_apps
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections, transaction
+from django.template import Context, Template
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.handoff import HANDOFF_COOKIE, make_handoff_token
+from accounts.loadtest import synthetic_burst
+from mfa.calibration import error_curves, pair_histograms, spool_descriptors
+from mfa.codec import decode_descriptor, encode_descriptor, is_legacy, read_header
+from mfa.descriptor_store import DescriptorStore, get_descriptor_store
+from mfa.duplicates import scan_enrollment
+from mfa.face_models import build_bundle, nets_used_by_templates
+from mfa.identification import (
+    CHANGE_RETENTION, build_face_index, fetch_face_descriptors, get_face_index, identify_face, iter_face_descriptors, reset_face_index, warm_face_index,
+)
+from mfa.index import FlatIndex, IVFPQIndex
+from mfa.management.commands.benchmark_identification import synthetic_descriptors
+from mfa.models import DuplicateFaceMatch, FaceIndexChange, MFAProfile
+from mfa.routers import shard_for
+
+SHARD_ALIASES = ('biometric_0', 'biometric_1')
+REPLICA_ALIAS = 'biometric_1_replica'
+
+
+def add_sqlite_database(alias, path):
+    connections.settings[alias] = dict(connections.settings['default'], NAME=path, TEST={})
+    connections.configure_settings(connections.settings)
+
+
+def remove_database(alias):
+    connections[alias].close()
+    del connections[alias]
+    del connections.settings[alias]
+
+
+def user_foreign_keys(alias, table):
+    with connections[alias].cursor() as cursor:
+        constraints = connections[alias].introspection.get_constraints(cursor, table)
+    return [constraint['foreign_key'] for constraint in constraints.values() if constraint['foreign_key']]
+
+
+def forget_migrations():
+    # They read BIOMETRIC_DATABASES on import (see mfa.routers.user_link)
+    for name in [name for name in sys.modules if name.startswith('mfa.migrations.')]:
+        del sys.modules[name]
+
+
+class DescriptorCodecTests(TestCase):
+    def setUp(self):
+        self.descriptors = synthetic_descriptors(400, seed=3)
+
+    def test_each_dtype_round_trips_within_its_error_bound(self):
+        first, second = self.descriptors[:200], self.descriptors[200:]
+        exact = np.linalg.norm(first - second, axis=1)
+        for dtype, size, distance_error in [('float32', 528, 0), ('float16', 272, 2e-4), ('int8', 144, 5e-3)]:
+            with self.subTest(dtype=dtype):
+                blobs = [encode_descriptor(vector, dtype=dtype) for vector in self.descriptors]
+                self.assertEqual({len(blob) for blob in blobs}, {size})
+                self.assertEqual(read_header(blobs[0]).dtype, dtype)
+                decoded = np.array([decode_descriptor(blob) for blob in blobs])
+                self.assertEqual(decoded.dtype, np.float32)
+                errors = np.abs(decoded - self.descriptors)
+                if dtype == 'float16':
+                    # Half a unit in the last place of an 11-bit significand
+                    self.assertTrue(np.all(errors <= np.abs(self.descriptors) * 2.0 ** -11 + 1e-7))
+                if dtype == 'int8':
+                    # Half a quantization step of the per-descriptor scale
+                    half_steps = np.abs(self.descriptors).max(axis=1, keepdims=True) / 127 / 2
+                    self.assertTrue(np.all(errors <= half_steps * 1.0001))
+                distances = np.linalg.norm(decoded[:200] - decoded[200:], axis=1)
+                self.assertLessEqual(np.abs(distances - exact).max(), distance_error)
+
+        # float32 decodes to a view over the blob itself
+        blob = encode_descriptor(self.descriptors[0])
+        self.assertFalse(decode_descriptor(blob).flags.writeable)
+        np.testing.assert_array_equal(decode_descriptor(blob), self.descriptors[0])
+
+    def test_bad_descriptors_are_refused(self):
+        for values in ([], [[0.1, 0.2]], [0.1, float('nan')]):
+            with self.subTest(values=values), self.assertRaises(ValueError):
+                encode_descriptor(values)
+        with self.assertRaises(ValueError):
+            encode_descriptor([0.1], dtype='float64')
+        with self.assertRaises(ValueError):
+            decode_descriptor(b'\x00' * 7)
+
+    def test_legacy_raw_blobs_still_decode(self):
+        legacy = self.descriptors[0].astype('<f4').tobytes()
+        self.assertTrue(is_legacy(legacy))
+        np.testing.assert_array_equal(decode_descriptor(legacy), self.descriptors[0])
+        # A header whose length does not add up is raw floats that happen to start with b'FD'
+        self.assertTrue(is_legacy(encode_descriptor(self.descriptors[0])[:-4]))
+
+    def test_migration_encodes_legacy_rows_and_reverses(self):
+        migration = importlib.import_module('mfa.migrations.0002_encode_face_descriptors')
+        schema_editor = SimpleNamespace(connection=connection)
+        legacy, float16 = User.objects.create_user(username='legacy'), User.objects.create_user(username='float16')
+        User.objects.create_user(username='no-face')
+        MFAProfile.objects.filter(user=legacy).update(face_data=self.descriptors[0].astype('<f4').tobytes())
+        MFAProfile.objects.filter(user=float16).update(face_data=encode_descriptor(self.descriptors[1], dtype='float16'))
+
+        def blobs():
+            return {
+                username: bytes(face_data) if face_data is not None else None
+                for username, face_data in MFAProfile.objects.values_list('user__username', 'face_data')
+            }
+
+        before = blobs()
+        migration.encode_legacy_descriptors(django_apps, schema_editor)
+        after = blobs()
+        self.assertEqual(read_header(after['legacy']).dtype, 'float32')
+        np.testing.assert_array_equal(decode_descriptor(after['legacy']), self.descriptors[0])
+        self.assertEqual(after['float16'], before['float16'])
+        self.assertIsNone(after['no-face'])
+
+        migration.decode_to_legacy_descriptors(django_apps, schema_editor)
+        reverted = blobs()
+        self.assertEqual(reverted['legacy'], before['legacy'])
+        self.assertTrue(is_legacy(reverted['float16']))
+        np.testing.assert_array_equal(decode_descriptor(reverted['float16']), decode_descriptor(before['float16']))
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class MFAProfileCapabilityTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='ada@example.com', email='ada@example.com', password='pw')
+
+    def test_profile_cascades_with_its_user_in_one_database(self):
+        self.assertEqual(user_foreign_keys('default', 'mfa_mfaprofile'), [('auth_user', 'id')])
+        self.assertEqual(len(user_foreign_keys('default', 'mfa_duplicatefacematch')), 2)
+        user_id = self.user.pk
+        with mock.patch('mfa.signals.MFAProfile.objects.for_user') as for_user:
+            self.user.delete()
+        for_user.assert_not_called()
+        self.assertFalse(MFAProfile.objects.filter(user_id=user_id).exists())
+
+    def test_new_profile_has_no_capabilities(self):
+        profile = MFAProfile.objects.get(user=self.user)
+        self.assertEqual((profile.has_face, profile.has_fingerprint, profile.face_dim), (False, False, 0))
+
+    def test_save_syncs_capabilities(self):
+        profile = self.user.mfaprofile
+        profile.face_data = encode_descriptor(np.zeros(128, dtype=np.float32), dtype='float16')
+        profile.fingerprint_data = b'credential'
+        profile.save()
+        profile.refresh_from_db()
+        self.assertEqual((profile.has_face, profile.has_fingerprint, profile.face_dim), (True, True, 128))
+
+        profile.face_data = None
+        profile.save(update_fields=['face_data'])
+        profile.refresh_from_db()
+        self.assertEqual((profile.has_face, profile.has_fingerprint, profile.face_dim), (False, True, 0))
+
+    def test_save_with_deferred_blobs_keeps_capabilities(self):
+        profile = self.user.mfaprofile
+        profile.face_data = encode_descriptor(np.zeros(128, dtype=np.float32))
+        profile.save()
+
+        deferred = MFAProfile.objects.defer('face_data', 'fingerprint_data').get(pk=profile.pk)
+        deferred.save()
+        deferred.refresh_from_db()
+        self.assertTrue(deferred.has_face)
+        self.assertEqual(deferred.face_dim, 128)
+
+    def test_face_enrollment_writes_only_face_columns(self):
+        profile = self.user.mfaprofile
+        profile.fingerprint_data = b'credential'
+        profile.save()
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connections['default']) as queries:
+            response = self.client.post(
+                reverse('setup-face'), json.dumps({'facialId': [0.5] * 128}), content_type='application/json'
+            )
+        self.assertEqual(response.json()['status'], 'success')
+        profile_queries = [q['sql'] for q in queries if 'mfa_mfaprofile' in q['sql']]
+        self.assertEqual(len(profile_queries), 2)
+        self.assertFalse(any('"fingerprint_data"' in sql for sql in profile_queries))
+        update = profile_queries[1]
+        self.assertTrue(update.startswith('UPDATE'))
+        self.assertNotIn('face_flagged', update)
+        profile.refresh_from_db()
+        self.assertEqual((profile.has_face, profile.face_dim, profile.fingerprint_data), (True, 128, b'credential'))
+
+
+class DescriptorStoreTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'descriptors.bin')
+        self.vectors = np.random.default_rng(0).standard_normal((8, 128)).astype(np.float32)
+
+    def test_replacing_and_deleting_leave_tombstones(self):
+        store = DescriptorStore(self.path)
+        store.put(1, self.vectors[0])
+        store.put(2, self.vectors[1])
+        store.put(1, self.vectors[2])
+        self.assertEqual(len(store), 2)
+        np.testing.assert_array_equal(store.get(1), self.vectors[2])
+        user_ids, _, alive = store.live()
+        self.assertEqual(user_ids.tolist(), [1, 2, 1])
+        self.assertEqual(alive.tolist(), [False, True, True])
+
+        store.delete(2)
+        self.assertIsNone(store.get(2))
+        self.assertEqual(store.fetch([1, 2])[0], [1])
+        store.put(2, self.vectors[3])
+        np.testing.assert_array_equal(store.get(2), self.vectors[3])
+        self.assertIsNone(store.get(99))
+
+    @mock.patch('mfa.descriptor_store.DEFAULT_CAPACITY', 4)
+    def test_full_file_grows_and_readers_remap(self):
+        writer, reader = DescriptorStore(self.path), DescriptorStore(self.path)
+        for user_id in range(1, 5):
+            writer.put(user_id, self.vectors[user_id])
+        old_view = reader.get(1)
+        inode = os.stat(self.path).st_ino
+
+        # Full: the live rows are compacted into a file twice the size
+        writer.put(1, self.vectors[6])
+        writer.put(5, self.vectors[5])
+        self.assertNotEqual(os.stat(self.path).st_ino, inode)
+        self.assertEqual(len(reader), 5)
+        np.testing.assert_array_equal(reader.get(1), self.vectors[6])
+        np.testing.assert_array_equal(reader.get(5), self.vectors[5])
+        self.assertEqual(reader.live()[0].tolist(), [2, 3, 4, 1, 5])
+        # Views into the replaced file stay readable
+        np.testing.assert_array_equal(old_view, self.vectors[1])
+
+    @mock.patch('mfa.descriptor_store.DEFAULT_CAPACITY', 16)
+    def test_rows_are_found_through_the_shared_hash_table(self):
+        writer, reader = DescriptorStore(self.path), DescriptorStore(self.path)
+        rng = np.random.default_rng(1)
+        vectors = rng.standard_normal((300, 128)).astype(np.float32)
+        # Enough ids that some share a home slot and probing steps past taken ones
+        user_ids = [1 + 64 * number for number in range(200)]
+        for user_id, vector in zip(user_ids, vectors):
+            writer.put(user_id, vector)
+        reader.get(user_ids[0])
+        writer.rebuild(user_ids[:150], vectors[:150])
+        for user_id, vector in zip(user_ids[:100], vectors[200:]):
+            writer.put(user_id, vector)
+        for user_id in user_ids[50:60]:
+            writer.delete(user_id)
+
+        for number, user_id in enumerate(user_ids[:150]):
+            expected = None if 50 <= number < 60 else vectors[200 + number] if number < 100 else vectors[number]
+            if expected is None:
+                self.assertIsNone(reader.get(user_id))
+            else:
+                np.testing.assert_array_equal(reader.get(user_id), expected)
+        self.assertIsNone(reader.get(user_ids[160]))
+        found, fetched = reader.fetch([user_ids[99], user_ids[55], user_ids[120], 2])
+        self.assertEqual(sorted(found), [user_ids[99], user_ids[120]])
+        self.assertEqual(len(fetched), 2)
+
+    def test_files_from_an_older_layout_are_refused(self):
+        store = DescriptorStore(self.path)
+        store.put(1, self.vectors[0])
+        with open(self.path, 'r+b') as f:
+            f.seek(8)
+            f.write(struct.pack('<I', 1))
+        with self.assertRaisesRegex(ValueError, 'layout version 1'):
+            DescriptorStore(self.path).get(1)
+
+    def test_files_are_built_aside_and_renamed_into_place(self):
+        store = DescriptorStore(self.path)
+        with mock.patch.object(DescriptorStore, '_create', autospec=True, side_effect=DescriptorStore._create) as create:
+            store.put(1, self.vectors[0])
+            store.rebuild([2, 3], self.vectors[1:3])
+        self.assertNotIn(self.path, [call.args[1] for call in create.call_args_list])
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self.path))), ['descriptors.bin', 'descriptors.bin.lock'])
+        self.assertEqual(store.fetch([1, 2, 3])[0], [2, 3])
+
+    def test_store_follows_committed_saves_only(self):
+        user = User.objects.create_user(username='ada@example.com', password='pw')
+        with override_settings(FACE_DESCRIPTOR_STORE_PATH=self.path):
+            store = get_descriptor_store()
+            profile = MFAProfile.objects.get(user=user)
+            profile.face_data = encode_descriptor(self.vectors[0])
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                profile.save()
+                raise RuntimeError("enrollment failed")
+            self.assertIsNone(store.get(user.pk))
+
+            profile = MFAProfile.objects.get(user=user)
+            profile.face_data = encode_descriptor(self.vectors[0])
+            with self.captureOnCommitCallbacks() as callbacks:
+                profile.save()
+            self.assertIsNone(store.get(user.pk))
+            for callback in callbacks:
+                callback()
+            np.testing.assert_array_equal(store.get(user.pk), self.vectors[0])
+
+            with self.captureOnCommitCallbacks(execute=True):
+                profile.delete()
+            self.assertIsNone(store.get(user.pk))
+
+
+class FaceIndexTests(TestCase):
+    def setUp(self):
+        reset_face_index()
+        self.addCleanup(reset_face_index)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'face_index.npz')
+        self.vectors = synthetic_descriptors(40, seed=1)
+        self.users = [User.objects.create_user(username=f'user{i}@example.com') for i in range(30)]
+        for user, vector in zip(self.users, self.vectors):
+            MFAProfile.objects.filter(user=user).update(face_data=encode_descriptor(vector))
+
+    def enroll(self, user, vector):
+        profile = MFAProfile.objects.get(user=user)
+        profile.face_data = encode_descriptor(vector) if vector is not None else None
+        profile.save()
+
+    def test_search_finds_the_exact_nearest_neighbours(self):
+        vectors = synthetic_descriptors(5000)
+        index = IVFPQIndex(nprobe=16)
+        index.train(vectors)
+        index.add(np.arange(len(vectors)), vectors)
+
+        rng = np.random.default_rng(1)
+        targets = rng.choice(len(vectors), size=50, replace=False)
+        probes = vectors[targets] + rng.normal(0, 0.02, (len(targets), 128)).astype(np.float32)
+        def fetch_vectors(ids):
+            return ids, vectors[ids]
+
+        for target, probe in zip(targets, probes):
+            exact = np.argsort(np.sum((vectors - probe) ** 2, axis=1))[:5]
+            found = index.search(probe, k=5, fetch_vectors=fetch_vectors)
+            self.assertEqual(found[0][0], target)
+            self.assertAlmostEqual(found[0][1], float(np.linalg.norm(vectors[target] - probe)), places=5)
+            # Probing every list and re-ranking them all is exact
+            found = index.search(probe, k=5, nprobe=index.nlist, rerank=len(vectors), fetch_vectors=fetch_vectors)
+            self.assertEqual([user_id for user_id, _ in found], exact.tolist())
+
+    def test_index_survives_a_round_trip_and_copies_are_independent(self):
+        vectors = synthetic_descriptors(500)
+        index = IVFPQIndex()
+        index.train(vectors)
+        index.add(np.arange(500), vectors)
+        loaded = IVFPQIndex.from_arrays(index.to_arrays())
+        self.assertEqual(loaded.search(vectors[7], k=3), index.search(vectors[7], k=3))
+
+        copy = loaded.copy()
+        copy.remove([7])
+        self.assertEqual(len(copy), 499)
+        self.assertEqual(len(loaded), 500)
+        self.assertNotIn(7, [user_id for user_id, _ in copy.search(vectors[7], k=3)])
+        self.assertEqual(IVFPQIndex.from_arrays(IVFPQIndex().to_arrays()).search(vectors[0]), [])
+
+    def test_committed_enrollments_reach_a_built_index(self):
+        user = self.users[0]
+        self.assertEqual(identify_face(self.vectors[0], k=1)[0][0], user.pk)
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.enroll(user, self.vectors[35])
+            raise RuntimeError("enrollment failed")
+        self.assertEqual(identify_face(self.vectors[0], k=1)[0][0], user.pk)
+
+        self.enroll(user, self.vectors[35])
+        self.assertEqual(identify_face(self.vectors[35], k=1), [(user.pk, 0.0)])
+        self.assertNotEqual(identify_face(self.vectors[0], k=1)[0][0], user.pk)
+
+        self.enroll(self.users[1], None)
+        self.assertNotIn(self.users[1].pk, [user_id for user_id, _ in identify_face(self.vectors[1])])
+
+    def test_small_populations_are_scanned_exactly_until_there_are_enough_to_train_on(self):
+        vectors = synthetic_descriptors(40, seed=2)
+        users = [User.objects.create_user(username=f'extra{i}@example.com') for i in range(len(vectors))]
+        with mock.patch('mfa.identification.MIN_INDEX_FACES', 32):
+            self.assertIsInstance(get_face_index(), FlatIndex)
+            for user, vector in zip(users[:2], vectors[:2]):
+                self.enroll(user, vector)
+            index = get_face_index()
+            self.assertIsInstance(index, IVFPQIndex)
+            self.assertEqual(index.training_size, 32)
+
+            # Past twice the faces it was trained on, it is trained again
+            for user, vector in zip(users[2:], vectors[2:]):
+                self.enroll(user, vector)
+            self.assertEqual(get_face_index().training_size, 70)
+            self.assertEqual(identify_face(vectors[39], k=1), [(users[39].pk, 0.0)])
+
+    def test_workers_load_the_published_index_and_reload_replacements(self):
+        with override_settings(FACE_INDEX_PATH=self.path):
+            with self.assertLogs('mfa.identification', 'WARNING'):
+                self.assertEqual(identify_face(self.vectors[0], k=1)[0][0], self.users[0].pk)
+
+            call_command('build_face_index', stdout=StringIO())
+            with mock.patch('mfa.identification.build_face_index') as build:
+                self.assertEqual(identify_face(self.vectors[2], k=1)[0][0], self.users[2].pk)
+                build.assert_not_called()
+            published = get_face_index()
+
+            # Enrolled after the build: in the change log until the next one
+            self.enroll(self.users[3], self.vectors[36])
+            self.assertEqual(identify_face(self.vectors[36], k=1)[0][0], self.users[3].pk)
+            self.assertIsNot(get_face_index(), published)
+            self.assertEqual(FaceIndexChange.objects.count(), 1)
+
+            with mock.patch('mfa.management.commands.build_face_index.CHANGE_LOOKBACK', 0):
+                call_command('build_face_index', stdout=StringIO())
+            self.assertEqual(FaceIndexChange.objects.count(), 0)
+            with mock.patch('mfa.identification.build_face_index') as build:
+                self.assertEqual(identify_face(self.vectors[36], k=1)[0][0], self.users[3].pk)
+                build.assert_not_called()
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self.path))), ['face_index.npz'])
+
+    def test_old_changes_are_pruned_and_long_idle_indexes_rebuilt(self):
+        self.enroll(self.users[0], self.vectors[35])
+        self.enroll(self.users[1], self.vectors[36])
+        old = FaceIndexChange.objects.earliest('id')
+        FaceIndexChange.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(identify_face(self.vectors[36], k=1)[0][0], self.users[1].pk)
+        self.assertEqual(FaceIndexChange.objects.count(), 1)
+
+        # Changes it never saw may have been pruned since
+        with mock.patch('mfa.identification.time') as clock, \
+                mock.patch('mfa.identification.build_face_index', wraps=build_face_index) as build:
+            clock.time.return_value = time.time() + CHANGE_RETENTION.total_seconds()
+            self.assertEqual(identify_face(self.vectors[35], k=1)[0][0], self.users[0].pk)
+        build.assert_called_once()
+
+    def test_startup_only_warms_a_published_index(self):
+        with mock.patch('mfa.identification.build_face_index') as build:
+            warm_face_index()
+        build.assert_not_called()
+
+        with override_settings(FACE_INDEX_PATH=self.path):
+            call_command('build_face_index', stdout=StringIO())
+            reset_face_index()
+            warm_face_index()
+            with mock.patch('mfa.identification.open_face_index') as open_index:
+                self.assertEqual(identify_face(self.vectors[4], k=1)[0][0], self.users[4].pk)
+            open_index.assert_not_called()
+
+    def test_build_command_needs_a_path(self):
+        with self.assertRaises(CommandError):
+            call_command('build_face_index')
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    BIOMETRIC_DATABASES=list(SHARD_ALIASES),
+    BIOMETRIC_READ_REPLICAS={'biometric_1': [REPLICA_ALIAS]},
+)
+class BiometricShardingTests(TransactionTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Real SQLite files, added after the runner has set up its own databases.
+        # The replica alias is a second connection to shard 1's file.
+        cls.databases = {*cls.databases, *SHARD_ALIASES, REPLICA_ALIAS}
+        cls.directory = tempfile.mkdtemp()
+        forget_migrations()
+        for alias in SHARD_ALIASES:
+            add_sqlite_database(alias, os.path.join(cls.directory, f'{alias}.sqlite3'))
+            call_command('migrate', database=alias, verbosity=0)
+        add_sqlite_database(REPLICA_ALIAS, os.path.join(cls.directory, 'biometric_1.sqlite3'))
+
+    @classmethod
+    def tearDownClass(cls):
+        for alias in (*SHARD_ALIASES, REPLICA_ALIAS):
+            remove_database(alias)
+        shutil.rmtree(cls.directory)
+        super().tearDownClass()
+        forget_migrations()
+
+    def create_user(self, number):
+        email = f'user{number}@example.com'
+        return User.objects.create_user(username=email, email=email, password='pw')
+
+    def create_user_on(self, alias):
+        number = User.objects.count()
+        while True:
+            user = self.create_user(number)
+            if shard_for(user.pk) == alias:
+                return user
+            number += 1
+
+    def test_profiles_live_on_their_users_shard(self):
+        users = [self.create_user(number) for number in range(12)]
+        for user in users:
+            self.assertTrue(MFAProfile.objects.using(shard_for(user.pk)).filter(user_id=user.pk).exists())
+        counts = [MFAProfile.objects.using(alias).count() for alias in SHARD_ALIASES]
+        self.assertEqual(sum(counts), len(users))
+        self.assertNotIn(0, counts)
+        self.assertFalse(MFAProfile.objects.using('default').exists())
+
+        # Related access from either side follows the router
+        user = users[0]
+        self.assertEqual(User.objects.get(pk=user.pk).mfaprofile.user_id, user.pk)
+        self.assertEqual(MFAProfile.objects.for_user(user).get(user=user).user.email, user.email)
+
+        user_id = user.pk
+        user.delete()
+        self.assertFalse(MFAProfile.objects.using(shard_for(user_id)).filter(user_id=user_id).exists())
+        # auth_user is elsewhere, so the shards cannot reference it
+        for alias in SHARD_ALIASES:
+            self.assertEqual(user_foreign_keys(alias, 'mfa_mfaprofile'), [])
+            self.assertEqual(user_foreign_keys(alias, 'mfa_duplicatefacematch'), [])
+
+    def test_face_login_reads_profile_from_replica(self):
+        user = self.create_user_on('biometric_1')
+        descriptor = (np.random.default_rng(0).standard_normal(128) * 0.15).astype(np.float32)
+        profile = user.mfaprofile
+        profile.face_data = encode_descriptor(descriptor)
+        profile.save()
+
+        self.client.cookies[HANDOFF_COOKIE] = make_handoff_token(user)
+
+        with CaptureQueriesContext(connections['biometric_1']) as primary, \
+                CaptureQueriesContext(connections[REPLICA_ALIAS]) as replica:
+            self.assertEqual(self.client.get(reverse('mfa-selection')).status_code, 200)
+            response = self.client.post(
+                reverse('face-login'),
+                json.dumps({'frames': synthetic_burst(descriptor)}),
+                content_type='application/json',
+            )
+        self.assertEqual(response.json()['status'], 'success')
+        self.assertEqual(len(primary), 0)
+        self.assertEqual(len(replica), 3)
+
+    def test_identification_reads_every_shard(self):
+        rng = np.random.default_rng(1)
+        users = [self.create_user(number) for number in range(6)]
+        for user in users:
+            profile = user.mfaprofile
+            profile.face_data = encode_descriptor(rng.standard_normal(128).astype(np.float32))
+            profile.save()
+
+        ids = np.concatenate([batch_ids for batch_ids, _ in iter_face_descriptors(batch_size=4)])
+        self.assertEqual(sorted(ids.tolist()), [user.pk for user in users])
+        fetched_ids, vectors = fetch_face_descriptors([user.pk for user in users])
+        self.assertEqual(sorted(fetched_ids), [user.pk for user in users])
+        self.assertEqual(vectors.shape, (6, 128))
+
+    def test_move_command_copies_rows_to_their_shards(self):
+        users = [self.create_user(number) for number in range(8)]
+        # Rows as they were before the router: every profile in default
+        for alias in SHARD_ALIASES:
+            MFAProfile.objects.using(alias).all()._raw_delete(alias)
+        MFAProfile.objects.using('default').bulk_create([
+            MFAProfile(user_id=user.pk, face_data=encode_descriptor(np.full(128, user.pk, dtype=np.float32)), has_face=True)
+            for user in users
+        ])
+
+        DuplicateFaceMatch.objects.using('default').create(user=users[0], matched_user=users[1], distance=0.1)
+        FaceIndexChange.objects.using('default').create(user_id=users[0].pk)
+        # Each shard already holds a profile under an id one of the moved rows has in default
+        source_ids = dict(MFAProfile.objects.using('default').values_list('user_id', 'id'))
+        residents = {}
+        for alias in SHARD_ALIASES:
+            taken = next(pk for user_id, pk in source_ids.items() if shard_for(user_id) == alias)
+            residents[alias] = self.create_user_on(alias)
+            MFAProfile.objects.using(alias).filter(user=residents[alias]).update(id=taken)
+
+        call_command('move_biometric_data', batch_size=3, delete=True, stdout=open(os.devnull, 'w'))
+        self.assertFalse(MFAProfile.objects.using('default').exists())
+        for user in users:
+            profile = MFAProfile.objects.for_user(user).get(user_id=user.pk)
+            self.assertTrue(profile.has_face)
+            self.assertEqual(bytes(profile.face_data), encode_descriptor(np.full(128, user.pk, dtype=np.float32)))
+        for alias, resident in residents.items():
+            self.assertTrue(MFAProfile.objects.using(alias).filter(user=resident).exists())
+
+        self.assertFalse(DuplicateFaceMatch.objects.using('default').exists())
+        self.assertFalse(FaceIndexChange.objects.using('default').exists())
+        shard = shard_for(users[0].pk)
+        self.assertEqual(
+            list(DuplicateFaceMatch.objects.using(shard).values_list('user_id', 'matched_user_id')),
+            [(users[0].pk, users[1].pk)],
+        )
+        self.assertTrue(FaceIndexChange.objects.using(shard).filter(user_id=users[0].pk).exists())
+
+
+class FaceModelBundleTests(TestCase):
+    def setUp(self):
+        self.source = tempfile.mkdtemp()
+        self.output = os.path.join(tempfile.mkdtemp(), 'bundle')
+        self.addCleanup(shutil.rmtree, self.source)
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.output))
+        for model in ('tiny_face_detector_model', 'mtcnn_model'):
+            shard = f'{model}-shard1'
+            with open(os.path.join(self.source, shard), 'wb') as shard_file:
+                shard_file.write(bytes(4096))
+            with open(os.path.join(self.source, f'{model}-weights_manifest.json'), 'w') as manifest:
+                json.dump([{'weights': [{'name': 'w', 'shape': [4096], 'dtype': 'float32'}], 'paths': [shard]}], manifest)
+
+    def test_templates_load_only_three_nets(self):
+        template_dirs = [os.path.join(os.path.dirname(os.path.dirname(__file__)), 'templates')]
+        self.assertEqual(
+            nets_used_by_templates(template_dirs), ['faceLandmark68Net', 'faceRecognitionNet', 'tinyFaceDetector']
+        )
+
+    def test_bundle_holds_hashed_compressed_copies_of_requested_nets(self):
+        index = build_bundle(self.source, self.output, ['tinyFaceDetector'])
+        manifest_name = index['nets']['tinyFaceDetector']
+        self.assertRegex(manifest_name, r'^tiny_face_detector_model-weights_manifest\.[0-9a-f]{16}\.json$')
+        with open(os.path.join(self.output, manifest_name)) as manifest_file:
+            shard_name = json.load(manifest_file)[0]['paths'][0]
+        self.assertRegex(shard_name, r'^tiny_face_detector_model-shard1\.[0-9a-f]{16}$')
+        with gzip.open(os.path.join(self.output, shard_name + '.gz')) as compressed:
+            self.assertEqual(compressed.read(), bytes(4096))
+        self.assertFalse(any(name.startswith('mtcnn') for name in os.listdir(self.output)))
+
+    def test_missing_shard_fails_the_build(self):
+        os.remove(os.path.join(self.source, 'tiny_face_detector_model-shard1'))
+        with self.assertRaises(FileNotFoundError):
+            build_bundle(self.source, self.output, ['tinyFaceDetector'])
+
+    def test_serving_negotiates_encoding_and_caches_forever(self):
+        template = Template("{% load face_models %}{% face_model_url 'tinyFaceDetector' %}")
+        with override_settings(FACE_MODEL_BUNDLE_DIR=self.output):
+            self.assertEqual(template.render(Context()), '/static/models')
+            index = build_bundle(self.source, self.output, ['tinyFaceDetector'])
+            url = template.render(Context())
+            self.assertEqual(url, reverse('face-model', args=[index['nets']['tinyFaceDetector']]))
+
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate, br;q=0')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(response['Content-Type'], 'application/json')
+            self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+            self.assertEqual(json.loads(gzip.decompress(b''.join(response.streaming_content)))[0]['weights'][0]['name'], 'w')
+
+            plain = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip;q=0')
+            self.assertFalse(plain.has_header('Content-Encoding'))
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=plain['ETag'], HTTP_ACCEPT_ENCODING='').status_code, 304)
+            self.assertEqual(self.client.get(reverse('face-model', args=['bundle.json'])).status_code, 404)
+
+
+class ThresholdCalibrationTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        rng = np.random.default_rng(0)
+        people = rng.standard_normal((12, 128)).astype(np.float32) / np.sqrt(128)
+        self.labels = np.repeat(np.arange(12), 4)
+        self.descriptors = people[self.labels] + rng.normal(0, 0.02, (48, 128)).astype(np.float32)
+
+    def test_blocked_histograms_match_brute_force(self):
+        spool = spool_descriptors(self.directory, [(self.labels[:20], self.descriptors[:20]),
+                                                   (self.labels[20:], self.descriptors[20:])], 128)
+        for workers in (1, 2):
+            with self.subTest(workers=workers):
+                genuine, impostor, _ = pair_histograms(spool, block=7, bins=50, max_distance=2.0, workers=workers)
+                first, second = np.triu_indices(48, k=1)
+                distances = np.linalg.norm(self.descriptors[first] - self.descriptors[second], axis=1)
+                bins = np.minimum((distances * 25).astype(int), 49)
+                same = self.labels[first] == self.labels[second]
+                np.testing.assert_array_equal(genuine, np.bincount(bins[same], minlength=50))
+                np.testing.assert_array_equal(impostor, np.bincount(bins[~same], minlength=50))
+
+    def test_curves_separate_genuine_from_impostor_pairs(self):
+        spool = spool_descriptors(self.directory, [(self.labels, self.descriptors)], 128)
+        report = error_curves(pair_histograms(spool, block=16), target_far=0.0)
+        self.assertEqual((report['genuine_pairs'], report['impostor_pairs']), (12 * 6, 48 * 47 // 2 - 12 * 6))
+        self.assertEqual(report['eer'], 0.0)
+        self.assertGreaterEqual(report['recommended_threshold'], report['eer_threshold'])
+        self.assertEqual([current['frr'] for current in report['current']], [0.0, 0.0])
+
+    def test_command_combines_stored_faces_with_samples(self):
+        for number, descriptor in enumerate(self.descriptors[::4]):
+            user = User.objects.create_user(username=f'user{number}@example.com', password='pw')
+            user.mfaprofile.face_data = encode_descriptor(descriptor)
+            user.mfaprofile.save()
+        samples = os.path.join(self.directory, 'samples.npz')
+        np.savez(samples, descriptors=self.descriptors, labels=self.labels)
+        output = os.path.join(self.directory, 'report.json')
+        call_command('calibrate_face_threshold', samples=samples, output=output, workers=1, stdout=StringIO())
+        with open(output) as report_file:
+            report = json.load(report_file)
+        self.assertEqual(report['meta']['descriptors'], 60)
+        # Stored faces are only ever impostors, even against samples of the same person
+        self.assertEqual(report['genuine_pairs'], 12 * 6)
+        self.assertEqual(len(report['curve']['far']), 2000)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class DuplicateFaceScanTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.face = (rng.standard_normal(128) * 0.15).astype(np.float32)
+        self.users = []
+        for number, descriptor in enumerate([self.face, self.face + 0.01, rng.standard_normal(128) * 0.15]):
+            user = User.objects.create_user(username=f'user{number}@example.com', password='pw')
+            user.mfaprofile.face_data = encode_descriptor(descriptor)
+            user.mfaprofile.save()
+            self.users.append(user)
+        self.newcomer = User.objects.create_user(username='new@example.com', password='pw')
+
+    def test_enrollment_schedules_scan_after_commit(self):
+        self.client.force_login(self.newcomer)
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(
+                reverse('setup-face'), json.dumps({'facialId': self.face.tolist()}), content_type='application/json'
+            )
+        self.assertEqual(response.json()['status'], 'success')
+        self.assertEqual(len(callbacks), 1)
+        self.assertFalse(DuplicateFaceMatch.objects.exists())
+
+    def test_scan_records_near_duplicates_in_blocks(self):
+        profile = self.newcomer.mfaprofile
+        profile.face_data = encode_descriptor(self.face)
+        profile.save()
+        with self.assertLogs('mfa.duplicates', 'WARNING') as logs:
+            matches = scan_enrollment(self.newcomer.pk, block_size=2)
+        self.assertEqual(logs.output, [
+            f'WARNING:mfa.duplicates:Face enrolled by user {self.newcomer.pk} matches 2 other account(s)'
+        ])
+        self.assertEqual([user_id for user_id, _ in matches], [self.users[0].pk, self.users[1].pk])
+        recorded = DuplicateFaceMatch.objects.filter(user=self.newcomer).order_by('distance')
+        self.assertEqual([match.matched_user_id for match in recorded], [self.users[0].pk, self.users[1].pk])
+        self.assertFalse(MFAProfile.objects.get(user=self.newcomer).face_flagged)
+
+        # Scanning again refreshes the records instead of adding more
+        with override_settings(FACE_DUPLICATE_FLAG_ACCOUNTS=True), self.assertLogs('mfa.duplicates', 'WARNING'):
+            scan_enrollment(self.newcomer.pk)
+        self.assertEqual(DuplicateFaceMatch.objects.count(), 2)
+        self.assertTrue(MFAProfile.objects.get(user=self.newcomer).face_flagged)
+
+        self.users[0].delete()
+        self.assertEqual(list(DuplicateFaceMatch.objects.values_list('matched_user_id', flat=True)), [self.users[1].pk])
+
+    def test_rescan_replaces_unreviewed_matches(self):
+        profile = self.newcomer.mfaprofile
+        profile.face_data = encode_descriptor(self.face)
+        profile.save()
+        with self.assertLogs('mfa.duplicates', 'WARNING'):
+            scan_enrollment(self.newcomer.pk)
+        DuplicateFaceMatch.objects.filter(matched_user=self.users[0]).update(reviewed=True)
+
+        # Re-enrolling as the third account's face leaves the first one's review in place
+        profile.face_data = MFAProfile.objects.get(user=self.users[2]).face_data
+        profile.save()
+        with self.assertLogs('mfa.duplicates', 'WARNING') as logs:
+            scan_enrollment(self.newcomer.pk)
+        self.assertIn('matches 1 other account(s)', logs.output[0])
+        recorded = DuplicateFaceMatch.objects.filter(user=self.newcomer)
+        self.assertEqual(
+            set(recorded.values_list('matched_user_id', 'reviewed')), {(self.users[0].pk, True), (self.users[2].pk, False)}
+        )
+
+    def test_scan_without_face_does_nothing(self):
+        self.assertEqual(scan_enrollment(self.newcomer.pk), [])
+        self.assertFalse(DuplicateFaceMatch.objects.exists())
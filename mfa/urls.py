@@ -1,8 +1,12 @@
+from django.conf import settings
 from django.urls import path
 
+from mfa import async_views
+from mfa.face_models import serve_face_model
 from mfa.views import *
 
 urlpatterns = [
     path('setup/fingerprint', setup_fingerprint, name='setup-fingerprint'),
-    path('setup/face-id', setup_face, name='setup-face' ),
-]
\ No newline at end of file
+    path('setup/face-id', async_views.setup_face if settings.ASYNC_LOGIN_VIEWS else setup_face, name='setup-face' ),
+    path('face-models/<str:name>', serve_face_model, name='face-model'),
+]
@@ -1,12 +1,16 @@
 import json
 import numpy as np
-import struct
 
+from django.conf import settings
 from django.shortcuts import render
 from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_protect, csrf_exempt
 
+from accounts.metrics import time_phase
+from audit.pipeline import record_event
+from mfa.codec import decode_descriptor, encode_descriptor
+from mfa.duplicates import schedule_duplicate_scan
 from mfa.models import MFAProfile
 
 
@@ -20,15 +24,22 @@ def setup_fingerprint(request):
 
             if status == 'success':
 
-                mfa_profile, created = MFAProfile.objects.get_or_create(user=request.user)
+                mfa_profile, created = MFAProfile.objects.for_user(request.user).defer(
+                    'face_data', 'fingerprint_data'
+                ).get_or_create(user=request.user)
                 mfa_profile.fingerprint_enabled = True
                 mfa_profile.save()
+                record_event('fingerprint_enrollment', 'success', request=request, user=request.user)
 
                 return JsonResponse({
                     'status': 'success',
                     'message': 'Fingerprint setup completed successfully'
                 })
             else:
+                record_event(
+                    'fingerprint_enrollment', 'failure', request=request, user=request.user,
+                    message=data.get('message', '')
+                )
                 return JsonResponse({
                     'status': 'error',
                     'message': data.get('message', 'Fingerprint setup failed')
@@ -64,15 +75,23 @@ def setup_face(request):
                     "message": "No facial data received."
                 }, status=400)            
             try:
-                binary_data = struct.pack('f' * len(facial_data), *facial_data)
+                with time_phase('setup-face', 'descriptor_encode'):
+                    binary_data = encode_descriptor(facial_data, dtype=settings.FACE_DESCRIPTOR_STORAGE_DTYPE)
             except Exception as e:
+                record_event('face_enrollment', 'failure', request=request, user=request.user, message=str(e))
                 return JsonResponse({
                     "message": f"Invalid facial data format: {str(e)}"
                 }, status=400)
             
-            mfa_profile, created = MFAProfile.objects.get_or_create(user=request.user)
-            mfa_profile.face_data = binary_data
-            mfa_profile.save()
+            with time_phase('setup-face', 'storage'):
+                # The fingerprint blob is neither read nor rewritten
+                mfa_profile, created = MFAProfile.objects.for_user(request.user).defer(
+                    'fingerprint_data'
+                ).get_or_create(user=request.user)
+                mfa_profile.face_data = binary_data
+                mfa_profile.save()
+            schedule_duplicate_scan(mfa_profile)
+            record_event('face_enrollment', 'success', request=request, user=request.user)
             
             return JsonResponse({
                 "message": "Face ID successfully enrolled.",
@@ -90,15 +109,10 @@ def setup_face(request):
     
     return render(request, 'mfa/setup-face.html')
 
-def convert_binary_to_array(binary_data):
-    float_count = len(binary_data) // struct.calcsize('f')
-    return struct.unpack('f' * float_count, binary_data)
-
 def verify_face(stored_face_data, new_face_descriptor):
     if stored_face_data:
-        stored_descriptor = convert_binary_to_array(stored_face_data)        
-        stored_array = np.array(stored_descriptor)
-        new_array = np.array(new_face_descriptor)        
+        stored_array = decode_descriptor(stored_face_data)
+        new_array = np.asarray(new_face_descriptor, dtype=np.float32)
         distance = np.linalg.norm(stored_array - new_array)        
         return distance < 0.6
     